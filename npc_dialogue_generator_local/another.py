@@ -2,15 +2,19 @@
 import datetime
 import json
 import os
-import re
-import requests
+from contextlib import asynccontextmanager
 from typing import List, Literal, Dict, Any, Union
+
+import httpx
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, status, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 from routers import auth
 
+from llm.backends import build_backend, close_shared_http_client
+from llm.postprocess import clean_dialogue_text
+
 
 # --- Pydantic Models for API Requests/Responses ---
 class Character(BaseModel):
@@ -34,16 +38,23 @@ class DialogueResponse(BaseModel):
 
 load_dotenv()
 # --- LLM Connection & Configuration ---
-COLAB_LLM_API_URL = os.getenv("COLAB_LLM_API_URL")
-COLAB_LLM_MODEL_NAME = "Zephyr-7B-Beta (via Colab)"
-
-if not COLAB_LLM_API_URL:
-    raise HTTPException(status_code=500, detail="COLAB_LLM_API_URL is not set in .env")
+# Needs COLAB_LLM_API_URL in .env
+backend = build_backend("colab")
+COLAB_LLM_MODEL_NAME = backend.model
+LLM_TEMPERATURE = 0.8
 MONGODB_URL = os.getenv("MONGODB_URL")
 SECRET_KEY = os.getenv("SECRET_KEY")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await backend.start()
+    yield
+    await backend.close()
+    await close_shared_http_client()
+
+
 # --- FastAPI App Initialization & CORS ---
-app = FastAPI(title="NPC Dialogue API")
+app = FastAPI(title="NPC Dialogue API", lifespan=lifespan)
 
 origins = ["http://localhost:3000"]
 app.add_middleware(
@@ -90,59 +101,12 @@ def create_prompt(data: Dict[str, Any]) -> str:
     return prompt_template
 
 
-def get_colab_response(prompt: str, num_predict: int) -> str:
-    """Sends a request to the Colab LLM API and processes the response."""
-    colab_payload = {
-        "prompt": prompt,
-        "max_new_tokens": num_predict,
-        "temperature": 0.8,
-        "top_p": 0.9,
-        "top_k": 50,
-    }
-    response = requests.post(COLAB_LLM_API_URL, json=colab_payload, timeout=180)
-    response.raise_for_status()
-    colab_result = response.json()
-    # Check if 'generated_text' exists, if not, return an empty string
-    generated_text = colab_result.get("generated_text", "")
+async def get_colab_response(prompt: str, num_predict: int) -> str:
+    """Sends a request to the Colab LLM API through the shared backend."""
+    generated_text = await backend.generate(prompt, num_predict, temperature=LLM_TEMPERATURE)
 
     # Post-processing from Colab LLM's raw output
-    generated_dialogue_cleaned = generated_text.strip()
-    assistant_marker = "<|assistant|>"
-    if assistant_marker in generated_dialogue_cleaned:
-        start_index = generated_dialogue_cleaned.rfind(assistant_marker) + len(
-            assistant_marker
-        )
-        generated_dialogue_cleaned = generated_dialogue_cleaned[start_index:].strip()
-
-    generated_dialogue_cleaned = re.sub(
-        r"\s*\([^()]*\)", "", generated_dialogue_cleaned
-    ).strip()
-    generated_dialogue_cleaned = re.sub(
-        r"(<|system|>|<|user|>|<|assistant|>|Dialogue:)",
-        "",
-        generated_dialogue_cleaned,
-        flags=re.IGNORECASE,
-    ).strip()
-
-    if generated_dialogue_cleaned:
-        last_char = generated_dialogue_cleaned[-1]
-        if last_char not in [".", "?", "!", "…"]:
-            last_punc_index = max(
-                generated_dialogue_cleaned.rfind("."),
-                generated_dialogue_cleaned.rfind("?"),
-                generated_dialogue_cleaned.rfind("!"),
-            )
-            if (
-                last_punc_index != -1
-                and (len(generated_dialogue_cleaned) - (last_punc_index + 1)) < 25
-            ):
-                generated_dialogue_cleaned = generated_dialogue_cleaned[
-                    : last_punc_index + 1
-                ]
-            else:
-                generated_dialogue_cleaned += "..."
-
-    return generated_dialogue_cleaned
+    return clean_dialogue_text(generated_text)
 
 
 # --- API Endpoints ---
@@ -184,46 +148,7 @@ async def generate_dialogue(request: Request):
             )
 
     try:
-        full_response_content = get_colab_response(prompt, llm_num_predict)
-
-        # Post-processing from Colab LLM's raw output
-        generated_dialogue_cleaned = full_response_content.strip()
-        assistant_marker = "<|assistant|>"
-        if assistant_marker in generated_dialogue_cleaned:
-            start_index = generated_dialogue_cleaned.rfind(assistant_marker) + len(
-                assistant_marker
-            )
-            generated_dialogue_cleaned = generated_dialogue_cleaned[
-                start_index:
-            ].strip()
-
-        generated_dialogue_cleaned = re.sub(
-            r"\s*\([^()]*\)", "", generated_dialogue_cleaned
-        ).strip()
-        generated_dialogue_cleaned = re.sub(
-            r"(<|system|>|<|user|>|<|assistant|>|Dialogue:)",
-            "",
-            generated_dialogue_cleaned,
-            flags=re.IGNORECASE,
-        ).strip()
-
-        if generated_dialogue_cleaned:
-            last_char = generated_dialogue_cleaned[-1]
-            if last_char not in [".", "?", "!", "…"]:
-                last_punc_index = max(
-                    generated_dialogue_cleaned.rfind("."),
-                    generated_dialogue_cleaned.rfind("?"),
-                    generated_dialogue_cleaned.rfind("!"),
-                )
-                if (
-                    last_punc_index != -1
-                    and (len(generated_dialogue_cleaned) - (last_punc_index + 1)) < 25
-                ):
-                    generated_dialogue_cleaned = generated_dialogue_cleaned[
-                        : last_punc_index + 1
-                    ]
-                else:
-                    generated_dialogue_cleaned += "..."
+        generated_dialogue_cleaned = await get_colab_response(prompt, llm_num_predict)
 
         timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat() + "Z"
         return DialogueResponse(
@@ -232,7 +157,7 @@ async def generate_dialogue(request: Request):
             timestamp=timestamp,
         )
 
-    except requests.exceptions.RequestException as e:
+    except (httpx.HTTPError, TimeoutError) as e:
         raise HTTPException(
             status_code=503,
             detail=f"Failed to connect to LLM server: {str(e)}. Is your Colab notebook running and Ngrok tunnel active?",
@@ -0,0 +1,30 @@
+# api/responses.py
+import json
+from typing import Any
+
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - stdlib json keeps working, just slower
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    """Compact UTF-8 JSON; orjson when it is installed, stdlib json otherwise."""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    """
+    Renders plain dicts with dumps(). Returning a Response from an endpoint
+    also skips FastAPI's re-validation of the return value against the
+    route's response_model, which then only documents the shape.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
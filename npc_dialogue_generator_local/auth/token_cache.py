@@ -0,0 +1,62 @@
+# auth/token_cache.py
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+
+
+class ApiTokenCache:
+    """
+    TTL + LRU cache of API token → username, with negative caching.
+
+    Unknown tokens are remembered as None for a shorter TTL so repeated bad
+    tokens don't each cost a database lookup. Rotation only invalidates this
+    process; other workers see the change once their entry expires.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, negative_ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries: "OrderedDict[str, Tuple[float, Optional[str]]]" = OrderedDict()
+        self._tokens_by_user: Dict[str, Set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Tuple[bool, Optional[str]]:
+        """Returns (found, username); username is None for a cached invalid token."""
+        entry = self._entries.get(token)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self._remove(token)
+            self.misses += 1
+            return False, None
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return True, entry[1]
+
+    def set(self, token: str, username: Optional[str]):
+        if token in self._entries:
+            self._remove(token)
+        ttl = self.ttl if username is not None else self.negative_ttl
+        self._entries[token] = (time.monotonic() + ttl, username)
+        if username is not None:
+            self._tokens_by_user.setdefault(username, set()).add(token)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def invalidate(self, token: str):
+        if token in self._entries:
+            self._remove(token)
+
+    def invalidate_user(self, username: str):
+        for token in list(self._tokens_by_user.get(username, ())):
+            self._remove(token)
+
+    def _remove(self, token: str):
+        _, username = self._entries.pop(token)
+        if username is not None:
+            tokens = self._tokens_by_user.get(username)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self._tokens_by_user[username]
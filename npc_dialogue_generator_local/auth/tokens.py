@@ -0,0 +1,84 @@
+# auth/tokens.py
+import datetime
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import jwt
+
+
+def parse_signing_keys(raw: Optional[str]) -> Dict[str, str]:
+    """Parses `kid1:secret1,kid2:secret2` into {kid: secret}."""
+    keys = {}
+    for entry in (raw or "").split(","):
+        kid, sep, secret = entry.strip().partition(":")
+        if sep and kid and secret:
+            keys[kid] = secret
+    return keys
+
+
+class TokenVerifier:
+    """
+    Signs and verifies HS256 JWTs against a set of active keys.
+
+    New tokens are signed with the active key and carry its `kid` header;
+    any other configured key still verifies, which lets keys be rotated
+    without logging everyone out. Tokens without a `kid` (issued before
+    rotation existed) are checked against the legacy key.
+
+    Verified claims are cached until the token expires, so a token that is
+    presented on every request is only cryptographically checked once.
+    """
+
+    def __init__(
+        self,
+        keys: Dict[str, str],
+        active_kid: str,
+        legacy_kid: Optional[str] = None,
+        algorithm: str = "HS256",
+        cache_size: int = 10000,
+    ):
+        if active_kid not in keys:
+            raise ValueError(f"Active JWT key id '{active_kid}' is not configured")
+        self.keys = keys
+        self.active_kid = active_kid
+        self.legacy_kid = legacy_kid
+        self.algorithm = algorithm
+        self.cache_size = cache_size
+        self._verified: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+    def encode(self, claims: Dict[str, Any], expires_delta: datetime.timedelta) -> str:
+        to_encode = dict(claims)
+        to_encode["exp"] = datetime.datetime.now(datetime.timezone.utc) + expires_delta
+        return jwt.encode(
+            to_encode,
+            self.keys[self.active_kid],
+            algorithm=self.algorithm,
+            headers={"kid": self.active_kid},
+        )
+
+    def decode(self, token: str) -> Dict[str, Any]:
+        """Returns the token's claims; raises jwt.PyJWTError if it isn't valid."""
+        cached = self._verified.get(token)
+        if cached is not None:
+            if cached[0] > time.time():
+                self._verified.move_to_end(token)
+                return cached[1]
+            del self._verified[token]
+
+        kid = jwt.get_unverified_header(token).get("kid", self.legacy_kid)
+        key = self.keys.get(kid)
+        if key is None:
+            raise jwt.InvalidKeyError(f"Unknown signing key id: {kid}")
+
+        claims = jwt.decode(token, key, algorithms=[self.algorithm])
+        expires_at = claims.get("exp")
+        if expires_at is not None:
+            self._verified[token] = (float(expires_at), claims)
+            while len(self._verified) > self.cache_size:
+                self._verified.popitem(last=False)
+        return claims
+
+
+def looks_like_jwt(token: str) -> bool:
+    return token.count(".") == 2
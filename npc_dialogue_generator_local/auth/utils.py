@@ -1,29 +1,53 @@
 # auth/utils.py
+import asyncio
 import datetime
 import jwt
+from concurrent.futures import ThreadPoolExecutor
 from passlib.context import CryptContext
-from typing import Union
+from typing import Optional, Tuple, Union
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer, HTTPBearer, HTTPAuthorizationCredentials
 from schemas.user import TokenData
-from motor.motor_asyncio import AsyncIOMotorClient
+from auth.token_cache import ApiTokenCache
+from auth.tokens import TokenVerifier, looks_like_jwt, parse_signing_keys
+from db.mongo import users_collection
+from metrics.instruments import stage_seconds
 import os
 
-SECRET_KEY = "your-super-secret-key-replace-me-with-a-long-random-string"
+SECRET_KEY = os.getenv("SECRET_KEY", "your-super-secret-key-replace-me-with-a-long-random-string")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+API_JWT_EXPIRE_DAYS = int(os.getenv("API_JWT_EXPIRE_DAYS", "30"))
+
+# --- JWT signing keys ---
+# JWT_SIGNING_KEYS="kid1:secret1,kid2:secret2" adds keys for rotation and
+# JWT_ACTIVE_KID picks the one new tokens are signed with. SECRET_KEY stays
+# available as "default" so tokens issued without a kid keep verifying.
+JWT_SIGNING_KEYS = {"default": SECRET_KEY, **parse_signing_keys(os.getenv("JWT_SIGNING_KEYS"))}
+JWT_ACTIVE_KID = os.getenv("JWT_ACTIVE_KID", "default")
+token_verifier = TokenVerifier(
+    JWT_SIGNING_KEYS, JWT_ACTIVE_KID, legacy_kid="default", algorithm=ALGORITHM
+)
+
+# --- Password hashing ---
+# Raising BCRYPT_ROUNDS transparently rehashes existing users on their next login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+# bcrypt releases the GIL, so a small dedicated thread pool keeps hashing
+# off the event loop without letting a login burst take every core
+password_executor = ThreadPoolExecutor(
+    max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash"
+)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 http_bearer = HTTPBearer()
 
-# --- Database Connection for API Token validation ---
-MONGODB_URL = os.getenv("MONGODB_URL")
-MONGODB_DB_NAME = "npc_forge_db"
-MONGODB_COLLECTION_NAME = "users"
-client = AsyncIOMotorClient(MONGODB_URL, tls=True, tlsAllowInvalidCertificates=True)
-database = client[MONGODB_DB_NAME]
-users_collection = database[MONGODB_COLLECTION_NAME]
-
+# --- API token cache (token → username) ---
+api_token_cache = ApiTokenCache(
+    max_entries=int(os.getenv("API_TOKEN_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("API_TOKEN_CACHE_TTL", "60")),
+    negative_ttl=float(os.getenv("API_TOKEN_CACHE_NEGATIVE_TTL", "10")),
+)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     # Bcrypt has a 72-byte limit. Truncate if necessary to match hashing
@@ -37,19 +61,36 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(truncated_password)
 
 
+def verify_and_update_password(
+    plain_password: str, hashed_password: str
+) -> Tuple[bool, Optional[str]]:
+    """Verifies the password and returns a new hash if the stored one is outdated."""
+    truncated_password = plain_password[:72]
+    return pwd_context.verify_and_update(truncated_password, hashed_password)
+
+
+async def verify_password_async(
+    plain_password: str, hashed_password: str
+) -> Tuple[bool, Optional[str]]:
+    loop = asyncio.get_running_loop()
+    with stage_seconds.labels("password_hash").time():
+        return await loop.run_in_executor(
+            password_executor, verify_and_update_password, plain_password, hashed_password
+        )
+
+
+async def get_password_hash_async(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    with stage_seconds.labels("password_hash").time():
+        return await loop.run_in_executor(password_executor, get_password_hash, password)
+
+
 def create_access_token(
     data: dict, expires_delta: Union[datetime.timedelta, None] = None
 ):
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.datetime.now(datetime.timezone.utc) + expires_delta
-    else:
-        expire = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
-            minutes=ACCESS_TOKEN_EXPIRE_MINUTES
-        )
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+    if not expires_delta:
+        expires_delta = datetime.timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    return token_verifier.encode(data, expires_delta)
 
 
 async def get_current_user_username(token: str = Depends(oauth2_scheme)):
@@ -59,9 +100,10 @@ async def get_current_user_username(token: str = Depends(oauth2_scheme)):
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = token_verifier.decode(token)
         username: str = payload.get("sub")
-        if username is None:
+        # Long-lived API tokens can't act as a login session (e.g. to mint more of themselves)
+        if username is None or payload.get("scope") == "api":
             raise credentials_exception
         token_data = TokenData(username=username)
     except jwt.PyJWTError:
@@ -73,6 +115,10 @@ async def get_current_user_by_api_token(credentials: HTTPAuthorizationCredential
     """
     Validates API token from Authorization: Bearer <api_token> header.
     Returns username if valid, raises HTTPException if invalid.
+
+    A signed JWT is accepted in place of an opaque API token and is verified
+    without touching the database; it must carry the "api" scope, so a login
+    (session) token can't be used as one.
     """
     api_token = credentials.credentials
     
@@ -83,14 +129,30 @@ async def get_current_user_by_api_token(credentials: HTTPAuthorizationCredential
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    # Look up user by API token in database
-    user_doc = await users_collection.find_one({"api_token": api_token})
-    
-    if not user_doc:
+    if looks_like_jwt(api_token):
+        try:
+            claims = token_verifier.decode(api_token)
+        except jwt.PyJWTError:
+            claims = {}
+        username = claims.get("sub") if claims.get("scope") == "api" else None
+        found = True
+    else:
+        found, username = api_token_cache.get(api_token)
+
+    if not found:
+        # Look up user by API token in database
+        with stage_seconds.labels("auth_lookup").time():
+            user_doc = await users_collection.find_one(
+                {"api_token": api_token}, projection={"username": 1}
+            )
+        username = user_doc.get("username") if user_doc else None
+        api_token_cache.set(api_token, username)
+
+    if not username:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid API token",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    
-    return user_doc.get("username")
+
+    return username
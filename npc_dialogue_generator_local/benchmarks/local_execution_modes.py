@@ -0,0 +1,101 @@
+# benchmarks/local_execution_modes.py
+"""
+Compares local execution modes (fp32 / int8 / bf16 / onnx) on latency and
+agreement with fp32.
+
+    python -m benchmarks.local_execution_modes --modes fp32 int8 bf16
+
+Each mode generates greedily from the same prompts. fp32 always runs first
+as the reference, whether or not it was asked for. Agreement is the share
+of generated tokens that match the fp32 output up to the first divergence,
+so 1.0 means identical text. A mode this CPU can't run is reported as the
+mode that ran instead (bf16 -> fp32).
+"""
+import argparse
+import os
+import time
+
+import torch
+
+from llm.local_model import EXECUTION_MODES, load_local_model, resolve_execution_mode
+
+PROMPTS = [
+    "<|system|>\nYou generate dialogue for video game NPCs. Only plain spoken lines.\n</s>\n"
+    "<|user|>\nContext: A blacksmith haggles with a knight over a cracked sword.\n\n"
+    "Characters:\n- Name: Brann, Personality: gruff, Occupation: blacksmith, Relationship: merchant\n"
+    "- Name: Elise, Personality: proud, Occupation: knight, Relationship: customer\n\n"
+    "Dialogue:\n</s>\n<|assistant|>",
+    "<|system|>\nYou generate dialogue for video game NPCs. Only plain spoken lines.\n</s>\n"
+    "<|user|>\nContext: Two smugglers argue in a storm-soaked harbour tavern.\n\n"
+    "Characters:\n- Name: Kess, Personality: nervous, Occupation: smuggler, Relationship: partner of Dorn\n"
+    "- Name: Dorn, Personality: calm, Occupation: smuggler, Relationship: partner of Kess\n\n"
+    "Dialogue:\n</s>\n<|assistant|>",
+]
+
+
+def generate(model, tokenizer, prompt: str, max_new_tokens: int):
+    inputs = tokenizer(prompt, return_tensors="pt")
+    with torch.no_grad():
+        output = model.generate(
+            **inputs,
+            max_new_tokens=max_new_tokens,
+            do_sample=False,
+            pad_token_id=tokenizer.eos_token_id,
+        )
+    return output[0][inputs["input_ids"].shape[1]:].tolist()
+
+
+def agreement(reference, candidate) -> float:
+    matched = 0
+    for a, b in zip(reference, candidate):
+        if a != b:
+            break
+        matched += 1
+    return matched / len(reference) if reference else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--model", default=os.getenv("MODEL_NAME", "TinyLlama/TinyLlama-1.1B-Chat-v1.0"))
+    parser.add_argument("--modes", nargs="+", default=["fp32", "int8", "bf16"], choices=EXECUTION_MODES)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    threads = torch.get_num_threads()
+    reference = None
+    rows = []
+    modes = ["fp32"] + [mode for mode in args.modes if mode != "fp32"]
+    for mode in modes:
+        started = time.perf_counter()
+        model, tokenizer = load_local_model(args.model, mode)
+        load_seconds = time.perf_counter() - started
+
+        generate(model, tokenizer, PROMPTS[0], 4)  # warm-up
+
+        outputs, tokens, elapsed = [], 0, 0.0
+        for _ in range(args.runs):
+            for prompt in PROMPTS:
+                started = time.perf_counter()
+                ids = generate(model, tokenizer, prompt, args.max_new_tokens)
+                elapsed += time.perf_counter() - started
+                tokens += len(ids)
+                outputs.append(ids)
+
+        if reference is None:
+            reference = outputs
+        score = sum(agreement(r, o) for r, o in zip(reference, outputs)) / len(outputs)
+        tokens_per_second = tokens / elapsed if elapsed else 0.0
+        ran = resolve_execution_mode(mode)
+        label = mode if ran == mode else f"{mode}->{ran}"
+        rows.append((label, load_seconds, tokens_per_second, tokens_per_second / threads, score))
+        del model
+
+    print(f"model={args.model} threads={threads} reference=fp32")
+    print(f"{'mode':<10} {'load s':>8} {'tok/s':>8} {'tok/s/core':>11} {'agreement':>10}")
+    for label, load_seconds, tps, tps_core, score in rows:
+        print(f"{label:<10} {load_seconds:>8.1f} {tps:>8.1f} {tps_core:>11.2f} {score:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
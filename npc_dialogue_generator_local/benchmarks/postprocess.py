@@ -0,0 +1,102 @@
+# benchmarks/postprocess.py
+"""
+Measures dialogue post-processing cost per KB of raw model output.
+
+    python -m benchmarks.postprocess --kb 1 16 64
+
+Compares the old inline cleanup (regexes compiled per call, one pass per
+step) with llm.postprocess on whole strings and on a stream fed in small
+chunks, as the streaming endpoints do.
+"""
+import argparse
+import random
+import re
+import timeit
+
+from llm.postprocess import DialogueLineParser, clean_dialogue_text, parse_dialogue_lines
+
+SPEAKERS = ["Brann", "Elise", "Kess", "Dorn"]
+WORDS = "the a sword storm harbour coin debt blade tavern night you I never always why".split()
+
+
+def raw_output(kb: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    lines = ["<|system|> rules </s> <|user|> context </s> <|assistant|>", "Dialogue:"]
+    size = 0
+    while size < kb * 1024:
+        words = " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 16)))
+        action = " (leans closer)" if rng.random() < 0.2 else ""
+        line = f"{rng.choice(SPEAKERS)}:{action} {words.capitalize()}{rng.choice('.?!')}"
+        lines.append(line)
+        size += len(line) + 1
+    return "\n".join(lines) + "\nBrann: And one more thing"
+
+
+def legacy_clean(text: str) -> str:
+    cleaned = text.strip()
+    marker = "<|assistant|>"
+    if marker in cleaned:
+        cleaned = cleaned[cleaned.rfind(marker) + len(marker):].strip()
+    cleaned = re.sub(r"\s*\([^()]*\)", "", cleaned).strip()
+    cleaned = re.sub(
+        r"(<\|system\|>|</s>|<\|user\|>|<\|assistant\|>|Dialogue:)",
+        "",
+        cleaned,
+        flags=re.IGNORECASE,
+    ).strip()
+    if cleaned and cleaned[-1] not in [".", "?", "!", "…"]:
+        last = max(cleaned.rfind("."), cleaned.rfind("?"), cleaned.rfind("!"))
+        if last != -1 and (len(cleaned) - (last + 1)) < 25:
+            cleaned = cleaned[: last + 1]
+        else:
+            cleaned += "..."
+    return cleaned
+
+
+def legacy_lines(text: str):
+    lines = []
+    for line in legacy_clean(text).split("\n"):
+        if ":" in line:
+            name, spoken = line.split(":", 1)
+            if name.strip() and spoken.strip():
+                lines.append((name.strip(), spoken.strip()))
+    return lines
+
+
+def streamed(text: str, chunk_size: int):
+    parser = DialogueLineParser()
+    lines = []
+    for i in range(0, len(text), chunk_size):
+        lines.extend(parser.feed(text[i:i + chunk_size]))
+    lines.extend(parser.flush())
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--kb", nargs="+", type=int, default=[1, 16, 64])
+    parser.add_argument("--chunk-size", type=int, default=16, help="stream chunk size in chars")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    cases = [
+        ("legacy clean", legacy_clean),
+        ("clean_dialogue_text", clean_dialogue_text),
+        ("legacy clean+split", legacy_lines),
+        ("parse_dialogue_lines", parse_dialogue_lines),
+        (f"stream ({args.chunk_size} ch)", lambda text: streamed(text, args.chunk_size)),
+    ]
+
+    print(f"{'case':<22} " + " ".join(f"{f'{kb} KB':>12}" for kb in args.kb) + "   (µs per KB)")
+    texts = {kb: raw_output(kb) for kb in args.kb}
+    for name, fn in cases:
+        row = []
+        for kb, text in texts.items():
+            number = max(1, 2000 // kb)
+            best = min(timeit.repeat(lambda: fn(text), number=number, repeat=args.repeat))
+            row.append(best / number / (len(text) / 1024) * 1e6)
+        print(f"{name:<22} " + " ".join(f"{v:>12.1f}" for v in row))
+
+
+if __name__ == "__main__":
+    main()
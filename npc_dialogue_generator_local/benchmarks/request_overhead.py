@@ -0,0 +1,159 @@
+# benchmarks/request_overhead.py
+"""
+Measures the per-request CPU cost /generate_dialogue adds around generation.
+
+    python -m benchmarks.request_overhead --characters 2 8 32
+
+Two minimal apps return the same canned dialogue, so only the request
+handling differs. "legacy" is the old shape: request.json(), then
+DialogueRequest(**data), a stdlib-json cache key, then .dict() for
+create_prompt, with a DialogueResponse model that FastAPI re-validates and
+serializes through response_model. "typed" is the current path: the body
+goes straight into DialogueRequest.model_validate_json, llm.cache.cache_key,
+create_prompt reads the model, and the result dict is rendered by
+FastJSONResponse. Requests go straight to the ASGI app, with no sockets.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import time
+import warnings
+
+from fastapi import Depends, FastAPI, Request
+
+from api.responses import FastJSONResponse, orjson
+from llm.cache import cache_key
+from main import (
+    DialogueRequest,
+    DialogueResponse,
+    LLM_MODEL_NAME,
+    create_prompt,
+    dialogue_request_body,
+    dialogue_result,
+)
+
+DIALOGUE = "\n".join(
+    f"{name}: The storm will not wait for us, and neither will the harbour master."
+    for name in ["Kess", "Dorn"] * 24
+)
+
+
+def legacy_normalize(value):
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, dict):
+        return {k: legacy_normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [legacy_normalize(v) for v in value]
+    return value
+
+
+def legacy_cache_key(request_data, model, params) -> str:
+    canonical = json.dumps(
+        {"request": legacy_normalize(request_data), "model": model, "params": params},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def request_body(characters: int) -> bytes:
+    return json.dumps({
+        "context": "Two smugglers argue in a storm-soaked harbour tavern about a missing cargo.",
+        "characters": [
+            {
+                "name": f"Smuggler{i}",
+                "personality": "nervous, quick to anger, loyal to a fault",
+                "occupation": "smuggler",
+                "relationship": "partner of the others",
+            }
+            for i in range(characters)
+        ],
+        "dialogue_length": "Medium",
+    }).encode()
+
+
+def build_apps():
+    legacy = FastAPI()
+    typed = FastAPI()
+
+    @legacy.post("/generate_dialogue", response_model=DialogueResponse)
+    async def legacy_endpoint(request: Request):
+        data = await request.json()
+        dialogue_request = DialogueRequest(**data)
+        legacy_cache_key(dialogue_request.dict(exclude={"cache"}), LLM_MODEL_NAME, {})
+        dialogue_request.dict()  # the copy create_prompt used to be handed
+        create_prompt(dialogue_request)
+        return DialogueResponse(generated_dialogue=DIALOGUE, model_used=LLM_MODEL_NAME, timestamp="now")
+
+    @typed.post("/generate_dialogue", response_model=DialogueResponse)
+    async def typed_endpoint(dialogue_request: DialogueRequest = Depends(dialogue_request_body)):
+        cache_key(dialogue_request.model_dump(exclude={"cache"}), LLM_MODEL_NAME, {})
+        create_prompt(dialogue_request)
+        return FastJSONResponse(dialogue_result(DIALOGUE))
+
+    return {"legacy": legacy, "typed": typed}
+
+
+async def call(app, body: bytes) -> int:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": "/generate_dialogue",
+        "raw_path": b"/generate_dialogue", "query_string": b"", "root_path": "",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 0), "server": ("bench", 80),
+    }
+    status = 0
+    received = False
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+
+async def per_request_us(app, body: bytes, number: int, repeat: int) -> float:
+    assert await call(app, body) == 200
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            await call(app, body)
+        best = min(best, time.perf_counter() - started)
+    return best / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--characters", nargs="+", type=int, default=[2, 8, 32])
+    parser.add_argument("--number", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    warnings.simplefilter("ignore", DeprecationWarning)
+
+    apps = build_apps()
+    bodies = {n: request_body(n) for n in args.characters}
+    print(f"serializer: {'orjson' if orjson is not None else 'json (orjson not installed)'}")
+    print(f"{'app':<8} " + " ".join(f"{f'{n} chars':>10}" for n in args.characters) + "   (µs per request)")
+    for name, app in apps.items():
+        row = [
+            asyncio.run(per_request_us(app, body, args.number, args.repeat))
+            for body in bodies.values()
+        ]
+        print(f"{name:<8} " + " ".join(f"{v:>10.1f}" for v in row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# db/mongo.py
+import os
+import threading
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+from pymongo.errors import PyMongoError
+
+load_dotenv()
+
+# --- Database Connection ---
+MONGODB_URL = os.getenv("MONGODB_URL")
+MONGODB_DB_NAME = "npc_forge_db"
+MONGODB_USERS_COLLECTION = "users"
+MONGODB_JOBS_COLLECTION = "jobs"
+
+# --- Pool & timeout tuning ---
+MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", "50"))
+MONGODB_MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", "2"))
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGODB_CONNECT_TIMEOUT_MS = int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", "5000"))
+MONGODB_SOCKET_TIMEOUT_MS = int(os.getenv("MONGODB_SOCKET_TIMEOUT_MS", "10000"))
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Connection pool counters, fed by pymongo's monitoring events."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+        self.checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.pool_clears = 0
+
+    def _add(self, field: str, delta: int):
+        # Events fire from pymongo's background threads as well as the loop thread
+        with self._lock:
+            setattr(self, field, getattr(self, field) + delta)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._add("pool_clears", 1)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._add("open", 1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._add("open", -1)
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._add("checkout_failures", 1)
+
+    def connection_checked_out(self, event):
+        self._add("checked_out", 1)
+        self._add("checkouts", 1)
+
+    def connection_checked_in(self, event):
+        self._add("checked_out", -1)
+
+    def snapshot(self):
+        return {
+            "max_pool_size": MONGODB_MAX_POOL_SIZE,
+            "min_pool_size": MONGODB_MIN_POOL_SIZE,
+            "open_connections": self.open,
+            "checked_out": self.checked_out,
+            "utilization": self.checked_out / MONGODB_MAX_POOL_SIZE if MONGODB_MAX_POOL_SIZE else 0.0,
+            "checkouts": self.checkouts,
+            "checkout_failures": self.checkout_failures,
+            "pool_clears": self.pool_clears,
+        }
+
+
+pool_metrics = PoolMetrics()
+
+# One client (and so one connection pool) per worker process, shared by
+# every module that talks to Mongo. Motor connects lazily on first use.
+client = AsyncIOMotorClient(
+    MONGODB_URL,
+    tls=True,
+    tlsAllowInvalidCertificates=True,
+    maxPoolSize=MONGODB_MAX_POOL_SIZE,
+    minPoolSize=MONGODB_MIN_POOL_SIZE,
+    serverSelectionTimeoutMS=MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+    connectTimeoutMS=MONGODB_CONNECT_TIMEOUT_MS,
+    socketTimeoutMS=MONGODB_SOCKET_TIMEOUT_MS,
+    event_listeners=[pool_metrics],
+)
+database = client[MONGODB_DB_NAME]
+users_collection = database[MONGODB_USERS_COLLECTION]
+jobs_collection = database[MONGODB_JOBS_COLLECTION]
+
+
+async def ensure_indexes():
+    """Keeps token/username lookups and stale-job scans on an index instead of a collection scan."""
+    try:
+        await users_collection.create_index("username")
+        await users_collection.create_index("api_token", sparse=True)
+        await jobs_collection.create_index([("status", 1), ("heartbeat_at", 1)])
+    except PyMongoError as e:
+        print(f"Could not ensure indexes: {e}")
+
+
+def close():
+    client.close()
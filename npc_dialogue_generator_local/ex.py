@@ -2,14 +2,17 @@
 import datetime
 import json
 import os
-import re
-import requests
+from contextlib import asynccontextmanager
 from typing import List, Literal, Dict, Any, Union
 
+import httpx
 from fastapi import FastAPI, HTTPException, status, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 
+from llm.backends import build_backend, close_shared_http_client
+from llm.postprocess import clean_dialogue_text
+
 
 # --- Pydantic Models for API Requests/Responses ---
 class Character(BaseModel):
@@ -33,23 +36,24 @@ class DialogueResponse(BaseModel):
 
 # --- LLM Connection & Configuration ---
 # <<--- IMPORTANT: CHOOSE YOUR LLM SETUP --->>
-# Option 1: For local Ollama setup
-# OLLAMA_API_URL = "http://localhost:11434/api/generate"
-# OLLAMA_MODEL_NAME = "zephyr"
-# LLM_API_URL = OLLAMA_API_URL
-# LLM_MODEL_NAME = OLLAMA_MODEL_NAME
+# Option 1 (default): local Ollama, set by OLLAMA_API_URL / OLLAMA_MODEL_NAME
+# Option 2: Colab + Ngrok, with LLM_BACKEND=colab and COLAB_LLM_API_URL copied
+# from your running Colab notebook
+backend = build_backend(os.getenv("LLM_BACKEND", "ollama"))
+LLM_MODEL_NAME = backend.model
+LLM_TEMPERATURE = 0.8
+
 
-# Option 2: For Colab + Ngrok setup
-# You must copy this from your running Colab notebook!
-# LLM_API_URL = "https://your-ngrok-url-here.ngrok-free.app/generate"
-# LLM_MODEL_NAME = "Zephyr-7B-Beta (via Colab)"
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await backend.start()
+    yield
+    await backend.close()
+    await close_shared_http_client()
 
-# Default to Ollama for local setup
-LLM_API_URL = "http://localhost:11434/api/generate"
-LLM_MODEL_NAME = "zephyr"
 
 # --- FastAPI App Initialization & CORS ---
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 origins = ["http://localhost:3000"]
 app.add_middleware(
@@ -98,30 +102,9 @@ def create_prompt(request: Union[DialogueRequest, Dict[str, Any]]) -> str:
     return prompt_template
 
 
-def get_llm_response(prompt: str, num_predict: int) -> str:
-    """Sends a request to the LLM API and processes the streamed response."""
-    payload = {
-        "model": LLM_MODEL_NAME,
-        "prompt": prompt,
-        "options": {
-            "num_predict": num_predict,
-            "temperature": 0.8,
-            "top_p": 0.9,
-            "top_k": 50,
-            "stop": ["</s>", "<|user|>", "<|system|>", "<|assistant|>"],
-        },
-    }
-    response = requests.post(LLM_API_URL, json=payload, stream=True, timeout=300)
-    response.raise_for_status()
-    full_response_content = ""
-    for chunk in response.iter_content(chunk_size=None):
-        if chunk:
-            try:
-                json_chunk = json.loads(chunk.decode("utf-8"))
-                full_response_content += json_chunk.get("response", "")
-            except json.JSONDecodeError:
-                full_response_content += chunk.decode("utf-8")
-    return full_response_content
+async def get_llm_response(prompt: str, num_predict: int) -> str:
+    """Generates a response through the shared LLM backend (timeouts, retries, pooling)."""
+    return await backend.generate(prompt, num_predict, temperature=LLM_TEMPERATURE)
 
 
 # --- API Endpoints ---
@@ -164,36 +147,9 @@ async def generate_dialogue(request: Request):
             )
 
     try:
-        full_response_content = get_llm_response(prompt, llm_num_predict)
-
-        generated_dialogue_cleaned = full_response_content.strip()
-        generated_dialogue_cleaned = re.sub(
-            r"\s*\([^()]*\)", "", generated_dialogue_cleaned
-        ).strip()
-        generated_dialogue_cleaned = re.sub(
-            r"(<|system|>|<|user|>|<|assistant|>|Dialogue:)",
-            "",
-            generated_dialogue_cleaned,
-            flags=re.IGNORECASE,
-        ).strip()
-
-        if generated_dialogue_cleaned:
-            last_char = generated_dialogue_cleaned[-1]
-            if last_char not in [".", "?", "!", "…"]:
-                last_punc_index = max(
-                    generated_dialogue_cleaned.rfind("."),
-                    generated_dialogue_cleaned.rfind("?"),
-                    generated_dialogue_cleaned.rfind("!"),
-                )
-                if (
-                    last_punc_index != -1
-                    and (len(generated_dialogue_cleaned) - (last_punc_index + 1)) < 25
-                ):
-                    generated_dialogue_cleaned = generated_dialogue_cleaned[
-                        : last_punc_index + 1
-                    ]
-                else:
-                    generated_dialogue_cleaned += "..."
+        full_response_content = await get_llm_response(prompt, llm_num_predict)
+
+        generated_dialogue_cleaned = clean_dialogue_text(full_response_content)
 
         timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat() + "Z"
         return DialogueResponse(
@@ -202,7 +158,7 @@ async def generate_dialogue(request: Request):
             timestamp=timestamp,
         )
 
-    except requests.exceptions.RequestException as e:
+    except (httpx.HTTPError, TimeoutError) as e:
         raise HTTPException(
             status_code=503,
             detail=f"Failed to connect to LLM server: {str(e)}. Is your LLM service running (`ollama serve` or Colab) and have you pulled the '{LLM_MODEL_NAME}' model?",
@@ -0,0 +1,175 @@
+# jobs/queue.py
+import asyncio
+import datetime
+import itertools
+import logging
+import os
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Literal, Optional
+
+from jobs.store import Job, JobStore
+
+logger = logging.getLogger(__name__)
+
+Priority = Literal["high", "normal", "low"]
+PRIORITY_ORDER = {"high": 0, "normal": 1, "low": 2}
+
+# How often a queue marks its unfinished jobs alive in a shared store; jobs
+# missing JOB_STALE_HEARTBEATS beats in a row are taken over by another queue
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "30"))
+JOB_STALE_HEARTBEATS = 3
+
+
+class QueueFullError(Exception):
+    pass
+
+
+def _now() -> str:
+    return datetime.datetime.utcnow().isoformat() + "Z"
+
+
+class JobQueue:
+    """
+    Bounded priority queue drained by a fixed pool of background workers.
+
+    `runner` receives the stored request payload and returns the job result.
+    Higher-priority jobs are picked first and jobs of equal priority run in
+    submission order. submit() raises QueueFullError once max_queued jobs are
+    waiting, or max_queued_per_key for the submitting key, so callers can push
+    back instead of queueing without limit and one caller can't fill the queue.
+
+    With a shared store each queue heartbeats the jobs it owns. Jobs left
+    queued or running by a process that was restarted or died stop getting
+    heartbeats, and the next queue to notice requeues them and runs them.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        runner: Callable[[Dict[str, Any]], Awaitable[Any]],
+        workers: int,
+        max_queued: int,
+        max_queued_per_key: Optional[int] = None,
+        heartbeat_seconds: float = JOB_HEARTBEAT_SECONDS,
+    ):
+        self.store = store
+        self.runner = runner
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_queued_per_key = max_queued_per_key
+        self._queued_by_key: Dict[str, int] = {}
+        self.heartbeat_seconds = heartbeat_seconds
+        self.owner = uuid.uuid4().hex
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._sequence = itertools.count()
+        self._tasks: List[asyncio.Task] = []
+        self.running = 0
+        self.counts = {"submitted": 0, "rejected": 0, "succeeded": 0, "failed": 0, "recovered": 0}
+
+    async def submit(
+        self, request: Dict[str, Any], priority: Priority = "normal", key: Optional[str] = None
+    ) -> Job:
+        if self._queue.qsize() >= self.max_queued:
+            self.counts["rejected"] += 1
+            raise QueueFullError(f"Job queue is full ({self.max_queued} jobs waiting)")
+        if (
+            key is not None
+            and self.max_queued_per_key is not None
+            and self._queued_by_key.get(key, 0) >= self.max_queued_per_key
+        ):
+            self.counts["rejected"] += 1
+            raise QueueFullError(f"At most {self.max_queued_per_key} jobs may wait per user")
+
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": "queued",
+            "priority": priority,
+            "request": request,
+            "key": key,
+            "owner": self.owner,
+            "heartbeat_at": time.time(),
+            "result": None,
+            "error": None,
+            "created_at": _now(),
+            "started_at": None,
+            "finished_at": None,
+        }
+        await self.store.create(job)
+        self._enqueue(job)
+        self.counts["submitted"] += 1
+        return job
+
+    def _enqueue(self, job: Job):
+        key = job.get("key")
+        self._queue.put_nowait((PRIORITY_ORDER[job["priority"]], next(self._sequence), job["id"], key))
+        if key is not None:
+            self._queued_by_key[key] = self._queued_by_key.get(key, 0) + 1
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._keep_alive()))
+
+    async def _keep_alive(self):
+        while True:
+            now = time.time()
+            try:
+                await self.store.heartbeat(self.owner, now)
+                stale_before = now - JOB_STALE_HEARTBEATS * self.heartbeat_seconds
+                for job in await self.store.claim_stale(self.owner, stale_before, now):
+                    logger.warning("Requeueing job %s left unfinished by a stopped worker", job["id"])
+                    self._enqueue(job)
+                    self.counts["recovered"] += 1
+            except Exception as e:
+                logger.warning("Job heartbeat failed: %s", e)
+            await asyncio.sleep(self.heartbeat_seconds)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self._queue.qsize(),
+            "running": self.running,
+            "workers": self.workers,
+            **self.counts,
+        }
+
+    async def _work(self):
+        while True:
+            _, _, job_id, key = await self._queue.get()
+            if key is not None:
+                self._queued_by_key[key] -= 1
+                if not self._queued_by_key[key]:
+                    del self._queued_by_key[key]
+            try:
+                await self._run(job_id)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str):
+        job = await self.store.get(job_id)
+        if job is None:
+            return
+
+        self.running += 1
+        await self.store.update(job_id, {"status": "running", "started_at": _now()})
+        try:
+            result = await self.runner(job["request"])
+        except asyncio.CancelledError:
+            # Shutdown, not a failure: back in the queue, so once this queue's
+            # heartbeats stop the job is recovered and run again
+            await self.store.update(job_id, {"status": "queued", "started_at": None})
+            raise
+        except Exception as e:
+            logger.warning("Job %s failed: %s", job_id, e)
+            self.counts["failed"] += 1
+            await self.store.update(job_id, {"status": "failed", "error": str(e), "finished_at": _now()})
+        else:
+            self.counts["succeeded"] += 1
+            await self.store.update(job_id, {"status": "succeeded", "result": result, "finished_at": _now()})
+        finally:
+            self.running -= 1
@@ -0,0 +1,92 @@
+# jobs/store.py
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from pymongo import ReturnDocument
+
+Job = Dict[str, Any]
+UNFINISHED = ["queued", "running"]
+
+
+class JobStore:
+    """Where job state lives. The queue only ever holds job ids."""
+
+    async def create(self, job: Job):
+        raise NotImplementedError
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        raise NotImplementedError
+
+    async def update(self, job_id: str, fields: Dict[str, Any]):
+        raise NotImplementedError
+
+    async def heartbeat(self, owner: str, now: float):
+        """Marks owner's unfinished jobs as still alive."""
+
+    async def claim_stale(self, owner: str, stale_before: float, now: float) -> List[Job]:
+        """
+        Takes over unfinished jobs whose owner stopped heartbeating (it was
+        restarted or crashed) and returns them queued again under owner.
+        """
+        return []
+
+
+class MemoryJobStore(JobStore):
+    """Per-process store; the oldest jobs are dropped past max_jobs. Jobs end with the process."""
+
+    def __init__(self, max_jobs: int = 10000):
+        self.max_jobs = max_jobs
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+
+    async def create(self, job: Job):
+        self._jobs[job["id"]] = job
+        while len(self._jobs) > self.max_jobs:
+            self._jobs.popitem(last=False)
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+    async def update(self, job_id: str, fields: Dict[str, Any]):
+        job = self._jobs.get(job_id)
+        if job is not None:
+            job.update(fields)
+
+
+class MongoJobStore(JobStore):
+    """Shared store so any worker process can answer GET /jobs/{id}."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def create(self, job: Job):
+        await self.collection.insert_one({"_id": job["id"], **job})
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        job = await self.collection.find_one({"_id": job_id})
+        if job is not None:
+            job.pop("_id", None)
+        return job
+
+    async def update(self, job_id: str, fields: Dict[str, Any]):
+        await self.collection.update_one({"_id": job_id}, {"$set": fields})
+
+    async def heartbeat(self, owner: str, now: float):
+        await self.collection.update_many(
+            {"owner": owner, "status": {"$in": UNFINISHED}}, {"$set": {"heartbeat_at": now}}
+        )
+
+    async def claim_stale(self, owner: str, stale_before: float, now: float) -> List[Job]:
+        # One job at a time, atomically, so two processes starting together
+        # never both take the same job
+        claimed = []
+        while True:
+            job = await self.collection.find_one_and_update(
+                {"status": {"$in": UNFINISHED}, "heartbeat_at": {"$not": {"$gte": stale_before}}},
+                {"$set": {"owner": owner, "heartbeat_at": now, "status": "queued", "started_at": None}},
+                return_document=ReturnDocument.AFTER,
+            )
+            if job is None:
+                return claimed
+            job.pop("_id", None)
+            claimed.append(job)
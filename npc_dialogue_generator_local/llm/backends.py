@@ -0,0 +1,481 @@
+# llm/backends.py
+import asyncio
+import os
+import time
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+from dotenv import load_dotenv
+from huggingface_hub import AsyncInferenceClient
+
+from llm.ndjson import aiter_tokens
+from llm.prompts import PromptContent
+from metrics.instruments import llm_in_flight, llm_requests, llm_tokens, stage_seconds
+
+load_dotenv()
+
+# --- Backend selection ---
+# "hf" (Hugging Face Inference), "ollama", "colab" or "local" (Transformers on CPU)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "hf")
+
+# --- Concurrency, timeout & retry policy (shared by every backend) ---
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "180"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", "0.5"))
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+ZEPHYR_STOP_TOKENS = ["</s>", "<|user|>", "<|system|>", "<|assistant|>"]
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def shared_http_client() -> httpx.AsyncClient:
+    """One pooled HTTP client for every HTTP-based backend in the process."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONCURRENCY * 2,
+                max_keepalive_connections=LLM_MAX_CONCURRENCY,
+            ),
+            timeout=httpx.Timeout(LLM_REQUEST_TIMEOUT, connect=10.0),
+        )
+    return _http_client
+
+
+async def close_shared_http_client():
+    if _http_client is not None and not _http_client.is_closed:
+        await _http_client.aclose()
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (TimeoutError, httpx.TransportError)):
+        return True
+    # Both httpx and huggingface_hub errors carry the upstream response
+    status_code = getattr(getattr(error, "response", None), "status_code", None)
+    return status_code in RETRYABLE_STATUS_CODES
+
+
+class Usage:
+    """Token counts the provider reported; None until it reports any."""
+
+    __slots__ = ("prompt_tokens", "completion_tokens")
+
+    def __init__(self):
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+
+
+_usage: ContextVar[Optional[Usage]] = ContextVar("llm_usage", default=None)
+
+
+def track_usage() -> Usage:
+    """
+    Collects the usage reported for LLM calls made from here on in the
+    current task (and tasks it starts, such as router hedges).
+    """
+    usage = Usage()
+    _usage.set(usage)
+    return usage
+
+
+def record_usage(backend: str, prompt_tokens: Optional[int], completion_tokens: Optional[int]):
+    usage = _usage.get()
+    if prompt_tokens:
+        llm_tokens.labels(backend, "prompt").inc(prompt_tokens)
+        if usage is not None:
+            usage.prompt_tokens = (usage.prompt_tokens or 0) + prompt_tokens
+    if completion_tokens:
+        llm_tokens.labels(backend, "completion").inc(completion_tokens)
+        if usage is not None:
+            usage.completion_tokens = (usage.completion_tokens or 0) + completion_tokens
+
+
+class LLMBackend:
+    """
+    Common interface for every upstream the service can generate with.
+
+    Subclasses implement _generate (and _stream when the upstream can
+    stream). This class layers the shared policy on top: a per-process
+    concurrency cap, a per-request timeout and retries with exponential
+    backoff for transient failures. Streams are retried the same way until
+    their first chunk arrives, but not after, because text that has already
+    been yielded can't be taken back.
+
+    stop_after_lines is a hint that the caller only needs that many
+    `Name: text` lines. Streaming callers stop reading on their own; backends
+    that generate in-process (local) use it to stop decoding early.
+    """
+
+    name = "base"
+    # True when every streamed chunk is one token, so chunks can be counted as usage
+    chunks_are_tokens = False
+    # "chat" backends also accept prompts as chat messages; the rest take raw text
+    prompt_format = "zephyr"
+
+    def __init__(
+        self,
+        model: str,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        timeout: float = LLM_REQUEST_TIMEOUT,
+        max_retries: int = LLM_MAX_RETRIES,
+        retry_backoff: float = LLM_RETRY_BACKOFF,
+    ):
+        self.model = model
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    @property
+    def models(self) -> List[str]:
+        """The upstream model names requests may be served by."""
+        return [self.model]
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def generate(
+        self,
+        prompt: PromptContent,
+        max_tokens: int,
+        temperature: float = 0.7,
+        timeout: Optional[float] = None,
+        stop_after_lines: Optional[int] = None,
+    ) -> str:
+        timeout = timeout or self.timeout
+        async with self._semaphore:
+            in_flight = llm_in_flight.labels(self.name)
+            in_flight.inc()
+            started = time.perf_counter()
+            outcome = "cancelled"
+            try:
+                for attempt in range(self.max_retries + 1):
+                    try:
+                        result = await asyncio.wait_for(
+                            self._generate(prompt, max_tokens, temperature, stop_after_lines),
+                            timeout=timeout,
+                        )
+                        outcome = "ok"
+                        return result
+                    except asyncio.TimeoutError:
+                        error = TimeoutError(f"LLM request timed out after {timeout:g}s")
+                        outcome = "timeout"
+                    except Exception as e:
+                        error = e
+                        outcome = "error"
+
+                    if attempt == self.max_retries or not is_retryable(error):
+                        raise error
+                    await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+            finally:
+                in_flight.dec()
+                llm_requests.labels(self.name, outcome).inc()
+                stage_seconds.labels("llm_upstream").observe(time.perf_counter() - started)
+
+    async def stream(
+        self,
+        prompt: PromptContent,
+        max_tokens: int,
+        temperature: float = 0.7,
+        timeout: Optional[float] = None,
+        stop_after_lines: Optional[int] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Yields completion text deltas as the upstream produces them.
+
+        The timeout bounds the initial response and every gap between chunks.
+        Failures before the first chunk are retried like generate(); closing
+        the generator early closes the upstream stream as well.
+        """
+        timeout = timeout or self.timeout
+        async with self._semaphore:
+            in_flight = llm_in_flight.labels(self.name)
+            in_flight.inc()
+            started = time.perf_counter()
+            outcome = "cancelled"
+            chunks = None
+            try:
+                for attempt in range(self.max_retries + 1):
+                    chunks = self._stream(prompt, max_tokens, temperature, stop_after_lines)
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), timeout=timeout)
+                        break
+                    except StopAsyncIteration:
+                        outcome = "ok"
+                        return
+                    except asyncio.TimeoutError:
+                        error = TimeoutError(f"LLM stream sent nothing for {timeout:g}s")
+                    except Exception as e:
+                        error = e
+                    await chunks.aclose()
+                    if attempt == self.max_retries or not is_retryable(error):
+                        outcome = "timeout" if isinstance(error, TimeoutError) else "error"
+                        raise error
+                    await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+
+                stage_seconds.labels("llm_first_chunk").observe(time.perf_counter() - started)
+                while True:
+                    if chunk:
+                        yield chunk
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), timeout=timeout)
+                    except StopAsyncIteration:
+                        outcome = "ok"
+                        break
+                    except asyncio.TimeoutError:
+                        outcome = "timeout"
+                        raise TimeoutError(f"LLM stream stalled for more than {timeout:g}s")
+            except GeneratorExit:
+                # The caller stopped reading, e.g. early stop at target_lines
+                outcome = "stopped"
+                raise
+            except Exception:
+                if outcome == "cancelled":
+                    outcome = "error"
+                raise
+            finally:
+                if chunks is not None:
+                    await chunks.aclose()
+                in_flight.dec()
+                llm_requests.labels(self.name, outcome).inc()
+                stage_seconds.labels("llm_upstream").observe(time.perf_counter() - started)
+
+    async def _generate(
+        self, prompt: str, max_tokens: int, temperature: float, stop_after_lines: Optional[int] = None
+    ) -> str:
+        raise NotImplementedError
+
+    async def _stream(
+        self, prompt: str, max_tokens: int, temperature: float, stop_after_lines: Optional[int] = None
+    ) -> AsyncIterator[str]:
+        # Upstreams without a streaming API produce the whole text as one chunk
+        yield await self._generate(prompt, max_tokens, temperature, stop_after_lines)
+
+
+class HFInferenceBackend(LLMBackend):
+    """Hugging Face Inference Providers via the chat completions API."""
+
+    name = "hf"
+    chunks_are_tokens = True
+    prompt_format = "chat"
+
+    def __init__(self, model: str, api_key: Optional[str] = None, **kwargs):
+        super().__init__(model, **kwargs)
+        self._client = AsyncInferenceClient(api_key=api_key, timeout=self.timeout)
+
+    def _request(self, prompt: PromptContent, max_tokens: int, temperature: float) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "messages": prompt if isinstance(prompt, list) else [{"role": "user", "content": prompt}],
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+        }
+
+    async def _generate(
+        self,
+        prompt: PromptContent,
+        max_tokens: int,
+        temperature: float,
+        stop_after_lines: Optional[int] = None,
+    ) -> str:
+        completion = await self._client.chat.completions.create(
+            **self._request(prompt, max_tokens, temperature)
+        )
+        usage = getattr(completion, "usage", None)
+        if usage is not None:
+            record_usage(self.name, usage.prompt_tokens, usage.completion_tokens)
+        return completion.choices[0].message.content or ""
+
+    async def _stream(
+        self,
+        prompt: PromptContent,
+        max_tokens: int,
+        temperature: float,
+        stop_after_lines: Optional[int] = None,
+    ) -> AsyncIterator[str]:
+        chunks = await self._client.chat.completions.create(
+            **self._request(prompt, max_tokens, temperature),
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        try:
+            async for chunk in chunks:
+                # The usage block comes last, so a stream closed early has none
+                usage = getattr(chunk, "usage", None)
+                if usage is not None:
+                    record_usage(self.name, usage.prompt_tokens, usage.completion_tokens)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            aclose = getattr(chunks, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    async def close(self):
+        await self._client.close()
+
+
+class OllamaBackend(LLMBackend):
+    """Ollama's /api/generate endpoint (raw prompt, NDJSON streaming)."""
+
+    name = "ollama"
+    chunks_are_tokens = True
+
+    def __init__(
+        self,
+        model: str,
+        api_url: str,
+        top_p: float = 0.9,
+        top_k: int = 50,
+        stop: Optional[List[str]] = None,
+        **kwargs,
+    ):
+        super().__init__(model, **kwargs)
+        self.api_url = api_url
+        self.options = {"top_p": top_p, "top_k": top_k, "stop": stop or ZEPHYR_STOP_TOKENS}
+
+    def _payload(self, prompt: str, max_tokens: int, temperature: float, stream: bool) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": stream,
+            "options": {**self.options, "num_predict": max_tokens, "temperature": temperature},
+        }
+
+    async def _generate(
+        self, prompt: str, max_tokens: int, temperature: float, stop_after_lines: Optional[int] = None
+    ) -> str:
+        response = await shared_http_client().post(
+            self.api_url, json=self._payload(prompt, max_tokens, temperature, stream=False)
+        )
+        response.raise_for_status()
+        data = response.json()
+        record_usage(self.name, data.get("prompt_eval_count"), data.get("eval_count"))
+        return data.get("response", "")
+
+    async def _stream(
+        self, prompt: str, max_tokens: int, temperature: float, stop_after_lines: Optional[int] = None
+    ) -> AsyncIterator[str]:
+        payload = self._payload(prompt, max_tokens, temperature, stream=True)
+        async with shared_http_client().stream("POST", self.api_url, json=payload) as response:
+            response.raise_for_status()
+            async for token in aiter_tokens(response.aiter_bytes()):
+                yield token
+
+
+class ColabBackend(LLMBackend):
+    """The Colab/ngrok text-generation endpoint (`generated_text` JSON, no streaming)."""
+
+    name = "colab"
+
+    def __init__(self, model: str, api_url: str, top_p: float = 0.9, top_k: int = 50, **kwargs):
+        super().__init__(model, **kwargs)
+        self.api_url = api_url
+        self.top_p = top_p
+        self.top_k = top_k
+
+    async def _generate(
+        self, prompt: str, max_tokens: int, temperature: float, stop_after_lines: Optional[int] = None
+    ) -> str:
+        response = await shared_http_client().post(
+            self.api_url,
+            json={
+                "prompt": prompt,
+                "max_new_tokens": max_tokens,
+                "temperature": temperature,
+                "top_p": self.top_p,
+                "top_k": self.top_k,
+            },
+        )
+        response.raise_for_status()
+        return response.json().get("generated_text", "")
+
+
+class LocalTransformersBackend(LLMBackend):
+    """
+    A Transformers model on this machine's CPU, run by LocalInferenceEngine.
+
+    Sampling settings are fixed per engine because a batch shares a single
+    generate() call, so the per-request temperature is ignored. torch is
+    only imported when the backend starts.
+    """
+
+    name = "local"
+
+    def __init__(
+        self,
+        model: str,
+        prefix: Optional[Tuple[str, str]] = None,
+        temperature: float = 0.75,
+        top_p: float = 0.9,
+        top_k: int = 50,
+        **kwargs,
+    ):
+        super().__init__(model, **kwargs)
+        self.prefix = prefix
+        self.sampling = {"do_sample": True, "temperature": temperature, "top_p": top_p, "top_k": top_k}
+        self.engine = None
+
+    async def start(self):
+        from llm.local_engine import LocalInferenceEngine
+        from llm.local_model import LOCAL_EXECUTION_MODE, load_local_model, supports_prefix_cache
+
+        model, tokenizer = await asyncio.to_thread(load_local_model, self.model, LOCAL_EXECUTION_MODE)
+        engine = LocalInferenceEngine(
+            model,
+            tokenizer,
+            generation_kwargs={
+                "num_return_sequences": 1,
+                **self.sampling,
+                "pad_token_id": tokenizer.eos_token_id,
+            },
+        )
+        if self.prefix and supports_prefix_cache(LOCAL_EXECUTION_MODE):
+            engine.register_prefix(*self.prefix)
+        engine.start()
+        self.engine = engine
+
+    async def close(self):
+        if self.engine is not None:
+            await asyncio.to_thread(self.engine.stop)
+            self.engine = None
+
+    async def _generate(
+        self, prompt: str, max_tokens: int, temperature: float, stop_after_lines: Optional[int] = None
+    ) -> str:
+        if self.engine is None:
+            raise RuntimeError("Local model is not loaded")
+        prefix_key = self.prefix[0] if self.prefix else None
+        return await self.engine.generate(
+            prompt, max_tokens, prefix_key=prefix_key, max_lines=stop_after_lines
+        )
+
+
+def build_backend(name: str = LLM_BACKEND) -> LLMBackend:
+    """Builds the configured backend from its environment variables."""
+    if name == "hf":
+        return HFInferenceBackend(
+            os.getenv("LLM_MODEL_NAME", "openai/gpt-oss-120b"), api_key=os.getenv("HF_TOKEN")
+        )
+    if name == "ollama":
+        return OllamaBackend(
+            os.getenv("OLLAMA_MODEL_NAME", "zephyr"),
+            os.getenv("OLLAMA_API_URL", "http://localhost:11434/api/generate"),
+        )
+    if name == "colab":
+        api_url = os.getenv("COLAB_LLM_API_URL")
+        if not api_url:
+            raise RuntimeError("COLAB_LLM_API_URL is not set in .env")
+        return ColabBackend("Zephyr-7B-Beta (via Colab)", api_url)
+    if name == "local":
+        # A retry after a timeout would redo the same CPU-bound generation
+        return LocalTransformersBackend(
+            os.getenv("MODEL_NAME", "TinyLlama/TinyLlama-1.1B-Chat-v1.0"), max_retries=0
+        )
+    raise ValueError(f"Unknown LLM_BACKEND '{name}', expected hf, ollama, colab or local")
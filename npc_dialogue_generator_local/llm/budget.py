@@ -0,0 +1,111 @@
+# llm/budget.py
+import math
+import os
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+# --- Adaptive max_tokens configuration ---
+LLM_BUDGET_PERCENTILE = float(os.getenv("LLM_BUDGET_PERCENTILE", "0.95"))
+LLM_BUDGET_MARGIN = float(os.getenv("LLM_BUDGET_MARGIN", "0.15"))
+# Keep the static budget until this many generations have been observed
+LLM_BUDGET_MIN_SAMPLES = int(os.getenv("LLM_BUDGET_MIN_SAMPLES", "20"))
+LLM_BUDGET_WINDOW = int(os.getenv("LLM_BUDGET_WINDOW", "500"))
+LLM_BUDGET_MIN_TOKENS = int(os.getenv("LLM_BUDGET_MIN_TOKENS", "64"))
+LLM_BUDGET_MAX_TOKENS = int(os.getenv("LLM_BUDGET_MAX_TOKENS", "8192"))
+# Used when a backend can't report token counts (single-chunk responses)
+LLM_CHARS_PER_TOKEN = float(os.getenv("LLM_CHARS_PER_TOKEN", "4"))
+
+
+def estimate_tokens(char_count: int) -> int:
+    return math.ceil(char_count / LLM_CHARS_PER_TOKEN)
+
+
+class _Samples:
+    def __init__(self, window: int):
+        self.values: Deque[float] = deque(maxlen=window)
+        self.total = 0
+        self._sorted: Optional[list] = None
+
+    def add(self, value: float):
+        self.values.append(value)
+        self.total += 1
+        self._sorted = None
+
+    def percentile(self, q: float) -> float:
+        if self._sorted is None:
+            self._sorted = sorted(self.values)
+        index = min(len(self._sorted) - 1, max(0, math.ceil(q * len(self._sorted)) - 1))
+        return self._sorted[index]
+
+
+class TokenBudget:
+    """
+    Learns max_tokens per (model, dialogue length) from what generations
+    actually used.
+
+    Every finished generation records its completion tokens per emitted
+    dialogue line. Once a key has min_samples observations, its budget is
+    the chosen percentile of the recent window times the target line count,
+    plus a safety margin, clamped to [min_tokens, max_tokens]. Until then the
+    static budget from length_config is used.
+    """
+
+    def __init__(
+        self,
+        length_config: Dict[str, Dict[str, int]],
+        percentile: float = LLM_BUDGET_PERCENTILE,
+        margin: float = LLM_BUDGET_MARGIN,
+        min_samples: int = LLM_BUDGET_MIN_SAMPLES,
+        window: int = LLM_BUDGET_WINDOW,
+        min_tokens: int = LLM_BUDGET_MIN_TOKENS,
+        max_tokens: int = LLM_BUDGET_MAX_TOKENS,
+    ):
+        self.length_config = length_config
+        self.percentile = percentile
+        self.margin = margin
+        self.min_samples = min_samples
+        self.window = window
+        self.min_tokens = min_tokens
+        self.max_tokens_cap = max_tokens
+        self._samples: Dict[Tuple[str, str], _Samples] = {}
+
+    def record(self, model: str, dialogue_length: str, completion_tokens: int, lines: int):
+        if lines <= 0 or completion_tokens <= 0:
+            return
+        key = (model, dialogue_length)
+        samples = self._samples.get(key)
+        if samples is None:
+            samples = self._samples[key] = _Samples(self.window)
+        samples.add(completion_tokens / lines)
+
+    def max_tokens(self, model: str, dialogue_length: str) -> int:
+        config = self.length_config[dialogue_length]
+        samples = self._samples.get((model, dialogue_length))
+        if samples is None or len(samples.values) < self.min_samples:
+            return config["max_tokens"]
+
+        per_line = samples.percentile(self.percentile)
+        budget = math.ceil(per_line * config["target_lines"] * (1 + self.margin))
+        return min(self.max_tokens_cap, max(self.min_tokens, budget))
+
+    def snapshot(self) -> Dict[str, Any]:
+        budgets = []
+        for (model, dialogue_length), samples in self._samples.items():
+            budgets.append({
+                "model": model,
+                "dialogue_length": dialogue_length,
+                "samples": samples.total,
+                "window": len(samples.values),
+                "tokens_per_line_p50": round(samples.percentile(0.5), 2),
+                f"tokens_per_line_p{round(self.percentile * 100)}": round(
+                    samples.percentile(self.percentile), 2
+                ),
+                "static_max_tokens": self.length_config[dialogue_length]["max_tokens"],
+                "max_tokens": self.max_tokens(model, dialogue_length),
+            })
+        return {
+            "percentile": self.percentile,
+            "margin": self.margin,
+            "min_samples": self.min_samples,
+            "budgets": budgets,
+        }
@@ -0,0 +1,241 @@
+# llm/cache.py
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Literal, Optional
+
+from dotenv import load_dotenv
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - falls back to stdlib json
+    orjson = None
+
+load_dotenv()
+
+# --- Cache configuration ---
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+# Optional on-disk tier; disabled unless a path is configured
+RESPONSE_CACHE_DB_PATH = os.getenv("RESPONSE_CACHE_DB_PATH")
+RESPONSE_CACHE_DB_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_DB_MAX_ENTRIES", "10000"))
+# The disk tier drops expired rows and trims to its cap once per this many writes
+DISK_PURGE_EVERY_WRITES = 64
+
+CacheMode = Literal["bypass", "prefer", "only"]
+
+
+def _normalize(value: Any) -> Any:
+    # Exact type checks: model_dump() only yields plain str/dict/list values,
+    # and this runs over every field of every request
+    value_type = type(value)
+    if value_type is str:
+        return " ".join(value.split())
+    if value_type is dict:
+        return {k: _normalize(v) for k, v in value.items()}
+    if value_type is list or value_type is tuple:
+        return [_normalize(v) for v in value]
+    return value
+
+
+def _canonical_json(value: Any) -> bytes:
+    # orjson's sorted compact output matches the stdlib call byte for byte
+    # for the strings, ints and plain floats a request is made of
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def cache_key(request_data: Dict[str, Any], model: str, params: Dict[str, Any]) -> str:
+    """
+    Canonical hash of a dialogue request plus the model and sampling parameters.
+
+    Whitespace inside string fields is collapsed and keys are sorted, so
+    requests that only differ in formatting share a key. Character order is
+    kept because it drives the speaking order in the prompt.
+    """
+    canonical = _canonical_json(
+        {"request": _normalize(request_data), "model": model, "params": params}
+    )
+    return hashlib.sha256(canonical).hexdigest()
+
+
+class MemoryCache:
+    """In-process LRU with a per-entry TTL and entry-count/byte-size limits."""
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value, size = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: str):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl, value, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+
+class SQLiteCache:
+    """
+    On-disk tier shared by every worker on the same host. Expired rows are
+    purged on open and then periodically on write, and the table is trimmed
+    to max_entries by least-recent use, so a cap overshoots by at most
+    DISK_PURGE_EVERY_WRITES rows per worker.
+    """
+
+    def __init__(self, path: str, ttl: float, max_entries: int = RESPONSE_CACHE_DB_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, "
+            "accessed_at REAL NOT NULL DEFAULT 0)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(responses)")}
+        if "accessed_at" not in columns:
+            # Tables written before the size cap; old rows count as least recent
+            self._conn.execute("ALTER TABLE responses ADD COLUMN accessed_at REAL NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_expires_at ON responses (expires_at)")
+        self._writes = 0
+        self._purge()
+        self._lock = asyncio.Lock()
+
+    def _get(self, key: str) -> Optional[str]:
+        row = self._conn.execute(
+            "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if row[1] < now:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            return None
+        self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def _set(self, key: str, value: str):
+        now = time.time()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO responses (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (key, value, now + self.ttl, now),
+        )
+        self._writes += 1
+        if self._writes % DISK_PURGE_EVERY_WRITES == 0:
+            self._purge()
+
+    def _purge(self):
+        self._conn.execute("DELETE FROM responses WHERE expires_at < ?", (time.time(),))
+        self._conn.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    async def get(self, key: str) -> Optional[str]:
+        async with self._lock:
+            return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: str):
+        async with self._lock:
+            await asyncio.to_thread(self._set, key, value)
+
+    def close(self):
+        self._conn.close()
+
+
+class ResponseCache:
+    """Two-tier response cache: in-process LRU first, then the optional disk tier."""
+
+    def __init__(self, memory: MemoryCache, disk: Optional[SQLiteCache] = None):
+        self.memory = memory
+        self.disk = disk
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0}
+
+    async def get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is not None:
+            self.stats["memory_hits"] += 1
+            return value
+
+        if self.disk is not None:
+            value = await self.disk.get(key)
+            if value is not None:
+                self.stats["disk_hits"] += 1
+                self.memory.set(key, value)
+                return value
+
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, value: str):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            await self.disk.set(key, value)
+        self.stats["stores"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        lookups = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory.size_bytes,
+            "disk_enabled": self.disk is not None,
+        }
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+
+
+def build_response_cache() -> ResponseCache:
+    memory = MemoryCache(
+        max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+        max_bytes=RESPONSE_CACHE_MAX_BYTES,
+        ttl=RESPONSE_CACHE_TTL,
+    )
+    disk = None
+    if RESPONSE_CACHE_DB_PATH:
+        disk = SQLiteCache(RESPONSE_CACHE_DB_PATH, RESPONSE_CACHE_TTL, RESPONSE_CACHE_DB_MAX_ENTRIES)
+    return ResponseCache(memory, disk)
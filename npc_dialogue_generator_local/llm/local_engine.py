@@ -0,0 +1,309 @@
+# llm/local_engine.py
+import asyncio
+import copy
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList
+
+from llm.postprocess import parse_dialogue_lines
+
+# --- Batching configuration ---
+LOCAL_MAX_BATCH_SIZE = int(os.getenv("LOCAL_MAX_BATCH_SIZE", "8"))
+LOCAL_MAX_WAIT_MS = float(os.getenv("LOCAL_MAX_WAIT_MS", "20"))
+LOCAL_MAX_INPUT_TOKENS = int(os.getenv("LOCAL_MAX_INPUT_TOKENS", "512"))
+LOCAL_PREFIX_CACHE_SIZE = int(os.getenv("LOCAL_PREFIX_CACHE_SIZE", "4"))
+
+
+class _PendingRequest:
+    def __init__(
+        self,
+        prompt: str,
+        max_new_tokens: int,
+        prefix_key: Optional[str],
+        max_lines: Optional[int],
+        loop: asyncio.AbstractEventLoop,
+    ):
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.prefix_key = prefix_key
+        self.max_lines = max_lines
+        self.loop = loop
+        self.future = loop.create_future()
+
+
+class DialogueLinesStoppingCriteria(StoppingCriteria):
+    """
+    Stops each row of a batch once its continuation holds max_lines complete
+    `Name: text` lines, instead of decoding on to max_new_tokens.
+
+    Rows are only re-decoded when their newest token contains a newline, so
+    the check costs almost nothing on the other steps.
+    """
+
+    def __init__(self, tokenizer, prompt_length: int, max_lines: List[Optional[int]]):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.max_lines = max_lines
+        self.stopped = [False] * len(max_lines)
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        for row, limit in enumerate(self.max_lines):
+            if limit is None or self.stopped[row]:
+                continue
+            if "\n" not in self.tokenizer.decode(input_ids[row, -1:]):
+                continue
+            text = self.tokenizer.decode(input_ids[row, self.prompt_length:], skip_special_tokens=True)
+            completed = text[: text.rfind("\n")]
+            self.stopped[row] = len(parse_dialogue_lines(completed)) >= limit
+        return torch.tensor(self.stopped, dtype=torch.bool, device=input_ids.device)
+
+
+class LocalInferenceEngine:
+    """
+    Dynamic batching front end for a local Transformers model.
+
+    Requests from the event loop are queued to one dedicated worker thread.
+    The thread waits up to max_wait_ms after the first request for others
+    to arrive, runs a single left-padded model.generate over up to
+    max_batch_size prompts, and resolves each caller's future with only its
+    own continuation. The event loop never runs model code.
+
+    Prompts that start with a registered static prefix (e.g. the system
+    rules block) reuse that prefix's precomputed past-key-values, so only
+    the per-request part of the prompt is prefilled. Prefix caches are kept
+    in a small LRU keyed by the caller's template version.
+
+    A request with max_lines stops decoding as soon as it has that many
+    dialogue lines; the rest of its batch keeps going.
+    """
+
+    def __init__(
+        self,
+        model,
+        tokenizer,
+        generation_kwargs: Dict[str, Any],
+        max_batch_size: int = LOCAL_MAX_BATCH_SIZE,
+        max_wait_ms: float = LOCAL_MAX_WAIT_MS,
+        max_input_tokens: int = LOCAL_MAX_INPUT_TOKENS,
+        prefix_cache_size: int = LOCAL_PREFIX_CACHE_SIZE,
+    ):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.generation_kwargs = generation_kwargs
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_input_tokens = max_input_tokens
+        self.prefix_cache_size = prefix_cache_size
+        self._prefix_texts: Dict[str, str] = {}
+        # Only touched from the worker thread
+        self._prefix_cache: "OrderedDict[str, Tuple[torch.Tensor, Any]]" = OrderedDict()
+        self._queue: "queue.Queue[Optional[_PendingRequest]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self.batches_run = 0
+        self.requests_served = 0
+        self.prefix_hits = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="local-inference", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def register_prefix(self, key: str, text: str):
+        """Declares a static prompt prefix; its KV cache is built on first use."""
+        self._prefix_texts[key] = text
+
+    async def generate(
+        self,
+        prompt: str,
+        max_new_tokens: int,
+        prefix_key: Optional[str] = None,
+        max_lines: Optional[int] = None,
+    ) -> str:
+        prefix = self._prefix_texts.get(prefix_key) if prefix_key else None
+        if prefix is None or not prompt.startswith(prefix):
+            prefix_key = None
+        request = _PendingRequest(
+            prompt, max_new_tokens, prefix_key, max_lines, asyncio.get_running_loop()
+        )
+        self._queue.put(request)
+        return await request.future
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize(),
+            "batches_run": self.batches_run,
+            "requests_served": self.requests_served,
+            "avg_batch_size": self.requests_served / self.batches_run if self.batches_run else 0.0,
+            "prefix_hits": self.prefix_hits,
+            "cached_prefixes": list(self._prefix_cache),
+        }
+
+    # --- worker thread ---
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+
+            batch = [first]
+            deadline = time.monotonic() + self.max_wait
+            stopping = False
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                batch.append(request)
+
+            # A batch shares one prefix cache, so split it by prefix key
+            groups: Dict[Optional[str], List[_PendingRequest]] = {}
+            for request in batch:
+                if not request.future.cancelled():
+                    groups.setdefault(request.prefix_key, []).append(request)
+            for prefix_key, group in groups.items():
+                self._run_batch(group, prefix_key)
+            if stopping:
+                return
+
+    def _run_batch(self, batch: List[_PendingRequest], prefix_key: Optional[str]):
+        try:
+            texts = self._generate(
+                [r.prompt for r in batch],
+                [r.max_new_tokens for r in batch],
+                prefix_key,
+                [r.max_lines for r in batch],
+            )
+        except Exception as e:
+            for request in batch:
+                request.loop.call_soon_threadsafe(self._resolve, request.future, None, e)
+            return
+
+        self.batches_run += 1
+        self.requests_served += len(batch)
+        for request, text in zip(batch, texts):
+            request.loop.call_soon_threadsafe(self._resolve, request.future, text, None)
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, result: Optional[str], error: Optional[Exception]):
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _prefix_state(self, key: str) -> Tuple[torch.Tensor, Any]:
+        state = self._prefix_cache.get(key)
+        if state is not None:
+            self._prefix_cache.move_to_end(key)
+            self.prefix_hits += 1
+            return state
+
+        prefix_ids = self.tokenizer(self._prefix_texts[key], return_tensors="pt").input_ids
+        prefix_ids = prefix_ids.to(self.model.device)
+        with torch.no_grad():
+            past_key_values = self.model(prefix_ids, use_cache=True).past_key_values
+
+        state = (prefix_ids, past_key_values)
+        self._prefix_cache[key] = state
+        while len(self._prefix_cache) > self.prefix_cache_size:
+            self._prefix_cache.popitem(last=False)
+        return state
+
+    def _encode(self, prompts: List[str], prefix_key: Optional[str]):
+        """Returns (inputs, past_key_values) for a left-padded batch."""
+        if prefix_key is None:
+            inputs = self.tokenizer(
+                prompts,
+                return_tensors="pt",
+                padding=True,
+                truncation=True,
+                max_length=self.max_input_tokens,
+            )
+            return {k: v.to(self.model.device) for k, v in inputs.items()}, None
+
+        prefix_ids, prefix_cache = self._prefix_state(prefix_key)
+        prefix_length = prefix_ids.shape[1]
+        prefix_text = self._prefix_texts[prefix_key]
+        suffix = self.tokenizer(
+            [p[len(prefix_text):] for p in prompts],
+            return_tensors="pt",
+            padding=True,
+            truncation=True,
+            max_length=max(self.max_input_tokens - prefix_length, 1),
+            add_special_tokens=False,
+        )
+        batch_size = len(prompts)
+        suffix_ids = suffix["input_ids"].to(self.model.device)
+        suffix_mask = suffix["attention_mask"].to(self.model.device)
+
+        # Padding lands between the prefix and each suffix; the attention mask
+        # hides it and generate() derives position ids from the mask.
+        inputs = {
+            "input_ids": torch.cat([prefix_ids.expand(batch_size, -1), suffix_ids], dim=1),
+            "attention_mask": torch.cat(
+                [
+                    torch.ones(
+                        batch_size, prefix_length, dtype=suffix_mask.dtype, device=suffix_mask.device
+                    ),
+                    suffix_mask,
+                ],
+                dim=1,
+            ),
+        }
+        # generate() appends to the cache in place, so every batch gets a copy
+        past_key_values = copy.deepcopy(prefix_cache)
+        past_key_values.batch_repeat_interleave(batch_size)
+        return inputs, past_key_values
+
+    def _generate(
+        self,
+        prompts: List[str],
+        max_new_tokens: List[int],
+        prefix_key: Optional[str] = None,
+        max_lines: Optional[List[Optional[int]]] = None,
+    ) -> List[str]:
+        # Decoder-only models need left padding so every row ends at its prompt
+        self.tokenizer.padding_side = "left"
+        inputs, past_key_values = self._encode(prompts, prefix_key)
+        prompt_length = inputs["input_ids"].shape[1]
+
+        stopping_criteria = None
+        if max_lines and any(limit is not None for limit in max_lines):
+            stopping_criteria = StoppingCriteriaList(
+                [DialogueLinesStoppingCriteria(self.tokenizer, prompt_length, max_lines)]
+            )
+
+        with torch.no_grad():
+            output = self.model.generate(
+                **inputs,
+                past_key_values=past_key_values,
+                max_new_tokens=max(max_new_tokens),
+                stopping_criteria=stopping_criteria,
+                **self.generation_kwargs,
+            )
+
+        return [
+            self.tokenizer.decode(
+                row[prompt_length : prompt_length + limit], skip_special_tokens=True
+            )
+            for row, limit in zip(output, max_new_tokens)
+        ]
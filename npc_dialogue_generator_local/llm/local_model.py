@@ -0,0 +1,69 @@
+# llm/local_model.py
+import logging
+import os
+from typing import Any, Tuple
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+# "fp32" (default), "int8" (dynamic quantization of nn.Linear), "bf16", or
+# "onnx" (ONNX Runtime via optimum, installed separately)
+LOCAL_EXECUTION_MODE = os.getenv("LOCAL_EXECUTION_MODE", "fp32")
+EXECUTION_MODES = ("fp32", "int8", "bf16", "onnx")
+
+logger = logging.getLogger(__name__)
+
+
+def cpu_supports_bf16() -> bool:
+    """bf16 is only a win with native AVX512-BF16 or AMX; otherwise it's emulated."""
+    checks = ("_is_avx512_bf16_supported", "_is_amx_tile_supported")
+    return any(getattr(torch.cpu, name, lambda: False)() for name in checks)
+
+
+def resolve_execution_mode(mode: str) -> str:
+    """The mode load_local_model will actually run: bf16 falls back to fp32 without CPU support."""
+    if mode not in EXECUTION_MODES:
+        raise ValueError(f"Unknown execution mode '{mode}', expected one of {EXECUTION_MODES}")
+    if mode == "bf16" and not cpu_supports_bf16():
+        return "fp32"
+    return mode
+
+
+def supports_prefix_cache(mode: str) -> bool:
+    # The ONNX Runtime model manages its own past-key-values format
+    return mode != "onnx"
+
+
+def load_local_model(model_name: str, mode: str = LOCAL_EXECUTION_MODE) -> Tuple[Any, Any]:
+    """Loads (model, tokenizer) for CPU inference in the requested execution mode."""
+    resolved = resolve_execution_mode(mode)
+    if resolved != mode:
+        logger.warning("This CPU has no native %s support; falling back to %s.", mode, resolved)
+        mode = resolved
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "right"
+
+    if mode == "onnx":
+        try:
+            from optimum.onnxruntime import ORTModelForCausalLM
+        except ImportError:
+            raise RuntimeError(
+                "LOCAL_EXECUTION_MODE=onnx needs `pip install optimum[onnxruntime]`"
+            )
+        return ORTModelForCausalLM.from_pretrained(model_name, export=True), tokenizer
+
+    dtype = torch.bfloat16 if mode == "bf16" else torch.float32
+    model = AutoModelForCausalLM.from_pretrained(
+        model_name, torch_dtype=dtype, low_cpu_mem_usage=True
+    )
+    model.to("cpu")
+    model.eval()
+
+    if mode == "int8":
+        model = torch.ao.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+
+    return model, tokenizer
@@ -0,0 +1,104 @@
+# llm/ndjson.py
+import codecs
+import io
+import json
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, Iterator, List, Union
+
+Chunk = Union[bytes, str]
+
+
+class NDJSONDecoder:
+    """
+    Incremental decoder for newline-delimited JSON (Ollama's streaming format).
+
+    Raw chunks are fed in exactly as the HTTP client hands them over. Bytes
+    go through an incremental UTF-8 decoder, so a multi-byte character split
+    across chunks is fine, and a JSON object is only parsed once its
+    terminating newline has arrived. Pending fragments are kept in a list and
+    joined once per line, so the work stays linear in the size of the stream.
+    """
+
+    def __init__(self):
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._pending: List[str] = []
+
+    def feed(self, chunk: Chunk) -> List[Dict[str, Any]]:
+        text = self._utf8.decode(chunk) if isinstance(chunk, bytes) else chunk
+        if "\n" not in text:
+            if text:
+                self._pending.append(text)
+            return []
+
+        parts = text.split("\n")
+        self._pending.append(parts[0])
+        completed = ["".join(self._pending)] + parts[1:-1]
+        self._pending = [parts[-1]] if parts[-1] else []
+        return self._decode(completed)
+
+    def flush(self) -> List[Dict[str, Any]]:
+        """Decodes a final object that wasn't followed by a newline."""
+        self._pending.append(self._utf8.decode(b"", final=True))
+        remainder = "".join(self._pending)
+        self._pending = []
+        return self._decode([remainder])
+
+    @staticmethod
+    def _decode(lines: Iterable[str]) -> List[Dict[str, Any]]:
+        messages = []
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                messages.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Malformed NDJSON line from LLM: {line[:200]!r}") from e
+        return messages
+
+
+def _check(message: Dict[str, Any]):
+    # Ollama reports failures that happen mid-stream as an {"error": ...} line
+    if "error" in message:
+        raise RuntimeError(f"LLM stream error: {message['error']}")
+
+
+def iter_ndjson(chunks: Iterable[Chunk]) -> Iterator[Dict[str, Any]]:
+    decoder = NDJSONDecoder()
+    for chunk in chunks:
+        yield from decoder.feed(chunk)
+    yield from decoder.flush()
+
+
+async def aiter_ndjson(chunks: AsyncIterable[Chunk]) -> AsyncIterator[Dict[str, Any]]:
+    decoder = NDJSONDecoder()
+    async for chunk in chunks:
+        for message in decoder.feed(chunk):
+            yield message
+    for message in decoder.flush():
+        yield message
+
+
+def iter_tokens(chunks: Iterable[Chunk], field: str = "response") -> Iterator[str]:
+    """Yields each message's text field until the message marked `done`."""
+    for message in iter_ndjson(chunks):
+        _check(message)
+        if message.get(field):
+            yield message[field]
+        if message.get("done"):
+            return
+
+
+async def aiter_tokens(chunks: AsyncIterable[Chunk], field: str = "response") -> AsyncIterator[str]:
+    async for message in aiter_ndjson(chunks):
+        _check(message)
+        if message.get(field):
+            yield message[field]
+        if message.get("done"):
+            return
+
+
+def collect_tokens(tokens: Iterable[str]) -> str:
+    buffer = io.StringIO()
+    for token in tokens:
+        buffer.write(token)
+    return buffer.getvalue()
@@ -0,0 +1,150 @@
+# llm/postprocess.py
+import re
+from typing import Iterable, List, Optional, Tuple
+
+DialogueLine = Tuple[str, str]
+
+ASSISTANT_MARKER = "<|assistant|>"
+MAX_SPEAKER_LENGTH = 40
+SENTENCE_ENDINGS = (".", "?", "!", "…")
+# A trailing fragment shorter than this is cut back to the last sentence end
+TRUNCATE_TAIL = 25
+
+# Everything the models emit that isn't spoken dialogue, removed in one sub():
+# parenthetical actions, stray chat-template tokens and a "Dialogue:" heading
+# at the start of a line. All of them stay within a line so whole texts and
+# streamed lines are processed identically. The leading lookahead lets the
+# engine skip most positions with one check.
+_NOISE_RE = re.compile(
+    r"(?=[ \t(<Dd])(?:[ \t]*\([^()\n]*\)|<(?:\|(?:system|user|assistant)\|>|/s>)|^[ \t]*Dialogue:)",
+    re.IGNORECASE | re.MULTILINE,
+)
+# An echoed prompt runs from its first template token through <|assistant|>
+# (or to the end of the text if the model never got past it)
+_ECHO_START_RE = re.compile(r"<\|(?:system|user)\|>")
+_ECHO_RE = re.compile(r"<\|(?:system|user)\|>.*?(?:<\|assistant\|>|\Z)", re.DOTALL)
+_RECORD_RE = re.compile(
+    r"^[ \t]*([^:\n]{1,%d}):[ \t]*(\S[^\n]*)" % MAX_SPEAKER_LENGTH, re.MULTILINE
+)
+# Markdown the models like to wrap speaker names in ("**Bob**:", "- Bob:")
+_SPEAKER_JUNK = " \t*_-"
+
+
+def strip_echoed_prompt(text: str) -> str:
+    """Drops an echoed prompt: `<|system|>` or `<|user|>` through `<|assistant|>`."""
+    return _ECHO_RE.sub("", text) if "<|" in text else text
+
+
+def _record(match: Optional[re.Match]) -> Optional[DialogueLine]:
+    if match is None:
+        return None
+    speaker = match.group(1).strip(_SPEAKER_JUNK)
+    if not speaker:
+        return None
+    return speaker, match.group(2).rstrip()
+
+
+def parse_line(line: str) -> Optional[DialogueLine]:
+    """Returns (speaker, text) for a `Name: text` line, or None if it isn't one."""
+    return _record(_RECORD_RE.match(_NOISE_RE.sub("", line)))
+
+
+def format_line(line: DialogueLine) -> str:
+    return f"{line[0]}: {line[1]}"
+
+
+def parse_dialogue_lines(content: str) -> List[DialogueLine]:
+    """Whole-text version: one sub() and one finditer() over the completion."""
+    cleaned = _NOISE_RE.sub("", strip_echoed_prompt(content))
+    lines = []
+    for match in _RECORD_RE.finditer(cleaned):
+        parsed = _record(match)
+        if parsed:
+            lines.append(parsed)
+    return lines
+
+
+def clean_dialogue_text(text: str) -> str:
+    """
+    Free-form cleanup for the single-file servers that return the model's
+    text as-is: strips the echoed prompt, actions and template tokens, then
+    trims a dangling half sentence (or marks it with "...").
+    """
+    cleaned = _NOISE_RE.sub("", strip_echoed_prompt(text.strip())).strip()
+    if not cleaned or cleaned.endswith(SENTENCE_ENDINGS):
+        return cleaned
+
+    tail = cleaned[-TRUNCATE_TAIL:]
+    last_end = max(tail.rfind("."), tail.rfind("?"), tail.rfind("!"))
+    if last_end == -1:
+        return cleaned + "..."
+    return cleaned[: len(cleaned) - len(tail) + last_end + 1]
+
+
+class DialogueLineParser:
+    """
+    Incremental version of parse_dialogue_lines for streamed completions.
+
+    Text chunks are fed in as they arrive; a line is only parsed once its
+    terminating newline has been seen, so a chunk boundary in the middle of a
+    line never produces a half-finished dialogue line. An echoed prompt is
+    skipped exactly as strip_echoed_prompt() would, so however the text is
+    chunked the lines match parse_dialogue_lines() on the whole text.
+    """
+
+    def __init__(self):
+        self._pending: List[str] = []
+        # Inside an echoed prompt: the text kept from the line it began on
+        self._echo_prefix: Optional[str] = None
+
+    def feed(self, chunk: str) -> List[DialogueLine]:
+        if "\n" not in chunk:
+            self._pending.append(chunk)
+            return []
+
+        parts = chunk.split("\n")
+        self._pending.append(parts[0])
+        completed = ["".join(self._pending)] + parts[1:-1]
+        self._pending = [parts[-1]]
+        return self._parse(completed)
+
+    def flush(self) -> List[DialogueLine]:
+        """Parses whatever is left once the stream has ended."""
+        remainder = "".join(self._pending)
+        self._pending = []
+        lines = self._parse([remainder])
+        if self._echo_prefix is not None:
+            # The echo never ended, so it ran to the end of the text
+            lines += self._parse_visible([self._echo_prefix])
+            self._echo_prefix = None
+        return lines
+
+    def _outside_echo(self, raw: str) -> Optional[str]:
+        """raw without any echoed prompt, or None while all of it is inside one."""
+        kept = ""
+        while True:
+            if self._echo_prefix is not None:
+                end = raw.find(ASSISTANT_MARKER)
+                if end == -1:
+                    return None
+                kept, self._echo_prefix = self._echo_prefix, None
+                raw = raw[end + len(ASSISTANT_MARKER):]
+            start = _ECHO_START_RE.search(raw) if "<|" in raw else None
+            if start is None:
+                return kept + raw
+            self._echo_prefix = kept + raw[: start.start()]
+            raw = raw[start.end():]
+            kept = ""
+
+    def _parse(self, raw_lines: Iterable[str]) -> List[DialogueLine]:
+        visible = (self._outside_echo(raw) for raw in raw_lines)
+        return self._parse_visible([line for line in visible if line is not None])
+
+    @staticmethod
+    def _parse_visible(raw_lines: Iterable[str]) -> List[DialogueLine]:
+        lines = []
+        for raw in raw_lines:
+            parsed = parse_line(raw)
+            if parsed:
+                lines.append(parsed)
+        return lines
@@ -0,0 +1,261 @@
+# llm/prompts.py
+import asyncio
+import copy
+import logging
+import os
+import string
+from functools import lru_cache
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, Tuple, Union
+
+from dotenv import load_dotenv
+
+from llm.budget import estimate_tokens
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# --- Prompt templates & context budget ---
+# Template version to use; defaults to the backend's preferred format
+PROMPT_TEMPLATE = os.getenv("PROMPT_TEMPLATE")
+# Hugging Face tokenizer used to count prompt tokens; defaults to the (first)
+# model name, "none" counts with the chars-per-token estimate instead. Exact
+# counts need `pip install transformers` (not in requirements.txt, so by
+# default every count is the estimate)
+PROMPT_TOKENIZER = os.getenv("PROMPT_TOKENIZER")
+# Context window prompts are checked against: one size for every model, or
+# per model as "model=tokens,...". Models not listed use KNOWN_CONTEXT_WINDOWS;
+# any other model skips the check
+LLM_CONTEXT_WINDOW = os.getenv("LLM_CONTEXT_WINDOW", "")
+# Windows of the backends' default models
+KNOWN_CONTEXT_WINDOWS = {
+    "openai/gpt-oss-120b": 131072,
+    "TinyLlama/TinyLlama-1.1B-Chat-v1.0": 2048,
+}
+
+# A Zephyr-marked string, or chat messages for chat completion APIs
+PromptContent = Union[str, List[Dict[str, str]]]
+# Literal text, then the field that follows it (None after the last literal)
+Segments = Tuple[Tuple[str, Optional[str]], ...]
+
+_formatter = string.Formatter()
+
+
+def compile_segments(template: str) -> Segments:
+    return tuple((literal, field) for literal, field, _, _ in _formatter.parse(template))
+
+
+def bind_segments(segments: Segments, values: Mapping[str, Any]) -> Segments:
+    """Substitutes the given fields now, merging them into the neighbouring literal text."""
+    bound = []
+    literal_run = ""
+    for literal, field in segments:
+        literal_run += literal
+        if field is None:
+            continue
+        if field in values:
+            literal_run += str(values[field])
+        else:
+            bound.append((literal_run, field))
+            literal_run = ""
+    bound.append((literal_run, None))
+    return tuple(bound)
+
+
+def render_segments(segments: Segments, values: Mapping[str, Any]) -> str:
+    parts = []
+    for literal, field in segments:
+        parts.append(literal)
+        if field is not None:
+            parts.append(values[field])
+    return "".join(parts)
+
+
+class PromptTemplate:
+    """
+    A versioned prompt: system and user text with {field} slots, sent either
+    as one Zephyr-marked string ("zephyr") or as system/user messages
+    ("chat"). Templates are split into literal/field segments once, and
+    bind() bakes in fields that are fixed ahead of time, so rendering a
+    request is a single join over what is left.
+    """
+
+    def __init__(self, name: str, format: str, system: str, user: str):
+        if format not in ("zephyr", "chat"):
+            raise ValueError(f"Unknown prompt format '{format}', expected zephyr or chat")
+        self.name = name
+        self.format = format
+        if format == "zephyr":
+            text = f"<|system|>\n{system}\n</s>\n\n<|user|>\n{user}\n</s>\n\n<|assistant|>"
+            self.messages = ((None, compile_segments(text)),)
+        else:
+            self.messages = (("system", compile_segments(system)), ("user", compile_segments(user)))
+
+    def bind(self, **values: Any) -> "PromptTemplate":
+        bound = copy.copy(self)
+        bound.messages = tuple((role, bind_segments(segments, values)) for role, segments in self.messages)
+        return bound
+
+    def render(self, values: Mapping[str, Any]) -> PromptContent:
+        if self.format == "zephyr":
+            return render_segments(self.messages[0][1], values)
+        return [
+            {"role": role, "content": render_segments(segments, values)}
+            for role, segments in self.messages
+        ]
+
+
+# --- Dialogue prompt, v1 ---
+DIALOGUE_SYSTEM_V1 = """You are an AI assistant generating dialogue for NPCs in video games.
+
+STRICT RULES:
+- Generate EXACTLY {target_lines} dialogue lines.
+- Follow strict rotation of characters in the given order.
+- Format MUST be: CharacterName: dialogue text
+- NO actions, NO asterisks (*), NO parentheses, NO stage directions.
+- ONLY plain spoken dialogue.
+- If any character would perform an action, OMIT it entirely.
+
+{example_pattern}
+Begin immediately with the first character."""
+
+DIALOGUE_USER_V1 = """Context: {context}
+
+Characters (speak in this exact order, cycling continuously):
+{characters}
+
+Generate exactly {target_lines} lines of pure dialogue:"""
+
+TEMPLATES = {
+    "zephyr-v1": PromptTemplate("zephyr-v1", "zephyr", DIALOGUE_SYSTEM_V1, DIALOGUE_USER_V1),
+    "chat-v1": PromptTemplate("chat-v1", "chat", DIALOGUE_SYSTEM_V1, DIALOGUE_USER_V1),
+}
+# Latest template of each format, used unless PROMPT_TEMPLATE pins one
+DEFAULT_TEMPLATES = {"zephyr": "zephyr-v1", "chat": "chat-v1"}
+
+
+@lru_cache(maxsize=8)
+def load_tokenizer(name: str):
+    """The Hugging Face tokenizer for name, or None if it (or transformers) isn't available."""
+    if name.lower() == "none":
+        return None
+    try:
+        from transformers import AutoTokenizer
+
+        return AutoTokenizer.from_pretrained(name)
+    except Exception as e:
+        logger.warning("No tokenizer for '%s' (%s); prompt tokens will be estimated", name, e)
+        return None
+
+
+def count_tokens(tokenizer, content: PromptContent) -> int:
+    """Prompt tokens as the model sees them, chat template included when it has one."""
+    if isinstance(content, str):
+        if tokenizer is None:
+            return estimate_tokens(len(content))
+        return len(tokenizer.encode(content))
+    if tokenizer is not None and getattr(tokenizer, "chat_template", None):
+        return len(tokenizer.apply_chat_template(content, add_generation_prompt=True, tokenize=True))
+    text = "\n".join(message["content"] for message in content)
+    return estimate_tokens(len(text)) if tokenizer is None else len(tokenizer.encode(text))
+
+
+def context_window_for(models: List[str], setting: str = LLM_CONTEXT_WINDOW) -> Optional[int]:
+    """The smallest known window among models, or None if none is known."""
+    setting = setting.strip()
+    if setting and "=" not in setting:
+        return int(setting)
+    windows = dict(KNOWN_CONTEXT_WINDOWS)
+    for entry in filter(None, setting.split(",")):
+        model, _, tokens = entry.rpartition("=")
+        windows[model.strip()] = int(tokens)
+    configured = [windows[model] for model in models if model in windows]
+    return min(configured) if configured else None
+
+
+class Prompt(NamedTuple):
+    content: PromptContent
+    tokens: int
+    template: str
+
+
+class PromptTooLong(Exception):
+    def __init__(self, prompt_tokens: int, completion_tokens: int, context_window: int):
+        super().__init__(
+            f"Prompt is {prompt_tokens} tokens; with {completion_tokens} reserved for the "
+            f"dialogue it exceeds the {context_window}-token context window"
+        )
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.context_window = context_window
+
+
+class PromptBuilder:
+    """
+    Renders dialogue prompts from one template and counts their tokens.
+
+    The template is bound once per dialogue length (target_lines), so the
+    rules block is never rebuilt per request. start() loads the tokenizer
+    in the background, so a slow or offline model hub never delays startup;
+    until it is loaded, or if it can't be, token counts fall back to the
+    chars-per-token estimate.
+    """
+
+    def __init__(
+        self,
+        template: PromptTemplate,
+        length_config: Dict[str, Dict[str, int]],
+        tokenizer_name: str,
+        context_window: Optional[int] = None,
+    ):
+        self.template = template
+        self.tokenizer_name = tokenizer_name
+        self.context_window = context_window
+        self.tokenizer = None
+        self._loader: Optional[asyncio.Task] = None
+        self._by_length = {
+            length: template.bind(target_lines=config["target_lines"])
+            for length, config in length_config.items()
+        }
+
+    def start(self):
+        self._loader = asyncio.ensure_future(self._load_tokenizer())
+
+    async def _load_tokenizer(self):
+        self.tokenizer = await asyncio.to_thread(load_tokenizer, self.tokenizer_name)
+
+    def close(self):
+        if self._loader is not None:
+            self._loader.cancel()
+
+    def build(self, dialogue_length: str, values: Mapping[str, Any]) -> Prompt:
+        content = self._by_length[dialogue_length].render(values)
+        return Prompt(content, count_tokens(self.tokenizer, content), self.template.name)
+
+    def check_fits(self, prompt: Prompt, completion_tokens: int):
+        """Raises PromptTooLong unless prompt plus completion fit the context window (if known)."""
+        if self.context_window is not None and prompt.tokens + completion_tokens > self.context_window:
+            raise PromptTooLong(prompt.tokens, completion_tokens, self.context_window)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "template": self.template.name,
+            "format": self.template.format,
+            "tokenizer": self.tokenizer_name if self.tokenizer is not None else None,
+            "context_window": self.context_window,
+        }
+
+
+def build_prompt_builder(
+    backend, length_config: Dict[str, Dict[str, int]], name: Optional[str] = PROMPT_TEMPLATE
+) -> PromptBuilder:
+    """A PromptBuilder with PROMPT_TEMPLATE, or the latest template in the backend's format."""
+    name = name or DEFAULT_TEMPLATES[backend.prompt_format]
+    if name not in TEMPLATES:
+        raise ValueError(f"Unknown PROMPT_TEMPLATE '{name}', expected one of {', '.join(TEMPLATES)}")
+    template = TEMPLATES[name]
+    if template.format == "chat" and backend.prompt_format != "chat":
+        raise ValueError(f"PROMPT_TEMPLATE '{name}' needs a chat backend, not '{backend.name}'")
+    # A router's model is "a+b"; its backends share one prompt, so count with the first's tokenizer
+    models = backend.models
+    return PromptBuilder(template, length_config, PROMPT_TOKENIZER or models[0], context_window_for(models))
@@ -0,0 +1,315 @@
+# llm/router.py
+import asyncio
+import os
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from llm.backends import LLM_BACKEND, LLMBackend, build_backend
+from llm.prompts import PromptContent
+
+# --- Routing configuration ---
+# Comma-separated backend names, e.g. "hf,ollama,colab"; more than one enables routing
+LLM_BACKENDS = [name.strip() for name in os.getenv("LLM_BACKENDS", "").split(",") if name.strip()]
+# Start a second backend if the first hasn't answered after this many seconds; 0 disables
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "10"))
+LLM_EWMA_ALPHA = float(os.getenv("LLM_EWMA_ALPHA", "0.2"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+
+class BackendState:
+    """Live health of one backend: EWMA latency/error rate, load and breaker."""
+
+    def __init__(self, backend: LLMBackend, alpha: float):
+        self.backend = backend
+        self.alpha = alpha
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+
+    def available(self, now: float, cooldown: float) -> bool:
+        if self.opened_at is None:
+            return True
+        # Half-open: after the cooldown, let a single trial request through
+        return now - self.opened_at >= cooldown and not self.trial_in_flight
+
+    def score(self) -> float:
+        # Untried backends score 0 so they get measured first
+        latency = self.latency or 0.0
+        return latency * (1 + self.in_flight) * (1 + 4 * self.error_rate)
+
+    def record_latency(self, elapsed: float):
+        self.latency = elapsed if self.latency is None else (
+            self.alpha * elapsed + (1 - self.alpha) * self.latency
+        )
+
+    def record_success(self, elapsed: float):
+        self.record_latency(elapsed)
+        self.error_rate *= 1 - self.alpha
+        self.consecutive_failures = 0
+        self.opened_at = None
+
+    def record_failure(self, breaker_failures: int):
+        self.error_rate = self.alpha + (1 - self.alpha) * self.error_rate
+        self.consecutive_failures += 1
+        if self.opened_at is not None or self.consecutive_failures >= breaker_failures:
+            self.opened_at = time.monotonic()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend.name,
+            "model": self.backend.model,
+            "ewma_latency": self.latency,
+            "error_rate": round(self.error_rate, 4),
+            "in_flight": self.in_flight,
+            "circuit": "open" if self.opened_at is not None else "closed",
+        }
+
+
+class BackendRouter(LLMBackend):
+    """
+    Sends each request to the healthiest, fastest backend.
+
+    Backends are ranked by EWMA latency scaled by their in-flight count and
+    recent error rate. A generation that hasn't finished after hedge_delay
+    is hedged: the next-best backend starts too and whichever answers first
+    wins, the other is cancelled. A failure fails over to the next backend.
+    After breaker_failures consecutive failures a backend's circuit opens
+    and it is skipped until breaker_cooldown has passed, when one trial
+    request decides whether it closes again.
+
+    Streams are hedged and fail over the same way until their first chunk;
+    after that they are committed to one backend. A stream the consumer
+    closes early (LLM_EARLY_STOP) counts as a success for that backend.
+    """
+
+    name = "router"
+
+    def __init__(
+        self,
+        backends: List[LLMBackend],
+        hedge_delay: float = LLM_HEDGE_DELAY,
+        alpha: float = LLM_EWMA_ALPHA,
+        breaker_failures: int = LLM_BREAKER_FAILURES,
+        breaker_cooldown: float = LLM_BREAKER_COOLDOWN,
+    ):
+        super().__init__(model="+".join(b.model for b in backends))
+        self.states = [BackendState(b, alpha) for b in backends]
+        self.hedge_delay = hedge_delay
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown = breaker_cooldown
+        self.chunks_are_tokens = all(s.backend.chunks_are_tokens for s in self.states)
+        # Chat messages only when every backend can take them
+        if all(s.backend.prompt_format == "chat" for s in self.states):
+            self.prompt_format = "chat"
+
+    @property
+    def models(self) -> List[str]:
+        return [model for s in self.states for model in s.backend.models]
+
+    async def start(self):
+        await asyncio.gather(*(s.backend.start() for s in self.states))
+
+    async def close(self):
+        await asyncio.gather(*(s.backend.close() for s in self.states), return_exceptions=True)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [s.snapshot() for s in self.states]
+
+    def _ranked(self) -> List[BackendState]:
+        now = time.monotonic()
+        candidates = [s for s in self.states if s.available(now, self.breaker_cooldown)]
+        return sorted(candidates, key=BackendState.score)
+
+    def _acquire(self, state: BackendState) -> bool:
+        """Marks a request as in flight; returns True if it is a half-open trial."""
+        trial = state.opened_at is not None
+        if trial:
+            state.trial_in_flight = True
+        state.in_flight += 1
+        return trial
+
+    def _release(self, state: BackendState, trial: bool):
+        state.in_flight -= 1
+        if trial:
+            state.trial_in_flight = False
+
+    async def _call(
+        self, state: BackendState, trial: bool, prompt: PromptContent, max_tokens: int, *args
+    ):
+        started = time.monotonic()
+        try:
+            result = await state.backend.generate(prompt, max_tokens, *args)
+        except asyncio.CancelledError:
+            # A hedge loser took at least this long; without this it would
+            # stay unmeasured and keep ranking first
+            state.record_latency(time.monotonic() - started)
+            raise
+        except Exception:
+            state.record_failure(self.breaker_failures)
+            raise
+        else:
+            state.record_success(time.monotonic() - started)
+            return result
+        finally:
+            self._release(state, trial)
+
+    async def generate(
+        self,
+        prompt: PromptContent,
+        max_tokens: int,
+        temperature: float = 0.7,
+        timeout: Optional[float] = None,
+        stop_after_lines: Optional[int] = None,
+    ) -> str:
+        candidates = self._ranked()
+        if not candidates:
+            raise RuntimeError("All LLM backends are unavailable (circuits open)")
+
+        running: Dict[asyncio.Future, BackendState] = {}
+        last_error: Optional[Exception] = None
+        hedged = False
+
+        def launch():
+            state = candidates.pop(0)
+            trial = self._acquire(state)
+            task = asyncio.ensure_future(
+                self._call(state, trial, prompt, max_tokens, temperature, timeout, stop_after_lines)
+            )
+            running[task] = state
+
+        launch()
+        try:
+            while running:
+                can_hedge = not hedged and candidates and self.hedge_delay > 0
+                done, _ = await asyncio.wait(
+                    running,
+                    timeout=self.hedge_delay if can_hedge else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    hedged = True
+                    launch()
+                    continue
+
+                for task in done:
+                    running.pop(task)
+                    if task.exception() is None:
+                        return task.result()
+                    last_error = task.exception()
+
+                if not running and candidates:
+                    launch()
+        finally:
+            for task in running:
+                task.cancel()
+
+        raise last_error
+
+    async def _abandon(self, task: asyncio.Future, state: BackendState, trial: bool, started: float, chunks):
+        """Stops a stream that lost the race for the first chunk."""
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        state.record_latency(time.monotonic() - started)
+        self._release(state, trial)
+        await chunks.aclose()
+
+    async def stream(
+        self,
+        prompt: PromptContent,
+        max_tokens: int,
+        temperature: float = 0.7,
+        timeout: Optional[float] = None,
+        stop_after_lines: Optional[int] = None,
+    ) -> AsyncIterator[str]:
+        candidates = self._ranked()
+        if not candidates:
+            raise RuntimeError("All LLM backends are unavailable (circuits open)")
+
+        # Each running stream's first chunk -> (state, trial, started, chunks)
+        pending: Dict[asyncio.Future, tuple] = {}
+        last_error: Optional[Exception] = None
+        hedged = False
+        winner = None
+        first_chunk = None
+
+        def launch():
+            state = candidates.pop(0)
+            trial = self._acquire(state)
+            chunks = state.backend.stream(prompt, max_tokens, temperature, timeout, stop_after_lines)
+            pending[asyncio.ensure_future(chunks.__anext__())] = (state, trial, time.monotonic(), chunks)
+
+        launch()
+        try:
+            while pending and winner is None:
+                can_hedge = not hedged and candidates and self.hedge_delay > 0
+                done, _ = await asyncio.wait(
+                    pending,
+                    timeout=self.hedge_delay if can_hedge else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    hedged = True
+                    launch()
+                    continue
+
+                for task in done:
+                    state, trial, started, chunks = entry = pending.pop(task)
+                    error = task.exception()
+                    if error is None and winner is None:
+                        winner, first_chunk = entry, task.result()
+                    elif error is None:
+                        # Answered in the same tick as the winner; stopped below
+                        pending[task] = entry
+                    elif isinstance(error, StopAsyncIteration):
+                        # Finished without any text: an answer all the same
+                        state.record_success(time.monotonic() - started)
+                        self._release(state, trial)
+                        await chunks.aclose()
+                        return
+                    else:
+                        state.record_failure(self.breaker_failures)
+                        self._release(state, trial)
+                        await chunks.aclose()
+                        last_error = error
+
+                if winner is None and not pending and candidates:
+                    launch()
+        finally:
+            for task, entry in pending.items():
+                await self._abandon(task, *entry)
+
+        if winner is None:
+            raise last_error
+
+        state, trial, started, chunks = winner
+        try:
+            yield first_chunk
+            async for chunk in chunks:
+                yield chunk
+        except GeneratorExit:
+            # The consumer stopped early (LLM_EARLY_STOP) after getting text,
+            # which is a success as far as this backend's health goes
+            state.record_success(time.monotonic() - started)
+            raise
+        except asyncio.CancelledError:
+            state.record_latency(time.monotonic() - started)
+            raise
+        except Exception:
+            state.record_failure(self.breaker_failures)
+            raise
+        else:
+            state.record_success(time.monotonic() - started)
+        finally:
+            self._release(state, trial)
+            await chunks.aclose()
+
+
+def build_llm() -> LLMBackend:
+    """A BackendRouter when LLM_BACKENDS lists several backends, else the single backend."""
+    if len(LLM_BACKENDS) > 1:
+        return BackendRouter([build_backend(name) for name in LLM_BACKENDS])
+    return build_backend(LLM_BACKENDS[0] if LLM_BACKENDS else LLM_BACKEND)
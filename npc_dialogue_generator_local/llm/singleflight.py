@@ -0,0 +1,54 @@
+# llm/singleflight.py
+import asyncio
+from functools import partial
+from typing import Awaitable, Callable, Dict, TypeVar
+
+T = TypeVar("T")
+
+
+class _Call:
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key onto one in-flight task.
+
+    Every caller awaits the same task, so a result or an exception reaches
+    all of them. A caller that is cancelled only stops waiting; the shared
+    task itself is cancelled once the last caller has gone away.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(partial(self._finish, key, call))
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                self._forget(key, call)
+                call.task.cancel()
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def _forget(self, key: str, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def _finish(self, key: str, call: _Call, task: asyncio.Future):
+        self._forget(key, call)
+        if not task.cancelled():
+            # Mark the exception as retrieved even if nobody is left to see it
+            task.exception()
@@ -1,25 +1,100 @@
 # main.py
+import asyncio
 import datetime
 import json
+import math
 import os
-from typing import List, Literal, Dict, Any
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterable, Callable, Dict, List, Literal, Optional, Set, Tuple
 
 from dotenv import load_dotenv
-from fastapi import FastAPI, File, Form, HTTPException, Request, UploadFile
+from fastapi import Depends, FastAPI, File, Form, HTTPException, Query, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.security import HTTPAuthorizationCredentials
+from pydantic import BaseModel, Field, ValidationError
+from api.responses import FastJSONResponse, dumps
 from routers import auth
-from huggingface_hub import InferenceClient
+from auth.utils import api_token_cache, get_current_user_by_api_token
+from db import mongo
+from jobs.queue import JobQueue, Priority, QueueFullError
+from jobs.store import MemoryJobStore, MongoJobStore
+from llm.cache import CacheMode, build_response_cache, cache_key
+from llm.backends import Usage, close_shared_http_client, track_usage
+from llm.budget import TokenBudget, estimate_tokens
+from llm.router import BackendRouter, build_llm
+from llm.singleflight import SingleFlight
+from llm.postprocess import DialogueLine, DialogueLineParser, format_line, parse_dialogue_lines
+from llm.prompts import Prompt, PromptTooLong, build_prompt_builder
+from metrics.instruments import llm_tokens, stage_seconds
+from metrics.middleware import MetricsMiddleware
+from metrics.registry import REGISTRY
+from ratelimit.limiter import RATE_LIMIT_PROXY_HOPS, RateLimitExceeded, build_rate_limiter
+from uploads.middleware import UploadLimitMiddleware
+from uploads.reader import UploadTooLarge, check_upload_size, iter_jsonl_upload, read_json_upload
 
 # Load environment variables
 load_dotenv()
-API_TOKEN = os.getenv("HF_TOKEN")
 
-# --- Model name constant ---
-LLM_MODEL_NAME = "openai/gpt-oss-120b"
+# --- LLM backend (LLM_BACKEND=hf|ollama|colab|local, or several via LLM_BACKENDS) ---
+backend = build_llm()
+LLM_MODEL_NAME = backend.model
+LLM_TEMPERATURE = 0.7
+# Stream completions and hang up once target_lines dialogue lines exist
+LLM_EARLY_STOP = os.getenv("LLM_EARLY_STOP", "true").lower() == "true"
+
+# --- Dialogue length → upstream budget ---
+LENGTH_CONFIG = {
+    "Short":  {"max_tokens": 1500, "target_lines": 20},
+    "Medium": {"max_tokens": 3000, "target_lines": 30},
+    "Long":   {"max_tokens": 4500, "target_lines": 40}
+}
+
+# Learned max_tokens per model/length; LENGTH_CONFIG is the cold-start budget
+token_budget = TokenBudget(LENGTH_CONFIG)
+
+# Prompt template for this backend, pre-bound per dialogue length
+prompt_builder = build_prompt_builder(backend, LENGTH_CONFIG)
+
+# --- Batch generation limits ---
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+
+# --- Background job queue ---
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "100"))
+JOB_MAX_QUEUED_PER_USER = int(os.getenv("JOB_MAX_QUEUED_PER_USER", "10"))
+JOB_STORE = os.getenv("JOB_STORE", "memory")  # "memory" or "mongo"
+
+# --- Response cache for repeated identical requests ---
+response_cache = build_response_cache()
+
+# --- Coalesces concurrent identical generations onto one upstream call ---
+inflight = SingleFlight()
+
+# --- Per-user request rate, concurrency and upstream token quotas ---
+rate_limiter = build_rate_limiter()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await mongo.ensure_indexes()
+    await backend.start()
+    prompt_builder.start()
+    job_queue.start()
+    yield
+    await job_queue.stop()
+    prompt_builder.close()
+    await backend.close()
+    await close_shared_http_client()
+    response_cache.close()
+    await rate_limiter.close()
+    mongo.close()
+
 
 # --- App setup ---
-app = FastAPI(title="NPC Dialogue Generator (no-auth)")
+app = FastAPI(title="NPC Dialogue Generator (no-auth)", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  
@@ -27,6 +102,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(UploadLimitMiddleware, paths=["/generate_dialogue_from_file"])
 
 # --- Pydantic Models ---
 class Character(BaseModel):
@@ -37,110 +114,315 @@ class Character(BaseModel):
 
 class DialogueRequest(BaseModel):
     context: str
-    characters: List[Character] = Field(min_items=1)
+    characters: List[Character] = Field(min_length=1)
     dialogue_length: Literal["Short", "Medium", "Long"]
+    cache: CacheMode = "prefer"
 
 class DialogueResponse(BaseModel):
     generated_dialogue: str
     model_used: str
     timestamp: str
 
-# --- Include authentication routes ---
-app.include_router(auth.router, tags=["Authentication"], prefix="/auth")
 
-# --- Hugging Face client ---
-client = InferenceClient(api_key=API_TOKEN)
+def dialogue_result(dialogue: str) -> Dict[str, Any]:
+    """A DialogueResponse as a plain dict, built without a validation pass."""
+    return {
+        "generated_dialogue": dialogue,
+        "model_used": LLM_MODEL_NAME,
+        "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+    }
 
+# --- Include authentication routes ---
+app.include_router(auth.router, tags=["Authentication"], prefix="/auth")
 
 # ============================================================
-# PROMPT CREATION (FIXED)
+# PROMPT CREATION
 # ============================================================
-def create_prompt(data: Dict[str, Any]) -> str:
-    context = data["context"]
-    dialogue_length_str = data["dialogue_length"]  # DO NOT default
-    characters = data["characters"]
-
-    # Map dialogue length → number of turns
-    length_mapping = {"Short": 24, "Medium": 48, "Long": 62}
-    target_lines = length_mapping[dialogue_length_str]
+def create_prompt(dialogue_request: DialogueRequest) -> Prompt:
+    characters = dialogue_request.characters
 
     characters_str = "\n".join(
-        f"- Name: {c['name']}, Personality: {c['personality']}, "
-        f"Occupation: {c['occupation']}, Relationship: {c['relationship']}"
+        f"- Name: {c.name}, Personality: {c.personality}, "
+        f"Occupation: {c.occupation}, Relationship: {c.relationship}"
         for c in characters
     )
 
-    character_names = [c["name"] for c in characters]
-
     example_pattern = ""
-    if len(character_names) >= 2:
+    if len(characters) >= 2:
         example_pattern = (
             "\nExample format:\n" +
-            "\n".join([f"{n}: [their dialogue]" for n in character_names[:3]]) +
+            "\n".join([f"{c.name}: [their dialogue]" for c in characters[:3]]) +
             "\n...and so on, strictly rotating.\n"
         )
 
-    # ---------------- FIXED: f-string for {target_lines} ----------------
-    return f"""
-<|system|>
-You are an AI assistant generating dialogue for NPCs in video games.
+    return prompt_builder.build(dialogue_request.dialogue_length, {
+        "context": dialogue_request.context,
+        "characters": characters_str,
+        "example_pattern": example_pattern,
+    })
+
+
+def prepare_prompt(dialogue_request: DialogueRequest) -> Tuple[Prompt, int]:
+    """
+    The prompt and the completion budget (max_tokens) for a request; a 413
+    when both together don't fit the model's context window, before any
+    upstream call is made.
+    """
+    with stage_seconds.labels("create_prompt").time():
+        prompt = create_prompt(dialogue_request)
+    num_predict = token_budget.max_tokens(LLM_MODEL_NAME, dialogue_request.dialogue_length)
+    try:
+        prompt_builder.check_fits(prompt, num_predict)
+    except PromptTooLong as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    return prompt, num_predict
+
+
+# ============================================================
+# LLM RESPONSE PROCESSING (unchanged except higher token use)
+# ============================================================
+def completion_tokens(usage: Usage, chunk_count: int, char_count: int) -> int:
+    """
+    Completion tokens a stream consumed: the provider's usage block when it
+    sent one, else counted here (a stream closed early never gets it).
+    """
+    if usage.completion_tokens is not None:
+        return usage.completion_tokens
+    if backend.chunks_are_tokens:
+        llm_tokens.labels(backend.name, "completion").inc(chunk_count)
+        return chunk_count
+    tokens = estimate_tokens(char_count)
+    llm_tokens.labels(backend.name, "completion_estimated").inc(tokens)
+    return tokens
+
+
+async def collect_dialogue_lines(
+    prompt: Prompt, num_predict: int, target_lines: int
+) -> Tuple[List[DialogueLine], int]:
+    """
+    Streams the completion and stops as soon as target_lines dialogue lines
+    have been parsed. Closing the stream closes the upstream request, so the
+    tokens past the last needed line are never generated or waited on.
+
+    Returns the parsed lines and the completion tokens consumed.
+    """
+    usage = track_usage()
+    parser = DialogueLineParser()
+    lines: List[DialogueLine] = []
+    chunk_count = char_count = 0
+    parse_seconds = 0.0
+    chunks = backend.stream(
+        prompt.content,
+        max_tokens=num_predict,
+        temperature=LLM_TEMPERATURE,
+        stop_after_lines=target_lines,
+    )
+    try:
+        async for chunk in chunks:
+            chunk_count += 1
+            char_count += len(chunk)
+            started = time.perf_counter()
+            lines.extend(parser.feed(chunk))
+            parse_seconds += time.perf_counter() - started
+            if len(lines) >= target_lines:
+                break
+        else:
+            lines.extend(parser.flush())
+    finally:
+        await chunks.aclose()
+    stage_seconds.labels("parse").observe(parse_seconds)
+    return lines, completion_tokens(usage, chunk_count, char_count)
+
+
+async def get_llm_response(
+    prompt: Prompt,
+    num_predict: int,
+    target_lines: int = 48,
+    dialogue_length: Optional[str] = None,
+    quota_key: Optional[str] = None,
+) -> str:
+    try:
+        if LLM_EARLY_STOP:
+            lines, tokens = await collect_dialogue_lines(prompt, num_predict, target_lines)
+        else:
+            usage = track_usage()
+            content = await backend.generate(
+                prompt.content, max_tokens=num_predict, temperature=LLM_TEMPERATURE
+            )
+            # Extract lines matching Character: text
+            with stage_seconds.labels("parse").time():
+                lines = parse_dialogue_lines(content)
+            tokens = usage.completion_tokens
+            if tokens is None:
+                tokens = estimate_tokens(len(content))
+                llm_tokens.labels(backend.name, "completion_estimated").inc(tokens)
+
+        lines = lines[:target_lines]
+        if dialogue_length is not None:
+            token_budget.record(LLM_MODEL_NAME, dialogue_length, tokens, len(lines))
+        if quota_key is not None:
+            await rate_limiter.charge_tokens(quota_key, tokens + prompt.tokens)
+
+        # Trim to target_lines
+        return "\n".join(format_line(line) for line in lines)
+
+    except Exception as e:
+        raise RuntimeError(f"LLM request failed: {e}")
+
 
-STRICT RULES:
-- Generate EXACTLY {target_lines} dialogue lines.
-- Follow strict rotation of characters in the given order.
-- Format MUST be: CharacterName: dialogue text
-- NO actions, NO asterisks (*), NO parentheses, NO stage directions.
-- ONLY plain spoken dialogue.
-- If any character would perform an action, OMIT it entirely.
+# ============================================================
+# CACHED GENERATION
+# ============================================================
+async def generate_dialogue_text(
+    dialogue_request: DialogueRequest, quota_key: Optional[str] = None
+) -> str:
+    """
+    prepare_prompt → get_llm_response, fronted by the response cache.
+
+    cache="prefer" serves a cached dialogue when one exists, "only" never
+    calls the model (404 on a miss), and "bypass" always regenerates and
+    refreshes the cached entry. Concurrent misses for the same key share a
+    single upstream call, whose tokens are charged to quota_key of the
+    caller that started it.
+    """
+    config = LENGTH_CONFIG[dialogue_request.dialogue_length]
+    key = cache_key(
+        dialogue_request.model_dump(exclude={"cache"}),
+        LLM_MODEL_NAME,
+        {**config, "temperature": LLM_TEMPERATURE, "prompt_template": prompt_builder.template.name},
+    )
 
-{example_pattern}
-Begin immediately with the first character.
-</s>
+    if dialogue_request.cache != "bypass":
+        with stage_seconds.labels("cache_lookup").time():
+            cached = await response_cache.get(key)
+        if cached is not None:
+            return cached
+        if dialogue_request.cache == "only":
+            raise HTTPException(status_code=404, detail="No cached dialogue for this request")
+
+    async def generate() -> str:
+        prompt, num_predict = prepare_prompt(dialogue_request)
+        dialogue = await get_llm_response(
+            prompt,
+            num_predict,
+            config["target_lines"],
+            dialogue_request.dialogue_length,
+            quota_key,
+        )
+        # A short or empty answer is served once but not cached, so the next
+        # request gets a fresh attempt instead of the same bad dialogue
+        if len(dialogue.splitlines()) >= config["target_lines"]:
+            await response_cache.set(key, dialogue)
+        return dialogue
+
+    return await inflight.do(key, generate)
 
-<|user|>
-Context: {context}
 
-Characters (speak in this exact order, cycling continuously):
-{characters_str}
+async def run_until_disconnect(request: Request, coro):
+    """
+    Awaits coro, cancelling it if the client disconnects first so that an
+    abandoned request stops waiting on (and eventually cancels) its upstream
+    generation.
+    """
+    work = asyncio.ensure_future(coro)
 
-Generate exactly {target_lines} lines of pure dialogue:
-</s>
+    async def wait_for_disconnect():
+        while (await request.receive())["type"] != "http.disconnect":
+            pass
 
-<|assistant|>
-""".strip()
+    watcher = asyncio.ensure_future(wait_for_disconnect())
+    try:
+        await asyncio.wait({work, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+
+    if not work.done():
+        work.cancel()
+        raise HTTPException(status_code=499, detail="Client closed request")
+    return work.result()
 
 
 # ============================================================
-# LLM RESPONSE PROCESSING (unchanged except higher token use)
+# RATE LIMITING
 # ============================================================
-def get_llm_response(prompt: str, num_predict: int, target_lines: int = 48) -> str:
-    try:
-        completion = client.chat.completions.create(
-            model=LLM_MODEL_NAME,
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=num_predict,
-            temperature=0.7
+def client_ip(request: Request) -> str:
+    """
+    The caller's address. Behind RATE_LIMIT_PROXY_HOPS proxies it is read
+    from X-Forwarded-For, counting from the right: entries further left were
+    sent by the client and can't be trusted.
+    """
+    if RATE_LIMIT_PROXY_HOPS > 0:
+        forwarded = [h.strip() for h in request.headers.get("x-forwarded-for", "").split(",") if h.strip()]
+        if forwarded:
+            return forwarded[-min(RATE_LIMIT_PROXY_HOPS, len(forwarded))]
+    return request.client.host if request.client else "unknown"
+
+
+async def get_quota_key(request: Request) -> str:
+    """
+    Callers presenting an API token are limited per user (an invalid token
+    is a 401); anonymous callers, like the web frontend, per client IP.
+    """
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        username = await get_current_user_by_api_token(
+            HTTPAuthorizationCredentials(scheme=scheme, credentials=token)
         )
+        return f"user:{username}"
+    return f"ip:{client_ip(request)}"
 
-        message = completion.choices[0].message
-        content = message.content or ""
 
-        # Extract lines matching Character: text
-        lines = []
-        for line in content.split("\n"):
-            if ":" in line:
-                name, text = line.split(":", 1)
-                if name.strip() and text.strip():
-                    lines.append(f"{name.strip()}: {text.strip()}")
+def too_many_requests(e: RateLimitExceeded) -> HTTPException:
+    retry_after = max(1, math.ceil(e.retry_after))
+    return HTTPException(status_code=429, detail=e.detail, headers={"Retry-After": str(retry_after)})
 
-        # Trim to target_lines
-        if len(lines) >= target_lines:
-            return "\n".join(lines[:target_lines])
 
-        return "\n".join(lines)
+async def admit_request(request: Request) -> str:
+    """Checks the caller's request rate and token quota; returns their quota key."""
+    quota_key = await get_quota_key(request)
+    try:
+        await rate_limiter.check_request(quota_key)
+    except RateLimitExceeded as e:
+        raise too_many_requests(e)
+    return quota_key
 
-    except Exception as e:
-        raise RuntimeError(f"LLM request failed: {e}")
+
+async def dialogue_request_body(request: Request) -> DialogueRequest:
+    """
+    Validates the raw body straight into a DialogueRequest: pydantic-core
+    parses the JSON itself, with no intermediate dict to build and re-walk.
+    """
+    try:
+        return DialogueRequest.model_validate_json(await request.body())
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def generate_with_slot(dialogue_request: DialogueRequest, quota_key: str) -> str:
+    """
+    For work that runs detached from a request (batch items, background
+    jobs): checks the token quota, then waits for a concurrent-generation
+    slot instead of failing fast. Raises RateLimitExceeded.
+    """
+    await rate_limiter.check_tokens(quota_key)
+    lease = await rate_limiter.wait_for_slot(quota_key)
+    try:
+        return await generate_dialogue_text(dialogue_request, quota_key)
+    finally:
+        await rate_limiter.release_slot(quota_key, lease)
+
+
+async def generate_within_limits(
+    request: Request, dialogue_request: DialogueRequest, quota_key: str
+) -> str:
+    try:
+        lease = await rate_limiter.acquire_slot(quota_key)
+    except RateLimitExceeded as e:
+        raise too_many_requests(e)
+    try:
+        return await run_until_disconnect(request, generate_dialogue_text(dialogue_request, quota_key))
+    finally:
+        await rate_limiter.release_slot(quota_key, lease)
 
 
 # ============================================================
@@ -151,82 +433,429 @@ async def root():
     return {"message": f"NPC Dialogue Generator API running with {LLM_MODEL_NAME}"}
 
 
+@app.get("/cache/stats")
+async def cache_stats():
+    return response_cache.snapshot()
+
+
+@app.get("/llm/backends")
+async def llm_backend_stats():
+    if isinstance(backend, BackendRouter):
+        return backend.stats()
+    return [{"backend": backend.name, "model": backend.model}]
+
+
+@app.get("/llm/budget")
+async def llm_budget_stats():
+    return token_budget.snapshot()
+
+
+@app.get("/llm/prompt")
+async def llm_prompt_info():
+    return prompt_builder.snapshot()
+
+
+@app.get("/db/pool")
+async def db_pool_stats():
+    return mongo.pool_metrics.snapshot()
+
+
 # ============================================================
 # JSON FILE UPLOAD (FIXED)
 # ============================================================
 @app.post("/generate_dialogue_from_file", response_model=DialogueResponse)
 async def generate_dialogue_from_file(
+    request: Request,
     file: UploadFile = File(...),
-    dialogue_length: Literal["Short", "Medium", "Long"] = Form(None)
+    dialogue_length: Literal["Short", "Medium", "Long"] = Form(None),
+    cache: CacheMode = Form("prefer"),
+    concurrency: int = Query(BATCH_MAX_CONCURRENCY, ge=1, le=BATCH_MAX_CONCURRENCY),
 ):
-    if not file.filename.endswith(".json"):
-        raise HTTPException(status_code=400, detail="Only JSON files supported")
+    """
+    A .json file holds one scene. A .jsonl file holds one scene per line;
+    each is validated and started as soon as its line has been read, and
+    results stream back as NDJSON exactly like /generate_dialogues/batch.
+    """
+    is_jsonl = file.filename.endswith(".jsonl")
+    if not (is_jsonl or file.filename.endswith(".json")):
+        raise HTTPException(status_code=400, detail="Only JSON or JSONL files supported")
+    quota_key = await admit_request(request)
+
+    def scene_request(scene: Dict[str, Any]) -> DialogueRequest:
+        characters = [Character(**c) for c in scene.get("characters")]
+        return DialogueRequest(
+            context=scene.get("context"),
+            characters=characters,
+            dialogue_length=dialogue_length or scene.get("dialogue_length") or "Medium",
+            cache=cache
+        )
 
     try:
-        content = await file.read()
-        json_data = json.loads(content.decode("utf-8"))
+        check_upload_size(file)
+        if is_jsonl:
+            return StreamingResponse(
+                run_batch(
+                    iter_jsonl_upload(file),
+                    lambda line: scene_request(json.loads(line)),
+                    concurrency, quota_key,
+                ),
+                media_type="application/x-ndjson",
+            )
+
+        dialogue_request = scene_request(await read_json_upload(file))
+        dialogue = await generate_within_limits(request, dialogue_request, quota_key)
+
+        return FastJSONResponse(dialogue_result(dialogue))
+
+    except HTTPException:
+        raise
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        context = json_data.get("context")
-        characters_data = json_data.get("characters")
-        json_length = json_data.get("dialogue_length")
 
-        if dialogue_length is None:  
-            dialogue_length = json_length or "Medium"
+# ============================================================
+# DIRECT JSON POST ENDPOINT
+# ============================================================
+@app.post("/generate_dialogue", response_model=DialogueResponse)
+async def generate_dialogue(
+    request: Request,
+    quota_key: str = Depends(admit_request),
+    dialogue_request: DialogueRequest = Depends(dialogue_request_body),
+):
+    try:
+        dialogue = await generate_within_limits(request, dialogue_request, quota_key)
 
-        characters = [Character(**c) for c in characters_data]
+        return FastJSONResponse(dialogue_result(dialogue))
 
-        dialogue_request = DialogueRequest(
-            context=context,
-            characters=characters,
-            dialogue_length=dialogue_length
-        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        prompt = create_prompt(dialogue_request.dict())
 
-        length_config = {
-            "Short":  {"max_tokens": 1500, "target_lines": 20},
-            "Medium": {"max_tokens": 3000, "target_lines": 30},
-            "Long":   {"max_tokens": 4500, "target_lines": 40}
-        }
-        config = length_config[dialogue_length]
+# ============================================================
+# STREAMING (SERVER-SENT EVENTS) ENDPOINT
+# ============================================================
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {dumps(data).decode()}\n\n"
 
-        dialogue = get_llm_response(prompt, config["max_tokens"], config["target_lines"])
 
-        return DialogueResponse(
-            generated_dialogue=dialogue,
-            model_used=LLM_MODEL_NAME,
-            timestamp=datetime.datetime.utcnow().isoformat() + "Z"
-        )
+async def stream_dialogue_events(prompt: Prompt, num_predict: int, dialogue_length: str, quota_key: str):
+    # The slot is taken here rather than in the endpoint so that it is only
+    # held while the stream runs; a client gone before it starts holds none
+    try:
+        lease = await rate_limiter.acquire_slot(quota_key)
+    except RateLimitExceeded as e:
+        yield sse_event("error", {"detail": e.detail, "retry_after": math.ceil(e.retry_after)})
+        return
+
+    target_lines = LENGTH_CONFIG[dialogue_length]["target_lines"]
+    usage = track_usage()
+    parser = DialogueLineParser()
+    chunks = backend.stream(
+        prompt.content,
+        max_tokens=num_predict,
+        temperature=LLM_TEMPERATURE,
+        stop_after_lines=target_lines,
+    )
+    emitted = chunk_count = char_count = 0
 
+    try:
+        async for chunk in chunks:
+            chunk_count += 1
+            char_count += len(chunk)
+            for speaker, text in parser.feed(chunk):
+                yield sse_event("line", {"index": emitted, "speaker": speaker, "text": text})
+                emitted += 1
+                if emitted >= target_lines:
+                    break
+            if emitted >= target_lines:
+                break
+        else:
+            for speaker, text in parser.flush()[: target_lines - emitted]:
+                yield sse_event("line", {"index": emitted, "speaker": speaker, "text": text})
+                emitted += 1
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        yield sse_event("error", {"detail": f"LLM request failed: {e}"})
+        return
+    finally:
+        # Release the upstream stream (and its concurrency slot) right away
+        await chunks.aclose()
+        await rate_limiter.release_slot(quota_key, lease)
+
+    tokens = completion_tokens(usage, chunk_count, char_count)
+    token_budget.record(LLM_MODEL_NAME, dialogue_length, tokens, emitted)
+    await rate_limiter.charge_tokens(quota_key, tokens + prompt.tokens)
+    yield sse_event("done", {
+        "line_count": emitted,
+        "model_used": LLM_MODEL_NAME,
+        "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+    })
+
+
+@app.post("/generate_dialogue/stream")
+async def generate_dialogue_stream(
+    quota_key: str = Depends(admit_request),
+    dialogue_request: DialogueRequest = Depends(dialogue_request_body),
+):
+    """
+    Same body as /generate_dialogue, but each finished `Name: text` line is
+    sent as a `line` event as soon as the model completes it, followed by a
+    final `done` (or `error`) event.
+    """
+    try:
+        prompt, num_predict = prepare_prompt(dialogue_request)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return StreamingResponse(
+        stream_dialogue_events(prompt, num_predict, dialogue_request.dialogue_length, quota_key),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 # ============================================================
-# DIRECT JSON POST ENDPOINT
+# BATCH ENDPOINT (NDJSON, COMPLETION ORDER)
 # ============================================================
-@app.post("/generate_dialogue", response_model=DialogueResponse)
-async def generate_dialogue(request: Request):
+async def iter_items(items: List[Any]):
+    for item in items:
+        yield item
+
+
+async def run_batch(
+    items: AsyncIterable[Any],
+    build_request: Callable[[Any], DialogueRequest],
+    concurrency: int,
+    quota_key: str,
+):
+    """
+    Runs build_request(item) for each item and yields NDJSON results in
+    completion order. The next item is only pulled once fewer than
+    `concurrency` are running or waiting to be written out, so neither a
+    long upload nor a slow reader makes results pile up in memory. If the
+    items themselves fail (say an upload turns out too large), that is
+    reported as a final error line without an index.
+
+    Each item generates while holding one of quota_key's concurrent-
+    generation slots, waiting up to RATE_LIMIT_SLOT_WAIT for one, so the
+    caller's limit holds across all of their requests and batches.
+    """
+    slots = asyncio.Semaphore(concurrency)
+    results: asyncio.Queue = asyncio.Queue()
+    tasks: Set[asyncio.Task] = set()
+
+    async def run_one(index: int, item: Any):
+        try:
+            dialogue_request = build_request(item)
+            dialogue = await generate_with_slot(dialogue_request, quota_key)
+        except RateLimitExceeded as e:
+            result = {"index": index, "status": "error", "detail": e.detail}
+        except HTTPException as e:
+            result = {"index": index, "status": "error", "detail": e.detail}
+        except Exception as e:
+            result = {"index": index, "status": "error", "detail": str(e)}
+        else:
+            result = {
+                "index": index,
+                "status": "ok",
+                "generated_dialogue": dialogue,
+                "model_used": LLM_MODEL_NAME,
+                "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+            }
+        results.put_nowait(result)
+
+    async def dispatch():
+        index = 0
+        try:
+            async for item in items:
+                await slots.acquire()
+                task = asyncio.ensure_future(run_one(index, item))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                index += 1
+        except Exception as e:
+            await slots.acquire()
+            results.put_nowait({"status": "error", "detail": str(e)})
+        if tasks:
+            await asyncio.wait(tasks)
+        results.put_nowait(None)
+
+    dispatcher = asyncio.ensure_future(dispatch())
+    try:
+        while True:
+            result = await results.get()
+            if result is None:
+                break
+            yield dumps(result) + b"\n"
+            slots.release()
+    finally:
+        # Client went away mid-batch: stop reading items and cancel the rest
+        dispatcher.cancel()
+        for task in list(tasks):
+            task.cancel()
+
+
+@app.post("/generate_dialogues/batch")
+async def generate_dialogues_batch(
+    request: Request,
+    concurrency: int = Query(BATCH_MAX_CONCURRENCY, ge=1, le=BATCH_MAX_CONCURRENCY),
+):
+    """
+    Expects a JSON array of /generate_dialogue bodies. Results are streamed
+    back as NDJSON in completion order, one object per item tagged with its
+    `index`; an invalid or failed item yields a `status: "error"` line
+    instead of failing the batch.
+
+    A batch counts as one request against the caller's limits. Each item
+    waits for one of their concurrent-generation slots while it runs and is
+    charged to their upstream token quota.
+    """
+    quota_key = await admit_request(request)
     try:
-        data = await request.json()
-        dialogue_request = DialogueRequest(**data)
+        items = await request.json()
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        prompt = create_prompt(dialogue_request.dict())
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array of dialogue requests")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {BATCH_MAX_ITEMS} items")
+
+    return StreamingResponse(
+        run_batch(iter_items(items), DialogueRequest.model_validate, concurrency, quota_key),
+        media_type="application/x-ndjson",
+    )
 
-        length_map = {
-            "Short":  {"max_tokens": 1500, "target_lines": 20},
-            "Medium": {"max_tokens": 3000, "target_lines": 30},
-            "Long":   {"max_tokens": 4500, "target_lines": 40}
-        }
-        config = length_map[dialogue_request.dialogue_length]
 
-        dialogue = get_llm_response(prompt, config["max_tokens"], config["target_lines"])
+# ============================================================
+# BACKGROUND JOBS (FOR LONG GENERATIONS)
+# ============================================================
+async def run_dialogue_job(request_data: Dict[str, Any]) -> Dict[str, Any]:
+    dialogue_request = DialogueRequest.model_validate(request_data)
+    quota_key = request_data.get("quota_key")
+    if quota_key is None:
+        dialogue = await generate_dialogue_text(dialogue_request)
+    else:
+        dialogue = await generate_with_slot(dialogue_request, quota_key)
+    return dialogue_result(dialogue)
+
+
+job_queue = JobQueue(
+    store=MongoJobStore(mongo.jobs_collection) if JOB_STORE == "mongo" else MemoryJobStore(),
+    runner=run_dialogue_job,
+    workers=JOB_WORKERS,
+    max_queued=JOB_MAX_QUEUED,
+    max_queued_per_key=JOB_MAX_QUEUED_PER_USER,
+)
 
-        return DialogueResponse(
-            generated_dialogue=dialogue,
-            model_used=LLM_MODEL_NAME,
-            timestamp=datetime.datetime.utcnow().isoformat() + "Z"
+
+@app.post("/jobs", status_code=202)
+async def submit_job(
+    priority: Priority = Query("normal"),
+    quota_key: str = Depends(admit_request),
+    dialogue_request: DialogueRequest = Depends(dialogue_request_body),
+):
+    """
+    Queues a /generate_dialogue body for a background worker and returns its
+    job id immediately. Poll GET /jobs/{job_id} for the result.
+    """
+    # A prompt that can't fit the context window is refused now, not left to fail later
+    prepare_prompt(dialogue_request)
+    try:
+        job = await job_queue.submit(
+            {**dialogue_request.model_dump(), "quota_key": quota_key}, priority, key=quota_key
         )
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
 
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    return {"job_id": job["id"], "status": job["status"], "priority": job["priority"]}
+
+
+@app.get("/jobs/stats")
+async def job_stats():
+    return job_queue.stats()
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await job_queue.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    for internal in ("request", "key", "owner", "heartbeat_at"):
+        job.pop(internal, None)
+    return job
+
+
+# ============================================================
+# METRICS (PROMETHEUS TEXT FORMAT)
+# ============================================================
+def local_engine_stats() -> List[Tuple[str, Dict[str, Any]]]:
+    """(model, stats) for every loaded local model, whether or not it sits behind a router."""
+    backends = [s.backend for s in backend.states] if isinstance(backend, BackendRouter) else [backend]
+    return [(b.model, b.engine.stats()) for b in backends if getattr(b, "engine", None) is not None]
+
+
+@REGISTRY.collector
+def collect_service_stats():
+    """Reads the counters the cache, queue, pool and token cache already keep."""
+    cache = response_cache.snapshot()
+    yield "npc_response_cache_lookups_total", "counter", "Response cache lookups by result.", [
+        ({"result": "memory_hit"}, cache["memory_hits"]),
+        ({"result": "disk_hit"}, cache["disk_hits"]),
+        ({"result": "miss"}, cache["misses"]),
+    ]
+    yield "npc_response_cache_stores_total", "counter", "Dialogues written to the response cache.", [
+        ({}, cache["stores"]),
+    ]
+    yield "npc_response_cache_memory_bytes", "gauge", "Bytes held by the in-memory response cache.", [
+        ({}, cache["memory_bytes"]),
+    ]
+    yield "npc_singleflight_in_flight", "gauge", "Distinct generations currently shared by callers.", [
+        ({}, inflight.in_flight()),
+    ]
+
+    jobs = job_queue.stats()
+    yield "npc_jobs", "gauge", "Background jobs by state.", [
+        ({"state": "queued"}, jobs["queued"]),
+        ({"state": "running"}, jobs["running"]),
+    ]
+    yield "npc_jobs_total", "counter", "Background jobs by outcome.", [
+        ({"outcome": outcome}, jobs[outcome]) for outcome in ("submitted", "rejected", "succeeded", "failed")
+    ]
+
+    pool = mongo.pool_metrics.snapshot()
+    yield "npc_mongo_pool_connections", "gauge", "MongoDB pool connections by state.", [
+        ({"state": "open"}, pool["open_connections"]),
+        ({"state": "checked_out"}, pool["checked_out"]),
+    ]
+    yield "npc_rate_limit_rejections_total", "counter", "Requests refused with 429 by limit.", [
+        ({"limit": limit}, count) for limit, count in rate_limiter.rejections.items()
+    ]
+    yield "npc_api_token_cache_lookups_total", "counter", "API token cache lookups by result.", [
+        ({"result": "hit"}, api_token_cache.hits),
+        ({"result": "miss"}, api_token_cache.misses),
+    ]
+
+    engines = local_engine_stats()
+    yield "npc_local_engine_queued", "gauge", "Requests waiting for the local model's next batch.", [
+        ({"model": model}, stats["queued"]) for model, stats in engines
+    ]
+    yield "npc_local_engine_batches_total", "counter", "Batched generate() calls run by the local model.", [
+        ({"model": model}, stats["batches_run"]) for model, stats in engines
+    ]
+    yield "npc_local_engine_requests_total", "counter", "Requests served by the local model.", [
+        ({"model": model}, stats["requests_served"]) for model, stats in engines
+    ]
+    yield "npc_local_engine_prefix_hits_total", "counter", "Local requests that reused a cached prompt prefix.", [
+        ({"model": model}, stats["prefix_hits"]) for model, stats in engines
+    ]
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
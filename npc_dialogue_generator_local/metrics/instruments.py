@@ -0,0 +1,34 @@
+# metrics/instruments.py
+from metrics.registry import Counter, Gauge, Histogram
+
+# --- HTTP (recorded by MetricsMiddleware) ---
+http_requests = Counter(
+    "npc_http_requests_total", "HTTP responses by route template and status code.",
+    ("method", "route", "status"),
+)
+http_request_seconds = Histogram(
+    "npc_http_request_duration_seconds", "Time from request start to the last body byte.",
+    ("method", "route"),
+)
+http_in_flight = Gauge("npc_http_requests_in_flight", "HTTP requests currently being served.")
+
+# --- Pipeline stages ---
+# create_prompt, cache_lookup, llm_upstream, llm_first_chunk, parse,
+# auth_lookup, password_hash
+stage_seconds = Histogram(
+    "npc_stage_duration_seconds", "Time spent in each stage of request handling.", ("stage",)
+)
+
+# --- Upstream LLM ---
+llm_requests = Counter(
+    "npc_llm_requests_total", "Upstream generations by backend and outcome.", ("backend", "outcome")
+)
+llm_in_flight = Gauge(
+    "npc_llm_requests_in_flight", "Upstream generations currently running.", ("backend",)
+)
+llm_tokens = Counter(
+    "npc_llm_tokens_total",
+    "Upstream tokens by kind (prompt, completion, or completion_estimated when "
+    "the backend doesn't report usage).",
+    ("backend", "kind"),
+)
@@ -0,0 +1,41 @@
+# metrics/middleware.py
+import time
+
+from metrics.instruments import http_in_flight, http_request_seconds, http_requests
+
+
+class MetricsMiddleware:
+    """
+    Plain ASGI middleware (no BaseHTTPMiddleware task/stream overhead) that
+    records per-route status codes, latency and in-flight requests.
+
+    Routes are labelled by their template (/jobs/{job_id}), never the raw
+    path, so label cardinality stays bounded; unrouted paths share one label.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_in_flight.dec()
+            route = getattr(scope.get("route"), "path", "unmatched")
+            method = scope["method"]
+            http_requests.labels(method, route, str(status)).inc()
+            http_request_seconds.labels(method, route).observe(time.perf_counter() - started)
@@ -0,0 +1,199 @@
+# metrics/registry.py
+import bisect
+import time
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# Seconds; spans sub-millisecond hooks up to multi-minute generations
+DEFAULT_BUCKETS = (
+    0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0,
+)
+
+Sample = Tuple[Dict[str, str], float]
+# A collector returns (name, type, help, samples) families, read at scrape time
+Collector = Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class _Timer:
+    __slots__ = ("child", "started")
+
+    def __init__(self, child: "_HistogramChild"):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.started)
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self) -> _Timer:
+        return _Timer(self)
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        (registry or REGISTRY).register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _render(self, out: List[str]):
+        out.append(f"# HELP {self.name} {self.documentation}")
+        out.append(f"# TYPE {self.name} {self.type}")
+        for values, child in list(self._children.items()):
+            self._render_child(out, dict(zip(self.labelnames, values)), child)
+
+    def _render_child(self, out: List[str], labels: Dict[str, str], child):
+        out.append(f"{self.name}{_format_labels(labels)} {_format_value(child.value)}")
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self.labels().dec(amount)
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(*args, **kwargs)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self) -> _Timer:
+        return self.labels().time()
+
+    def _render_child(self, out: List[str], labels: Dict[str, str], child: _HistogramChild):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            bucket_labels = _format_labels({**labels, "le": _format_value(bound)})
+            out.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+        out.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(child.sum)}")
+        out.append(f"{self.name}_count{_format_labels(labels)} {child.count}")
+
+
+class Registry:
+    """
+    Minimal Prometheus registry: metrics update plain Python numbers on the
+    event loop (no locks, no I/O) and are only formatted when scraped.
+    Collectors expose existing in-process stats without per-request hooks.
+    """
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Collector] = []
+
+    def register(self, metric: _Metric):
+        self._metrics.append(metric)
+
+    def collector(self, fn: Collector) -> Collector:
+        self._collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        out: List[str] = []
+        for metric in self._metrics:
+            metric._render(out)
+        for collect in self._collectors:
+            for name, metric_type, documentation, samples in collect():
+                out.append(f"# HELP {name} {documentation}")
+                out.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    out.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(out) + "\n"
+
+
+REGISTRY = Registry()
@@ -0,0 +1,132 @@
+# ratelimit/limiter.py
+import asyncio
+import os
+import time
+from typing import Optional, Union
+
+from ratelimit.stores import build_rate_limit_store
+
+# --- Per-user limits (per API-token user, or per client IP when anonymous) ---
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_REQUESTS_PER_MINUTE = float(os.getenv("RATE_LIMIT_REQUESTS_PER_MINUTE", "30"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "10"))
+RATE_LIMIT_MAX_CONCURRENT = int(os.getenv("RATE_LIMIT_MAX_CONCURRENT", "2"))
+RATE_LIMIT_TOKENS_PER_MINUTE = float(os.getenv("RATE_LIMIT_TOKENS_PER_MINUTE", "60000"))
+# A concurrency slot is reclaimed after this long even if it was never released
+RATE_LIMIT_SLOT_TTL = float(os.getenv("RATE_LIMIT_SLOT_TTL", "600"))
+# How long batch items and background jobs wait for a free slot before failing
+RATE_LIMIT_SLOT_WAIT = float(os.getenv("RATE_LIMIT_SLOT_WAIT", "300"))
+# How often a waiting caller retries; polling works the same for every store
+SLOT_POLL_SECONDS = 0.25
+# Reverse proxies in front of the app that append to X-Forwarded-For;
+# anonymous callers are keyed by the address the outermost of them saw. The
+# default of 1 matches the Render and Heroku routers the app is deployed
+# behind. Set 0 when serving directly (e.g. local uvicorn): the socket peer is
+# then the client, and a forged X-Forwarded-For could dodge the limit.
+RATE_LIMIT_PROXY_HOPS = int(os.getenv("RATE_LIMIT_PROXY_HOPS", "1"))
+
+Lease = Union[int, str]
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """
+    Three independent per-key limits in front of the upstream LLM:
+
+    - requests: a token bucket refilled at requests_per_minute, holding up
+      to burst requests;
+    - concurrency: at most max_concurrent generations at once;
+    - upstream tokens: a bucket refilled at tokens_per_minute that is charged
+      after each generation with what it actually used. A key that has
+      overdrawn it is refused until the balance is positive again.
+
+    Each check is one store operation on one key, so the hot path is O(1).
+    """
+
+    def __init__(
+        self,
+        store,
+        requests_per_minute: float = RATE_LIMIT_REQUESTS_PER_MINUTE,
+        burst: float = RATE_LIMIT_BURST,
+        max_concurrent: int = RATE_LIMIT_MAX_CONCURRENT,
+        tokens_per_minute: float = RATE_LIMIT_TOKENS_PER_MINUTE,
+        slot_ttl: float = RATE_LIMIT_SLOT_TTL,
+        enabled: bool = RATE_LIMIT_ENABLED,
+    ):
+        self.store = store
+        self.request_rate = requests_per_minute / 60
+        self.burst = burst
+        self.max_concurrent = max_concurrent
+        self.token_rate = tokens_per_minute / 60
+        self.token_capacity = tokens_per_minute
+        self.slot_ttl = slot_ttl
+        self.enabled = enabled
+        self.rejections = {"requests": 0, "concurrency": 0, "tokens": 0}
+
+    def _reject(self, limit: str, detail: str, retry_after: float):
+        self.rejections[limit] += 1
+        raise RateLimitExceeded(detail, retry_after)
+
+    async def check_tokens(self, key: str):
+        """Raises RateLimitExceeded while key's upstream token balance is overdrawn."""
+        if not self.enabled:
+            return
+        wait = await self.store.take(f"tokens:{key}", self.token_rate, self.token_capacity, 0)
+        if wait > 0:
+            self._reject("tokens", "Upstream token quota exhausted", wait)
+
+    async def check_request(self, key: str):
+        """Admits one request for key or raises RateLimitExceeded."""
+        if not self.enabled:
+            return
+        await self.check_tokens(key)
+        wait = await self.store.take(f"requests:{key}", self.request_rate, self.burst, 1)
+        if wait > 0:
+            self._reject("requests", "Too many requests", wait)
+
+    async def acquire_slot(self, key: str) -> Optional[Lease]:
+        """Takes one of key's concurrent-generation slots; release it with release_slot."""
+        if not self.enabled:
+            return None
+        lease = await self.store.acquire(f"slots:{key}", self.max_concurrent, self.slot_ttl)
+        if lease is None:
+            self._reject_concurrency()
+        return lease
+
+    async def wait_for_slot(self, key: str, timeout: float = RATE_LIMIT_SLOT_WAIT) -> Optional[Lease]:
+        """Like acquire_slot, but waits up to timeout seconds for one of key's slots to free up."""
+        if not self.enabled:
+            return None
+        deadline = time.monotonic() + timeout
+        while True:
+            lease = await self.store.acquire(f"slots:{key}", self.max_concurrent, self.slot_ttl)
+            if lease is not None:
+                return lease
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._reject_concurrency()
+            await asyncio.sleep(min(SLOT_POLL_SECONDS, remaining))
+
+    def _reject_concurrency(self):
+        self._reject("concurrency", f"At most {self.max_concurrent} concurrent generations per user", 1)
+
+    async def release_slot(self, key: str, lease: Optional[Lease]):
+        if lease is not None:
+            await self.store.release(f"slots:{key}", lease)
+
+    async def charge_tokens(self, key: str, tokens: int):
+        if self.enabled and tokens > 0:
+            await self.store.debit(f"tokens:{key}", self.token_rate, self.token_capacity, tokens)
+
+    async def close(self):
+        await self.store.close()
+
+
+def build_rate_limiter() -> RateLimiter:
+    return RateLimiter(build_rate_limit_store())
@@ -0,0 +1,175 @@
+# ratelimit/stores.py
+import itertools
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+# --- Store selection ---
+# "memory" limits each worker process on its own; "redis" shares the limits
+# between workers (needs `pip install redis`)
+RATE_LIMIT_STORE = os.getenv("RATE_LIMIT_STORE", "memory")
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+
+def _refill(bucket: _Bucket, rate: float, capacity: float, now: float):
+    bucket.tokens = min(capacity, bucket.tokens + (now - bucket.updated) * rate)
+    bucket.updated = now
+
+
+class MemoryRateLimitStore:
+    """
+    Token buckets and concurrency leases in this process.
+
+    Every operation touches one dict entry, so checks are O(1). Buckets live
+    in an LRU capped at max_keys; an evicted bucket simply starts full again.
+    Leases expire after their TTL so a slot leaked by a dropped connection
+    comes back on its own.
+    """
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, _Bucket]" = OrderedDict()
+        self._leases: Dict[str, List[Tuple[int, float]]] = {}
+        self._lease_ids = itertools.count()
+
+    def _bucket(self, key: str, capacity: float, now: float) -> _Bucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(capacity, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    async def take(self, key: str, rate: float, capacity: float, cost: float) -> float:
+        """Takes cost tokens if available; returns 0, or seconds until they would be."""
+        now = time.monotonic()
+        bucket = self._bucket(key, capacity, now)
+        _refill(bucket, rate, capacity, now)
+        if bucket.tokens >= cost:
+            bucket.tokens -= cost
+            return 0.0
+        return (cost - bucket.tokens) / rate
+
+    async def debit(self, key: str, rate: float, capacity: float, cost: float):
+        """Charges cost unconditionally; the balance may go negative."""
+        now = time.monotonic()
+        bucket = self._bucket(key, capacity, now)
+        _refill(bucket, rate, capacity, now)
+        bucket.tokens -= cost
+
+    async def acquire(self, key: str, limit: int, ttl: float) -> Optional[int]:
+        """Returns a lease id, or None if key already holds `limit` live leases."""
+        now = time.monotonic()
+        leases = [lease for lease in self._leases.get(key, ()) if lease[1] > now]
+        if len(leases) >= limit:
+            self._leases[key] = leases
+            return None
+        lease_id = next(self._lease_ids)
+        leases.append((lease_id, now + ttl))
+        self._leases[key] = leases
+        return lease_id
+
+    async def release(self, key: str, lease_id: int):
+        leases = [lease for lease in self._leases.get(key, ()) if lease[0] != lease_id]
+        if leases:
+            self._leases[key] = leases
+        else:
+            self._leases.pop(key, None)
+
+    async def close(self):
+        pass
+
+
+# KEYS[1]=bucket; ARGV: rate, capacity, cost, now, debit(0/1)
+_TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if ARGV[5] == '1' or tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+return tostring(wait)
+"""
+
+# KEYS[1]=lease set; ARGV: limit, now, expires_at, lease_id
+_ACQUIRE_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[4])
+redis.call('EXPIREAT', KEYS[1], math.ceil(tonumber(ARGV[3])))
+return 1
+"""
+
+
+class RedisRateLimitStore:
+    """
+    The same buckets and leases in Redis, so limits hold across workers.
+
+    Each check is a single Lua script call (one round trip, atomic). Leases
+    are sorted-set members scored by expiry, so crashed workers' slots expire.
+    """
+
+    def __init__(self, url: str = RATE_LIMIT_REDIS_URL, prefix: str = "npc:ratelimit:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("RATE_LIMIT_STORE=redis needs `pip install redis`")
+        self.prefix = prefix
+        self._redis = redis.from_url(url)
+        self._take = self._redis.register_script(_TAKE_SCRIPT)
+        self._acquire = self._redis.register_script(_ACQUIRE_SCRIPT)
+        self._lease_ids = itertools.count()
+        self._worker = f"{os.getpid()}-{id(self)}"
+
+    async def take(self, key: str, rate: float, capacity: float, cost: float) -> float:
+        wait = await self._take(keys=[self.prefix + key], args=[rate, capacity, cost, time.time(), 0])
+        return float(wait)
+
+    async def debit(self, key: str, rate: float, capacity: float, cost: float):
+        await self._take(keys=[self.prefix + key], args=[rate, capacity, cost, time.time(), 1])
+
+    async def acquire(self, key: str, limit: int, ttl: float) -> Optional[str]:
+        now = time.time()
+        lease_id = f"{self._worker}-{next(self._lease_ids)}"
+        acquired = await self._acquire(
+            keys=[self.prefix + key], args=[limit, now, now + ttl, lease_id]
+        )
+        return lease_id if acquired else None
+
+    async def release(self, key: str, lease_id: str):
+        await self._redis.zrem(self.prefix + key, lease_id)
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+def build_rate_limit_store(name: str = RATE_LIMIT_STORE):
+    if name == "memory":
+        return MemoryRateLimitStore()
+    if name == "redis":
+        return RedisRateLimitStore()
+    raise ValueError(f"Unknown RATE_LIMIT_STORE '{name}', expected memory or redis")
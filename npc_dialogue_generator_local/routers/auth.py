@@ -3,25 +3,19 @@ from dotenv import load_dotenv
 from fastapi import APIRouter, HTTPException, Depends, status
 from fastapi.security import OAuth2PasswordRequestForm
 from datetime import timedelta
-from motor.motor_asyncio import AsyncIOMotorClient
 from auth import utils
+from db.mongo import users_collection
+from metrics.instruments import stage_seconds
 from schemas.user import UserCreate, Token, UserModel
-import os
 import secrets
 
 router = APIRouter()
 load_dotenv()
-# --- Database Connection ---
-MONGODB_URL = os.getenv("MONGODB_URL")
-MONGODB_DB_NAME = "npc_forge_db"
-MONGODB_COLLECTION_NAME = "users"
-client = AsyncIOMotorClient(MONGODB_URL, tls=True, tlsAllowInvalidCertificates=True)
-database = client[MONGODB_DB_NAME]
-users_collection = database[MONGODB_COLLECTION_NAME]
 
 
 async def get_user(username: str):
-    user_doc = await users_collection.find_one({"username": username})
+    with stage_seconds.labels("auth_lookup").time():
+        user_doc = await users_collection.find_one({"username": username})
     if user_doc:
         return UserModel(**user_doc)
     return None
@@ -29,8 +23,17 @@ async def get_user(username: str):
 
 async def authenticate_user(username: str, password: str):
     user = await get_user(username)
-    if not user or not utils.verify_password(password, user.hashed_password):
+    if not user:
+        return False
+
+    verified, new_hash = await utils.verify_password_async(password, user.hashed_password)
+    if not verified:
         return False
+    if new_hash:
+        # Stored hash used an older cost factor; upgrade it while we have the password
+        await users_collection.update_one(
+            {"username": user.username}, {"$set": {"hashed_password": new_hash}}
+        )
     return user
 
 
@@ -43,7 +46,7 @@ async def signup(user_data: UserCreate):
             detail="Username already registered",
         )
 
-    hashed_password = utils.get_password_hash(user_data.password)
+    hashed_password = await utils.get_password_hash_async(user_data.password)
     new_user_doc = {
         "username": user_data.username,
         "email": user_data.email,
@@ -73,10 +76,23 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
 @router.post("/generate-api-token")
 async def generate_api_token(
     current_user_username: str = Depends(utils.get_current_user_username),
+    stateless: bool = False,
 ):
+    if stateless:
+        # Signed, long-lived token that is verified without a database lookup.
+        # It can't be revoked by rotation, only by retiring its signing key.
+        api_token = utils.create_access_token(
+            data={"sub": current_user_username, "scope": "api"},
+            expires_delta=timedelta(days=utils.API_JWT_EXPIRE_DAYS),
+        )
+        return {"api_token": api_token, "expires_in_days": utils.API_JWT_EXPIRE_DAYS}
+
     api_token = secrets.token_hex(32)
     # Store the API token in the user's database entry
     await users_collection.update_one(
         {"username": current_user_username}, {"$set": {"api_token": api_token}}
     )
+    # The previous token must stop working right away, at least on this worker
+    utils.api_token_cache.invalidate_user(current_user_username)
+    utils.api_token_cache.invalidate(api_token)
     return {"api_token": api_token}
@@ -0,0 +1,84 @@
+# tests/test_auth_tokens.py
+import asyncio
+import datetime
+
+import jwt
+import pytest
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+
+from auth import utils
+from auth.tokens import TokenVerifier
+
+HOUR = datetime.timedelta(hours=1)
+# At least 32 bytes, as HS256 keys should be
+KEY_ONE = "first-signing-key-0123456789abcdef"
+KEY_TWO = "second-signing-key-0123456789abcdef"
+OLD_KEY = "legacy-signing-key-0123456789abcdef"
+
+
+def as_api_token(token: str):
+    return asyncio.run(utils.get_current_user_by_api_token(
+        HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+    ))
+
+
+def as_session_token(token: str):
+    return asyncio.run(utils.get_current_user_username(token))
+
+
+def test_session_token_is_not_an_api_token():
+    session = utils.create_access_token({"sub": "bob"})
+    assert as_session_token(session) == "bob"
+    with pytest.raises(HTTPException) as exc:
+        as_api_token(session)
+    assert exc.value.status_code == 401
+
+
+def test_api_token_is_not_a_session_token():
+    api = utils.create_access_token({"sub": "bob", "scope": "api"}, HOUR)
+    assert as_api_token(api) == "bob"
+    with pytest.raises(HTTPException) as exc:
+        as_session_token(api)
+    assert exc.value.status_code == 401
+
+
+def test_rotation_by_kid():
+    old = TokenVerifier({"k1": KEY_ONE}, "k1")
+    token = old.encode({"sub": "bob"}, HOUR)
+    assert jwt.get_unverified_header(token)["kid"] == "k1"
+
+    # k2 is now active; tokens signed with k1 keep verifying while it is configured
+    rotated = TokenVerifier({"k1": KEY_ONE, "k2": KEY_TWO}, "k2")
+    assert rotated.decode(token)["sub"] == "bob"
+    assert jwt.get_unverified_header(rotated.encode({"sub": "bob"}, HOUR))["kid"] == "k2"
+
+    # Once k1 is retired its tokens are refused
+    retired = TokenVerifier({"k2": KEY_TWO}, "k2")
+    with pytest.raises(jwt.InvalidKeyError):
+        retired.decode(token)
+
+
+def test_legacy_token_without_kid():
+    legacy = jwt.encode(
+        {"sub": "bob", "exp": datetime.datetime.now(datetime.timezone.utc) + HOUR},
+        OLD_KEY,
+        algorithm="HS256",
+    )
+    verifier = TokenVerifier({"default": OLD_KEY, "k2": KEY_TWO}, "k2", legacy_kid="default")
+    assert verifier.decode(legacy)["sub"] == "bob"
+
+
+def test_bad_signature_and_expiry():
+    verifier = TokenVerifier({"k1": KEY_ONE}, "k1")
+    forged = TokenVerifier({"k1": "forged-signing-key-0123456789abcdef"}, "k1").encode({"sub": "bob"}, HOUR)
+    with pytest.raises(jwt.InvalidSignatureError):
+        verifier.decode(forged)
+    expired = verifier.encode({"sub": "bob"}, -HOUR)
+    with pytest.raises(jwt.ExpiredSignatureError):
+        verifier.decode(expired)
+
+
+def test_unknown_active_kid():
+    with pytest.raises(ValueError):
+        TokenVerifier({"k1": KEY_ONE}, "k2")
@@ -0,0 +1,56 @@
+# tests/test_cache.py
+import asyncio
+import sqlite3
+
+from llm import cache
+from llm.cache import SQLiteCache
+
+
+def test_disk_cache_trims_least_recently_used_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "DISK_PURGE_EVERY_WRITES", 2)
+    disk = SQLiteCache(str(tmp_path / "cache.db"), ttl=60, max_entries=2)
+
+    async def scenario():
+        await disk.set("a", "1")
+        await disk.set("b", "2")
+        await asyncio.sleep(0.01)
+        assert await disk.get("a") == "1"
+        await disk.set("c", "3")
+        # The fourth write purges, trimming "b": the least recently used
+        await disk.set("d", "4")
+        return [await disk.get(key) for key in "abcd"]
+
+    assert asyncio.run(scenario()) == [None, None, "3", "4"]
+    assert len(disk) == 2
+    disk.close()
+
+
+def test_disk_cache_purges_expired_rows_without_reads(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "DISK_PURGE_EVERY_WRITES", 2)
+    disk = SQLiteCache(str(tmp_path / "cache.db"), ttl=-1, max_entries=100)
+
+    async def scenario():
+        for key in "abcd":
+            await disk.set(key, "x")
+
+    asyncio.run(scenario())
+    assert len(disk) == 0
+    disk.close()
+
+
+def test_disk_cache_migrates_tables_without_access_times(tmp_path):
+    path = str(tmp_path / "cache.db")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE responses (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+    )
+    conn.executemany(
+        "INSERT INTO responses VALUES (?, ?, ?)", [("old", "1", 4e9), ("stale", "2", 0)]
+    )
+    conn.commit()
+    conn.close()
+
+    disk = SQLiteCache(path, ttl=60, max_entries=10)
+    assert len(disk) == 1
+    assert asyncio.run(disk.get("old")) == "1"
+    disk.close()
@@ -0,0 +1,104 @@
+# tests/test_jobs.py
+import asyncio
+
+import pytest
+
+from jobs.queue import JobQueue, QueueFullError
+from jobs.store import UNFINISHED, MemoryJobStore
+
+
+class SharedJobStore(MemoryJobStore):
+    """A MemoryJobStore that recovers stale jobs the way MongoJobStore does."""
+
+    async def heartbeat(self, owner, now):
+        for job in self._jobs.values():
+            if job["owner"] == owner and job["status"] in UNFINISHED:
+                job["heartbeat_at"] = now
+
+    async def claim_stale(self, owner, stale_before, now):
+        claimed = []
+        for job in self._jobs.values():
+            if job["status"] in UNFINISHED and job["heartbeat_at"] < stale_before:
+                job.update(owner=owner, heartbeat_at=now, status="queued", started_at=None)
+                claimed.append(dict(job))
+        return claimed
+
+
+def test_shutdown_requeues_running_jobs_for_recovery():
+    async def scenario():
+        store = SharedJobStore()
+        started = asyncio.Event()
+
+        async def slow_runner(request):
+            started.set()
+            await asyncio.sleep(10)
+
+        old = JobQueue(store, slow_runner, workers=1, max_queued=10, heartbeat_seconds=0.01)
+        old.start()
+        job = await old.submit({"scene": 1})
+        await started.wait()
+        await old.stop()
+        after_shutdown = (await store.get(job["id"]))["status"]
+
+        async def runner(request):
+            return {"done": request["scene"]}
+
+        new = JobQueue(store, runner, workers=1, max_queued=10, heartbeat_seconds=0.01)
+        new.start()
+        await asyncio.sleep(0.1)
+        await new.stop()
+        return after_shutdown, await store.get(job["id"]), new.stats()
+
+    after_shutdown, job, stats = asyncio.run(scenario())
+    assert after_shutdown == "queued"
+    assert job["status"] == "succeeded" and job["result"] == {"done": 1}
+    assert stats["recovered"] == 1
+
+
+def test_live_queue_keeps_its_jobs():
+    async def scenario():
+        store = SharedJobStore()
+        release = asyncio.Event()
+
+        async def runner(request):
+            await release.wait()
+            return "ok"
+
+        owner = JobQueue(store, runner, workers=1, max_queued=10, heartbeat_seconds=0.01)
+        other = JobQueue(store, runner, workers=1, max_queued=10, heartbeat_seconds=0.01)
+        owner.start()
+        other.start()
+        await owner.submit({})
+        await asyncio.sleep(0.1)
+        release.set()
+        await asyncio.sleep(0.02)
+        await owner.stop()
+        await other.stop()
+        return owner.stats(), other.stats()
+
+    owner_stats, other_stats = asyncio.run(scenario())
+    assert owner_stats["succeeded"] == 1
+    assert other_stats["recovered"] == 0
+
+
+def test_job_queue_caps_queued_jobs_per_key():
+    async def scenario():
+        async def runner(request):
+            return request
+
+        queue = JobQueue(MemoryJobStore(), runner, workers=1, max_queued=10, max_queued_per_key=2)
+        await queue.submit({}, key="user:a")
+        await queue.submit({}, key="user:a")
+        with pytest.raises(QueueFullError, match="per user"):
+            await queue.submit({}, key="user:a")
+        await queue.submit({}, key="user:b")
+        # Once a worker picks a job up it no longer counts against the key
+        queue.start()
+        await asyncio.sleep(0.01)
+        await queue.stop()
+        await queue.submit({}, key="user:a")
+        return queue.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["rejected"] == 1
+    assert stats["succeeded"] == 3
@@ -0,0 +1,62 @@
+# tests/test_ndjson.py
+import asyncio
+import json
+
+import pytest
+
+from llm.ndjson import NDJSONDecoder, aiter_tokens, collect_tokens, iter_ndjson, iter_tokens
+
+MESSAGES = [
+    {"response": "Bob: ", "done": False},
+    {"response": "Grüße, ", "done": False},
+    {"response": "traveller 🗡️", "done": False},
+    {"response": "", "done": True, "eval_count": 3},
+]
+STREAM = "".join(json.dumps(m, ensure_ascii=False) + "\n" for m in MESSAGES).encode()
+
+
+def split_every(data: bytes, size: int):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64, len(STREAM)])
+def test_decodes_any_chunking(size):
+    # Small sizes split multi-byte characters and lines across chunks
+    assert list(iter_ndjson(split_every(STREAM, size))) == MESSAGES
+
+
+def test_str_chunks_and_blank_lines():
+    decoder = NDJSONDecoder()
+    assert decoder.feed('{"a": 1}\n\n  \n{"b"') == [{"a": 1}]
+    assert decoder.feed(': 2}') == []
+    assert decoder.flush() == [{"b": 2}]
+
+
+def test_final_object_without_newline():
+    assert list(iter_ndjson([STREAM.rstrip(b"\n")])) == MESSAGES
+
+
+def test_malformed_line():
+    with pytest.raises(ValueError, match="Malformed NDJSON"):
+        list(iter_ndjson([b'{"response": "x"}\n{not json}\n']))
+
+
+def test_tokens_stop_at_done():
+    chunks = split_every(STREAM + b'{"response": "ignored"}\n', 5)
+    assert collect_tokens(iter_tokens(chunks)) == "Bob: Grüße, traveller 🗡️"
+
+
+def test_error_line_raises():
+    with pytest.raises(RuntimeError, match="model not found"):
+        list(iter_tokens([b'{"response": "a"}\n{"error": "model not found"}\n']))
+
+
+def test_async_tokens():
+    async def chunks():
+        for chunk in split_every(STREAM, 3):
+            yield chunk
+
+    async def collect():
+        return [token async for token in aiter_tokens(chunks())]
+
+    assert asyncio.run(collect()) == ["Bob: ", "Grüße, ", "traveller 🗡️"]
@@ -0,0 +1,88 @@
+# tests/test_postprocess.py
+import random
+
+import pytest
+
+from llm.postprocess import (
+    DialogueLineParser,
+    clean_dialogue_text,
+    format_line,
+    parse_dialogue_lines,
+    parse_line,
+)
+
+ECHOED = (
+    "<|system|>\nYou generate dialogue.\nRules: none\n</s>\n\n"
+    "<|user|>\nContext: a tavern\nBob: a character\n</s>\n\n<|assistant|>\n"
+    "Dialogue:\n**Bob**: (leans in) Your dialogue: it is stiff.\n"
+    "- Alice: Then fix it </s>\n"
+    "narration without a speaker\n"
+    "Bob:   \n"
+    "Bob: Fine."
+)
+TEXTS = [
+    ECHOED,
+    "Bob: hi <|system|>echo\nstill echo<|assistant|> there\nAlice: yo",
+    "Bob: hi <|user|>never closed\nAlice: x",
+    "Bob: no echo at all\nAlice: <|assistant|>stray marker",
+    "",
+]
+
+
+def test_parse_line():
+    assert parse_line("  **Bob**: (smiles) Hello there. ") == ("Bob", "Hello there.")
+    assert parse_line("- Alice:Hi") == ("Alice", "Hi")
+    assert parse_line("no speaker here") is None
+    assert parse_line("Bob:   ") is None
+    assert parse_line("x" * 41 + ": too long a speaker") is None
+
+
+def test_dialogue_heading_only_at_line_start():
+    assert parse_line("Bob: Your dialogue: it is stiff.") == ("Bob", "Your dialogue: it is stiff.")
+    assert parse_dialogue_lines("Dialogue:\n  dialogue: Bob: Hi.") == [("Bob", "Hi.")]
+
+
+def test_parse_dialogue_lines_drops_echo_and_noise():
+    assert parse_dialogue_lines(ECHOED) == [
+        ("Bob", "Your dialogue: it is stiff."),
+        ("Alice", "Then fix it"),
+        ("Bob", "Fine."),
+    ]
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_stream_matches_whole_text(text):
+    expected = parse_dialogue_lines(text)
+    rng = random.Random(text)
+    for _ in range(100):
+        parser = DialogueLineParser()
+        lines, i = [], 0
+        while i < len(text):
+            size = rng.randint(1, 12)
+            lines += parser.feed(text[i:i + size])
+            i += size
+        lines += parser.flush()
+        assert lines == expected
+
+
+def test_stream_returns_lines_as_they_complete():
+    parser = DialogueLineParser()
+    assert parser.feed("Bob: Hel") == []
+    assert parser.feed("lo.\nAli") == [("Bob", "Hello.")]
+    assert parser.feed("ce: Hi") == []
+    assert parser.flush() == [("Alice", "Hi")]
+    assert parser.flush() == []
+
+
+def test_format_line_round_trips():
+    line = ("Bob", "Hello there.")
+    assert parse_line(format_line(line)) == line
+
+
+def test_clean_dialogue_text():
+    assert clean_dialogue_text(ECHOED).startswith("**Bob**: Your dialogue: it is stiff.")
+    assert clean_dialogue_text("Bob: One. Two and") == "Bob: One."
+    assert clean_dialogue_text("Bob: no sentence end at all here at any point") == (
+        "Bob: no sentence end at all here at any point..."
+    )
+    assert clean_dialogue_text("Bob: Done!") == "Bob: Done!"
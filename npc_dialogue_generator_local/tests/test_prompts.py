@@ -0,0 +1,15 @@
+# tests/test_prompts.py
+from llm.prompts import context_window_for
+
+
+def test_default_models_have_known_windows():
+    assert context_window_for(["openai/gpt-oss-120b"], "") == 131072
+    assert context_window_for(["zephyr"], "") is None
+    # A router is checked against its smallest window
+    assert context_window_for(["openai/gpt-oss-120b", "TinyLlama/TinyLlama-1.1B-Chat-v1.0"], "") == 2048
+
+
+def test_configured_windows_override_known_ones():
+    assert context_window_for(["openai/gpt-oss-120b"], "8192") == 8192
+    assert context_window_for(["zephyr"], "zephyr=4096") == 4096
+    assert context_window_for(["openai/gpt-oss-120b"], "openai/gpt-oss-120b=32768, zephyr=4096") == 32768
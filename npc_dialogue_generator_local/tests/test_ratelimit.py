@@ -0,0 +1,127 @@
+# tests/test_ratelimit.py
+import asyncio
+
+import pytest
+
+from ratelimit import stores
+from ratelimit.limiter import RateLimiter, RateLimitExceeded
+from ratelimit.stores import MemoryRateLimitStore
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(stores.time, "monotonic", clock)
+    return clock
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_bucket_starts_full_and_refills(clock):
+    store = MemoryRateLimitStore()
+    for _ in range(3):
+        assert run(store.take("k", rate=1.0, capacity=3, cost=1)) == 0
+    assert run(store.take("k", rate=1.0, capacity=3, cost=1)) == pytest.approx(1.0)
+    clock.now += 0.5
+    assert run(store.take("k", rate=1.0, capacity=3, cost=1)) == pytest.approx(0.5)
+    clock.now += 0.5
+    assert run(store.take("k", rate=1.0, capacity=3, cost=1)) == 0
+    # Refill never goes past capacity
+    clock.now += 100
+    for _ in range(3):
+        assert run(store.take("k", rate=1.0, capacity=3, cost=1)) == 0
+    assert run(store.take("k", rate=1.0, capacity=3, cost=1)) > 0
+
+
+def test_debit_overdraws_until_refilled(clock):
+    store = MemoryRateLimitStore()
+    run(store.debit("k", rate=10.0, capacity=100, cost=150))
+    # 50 tokens in debt: even a zero-cost check waits until the balance is back to 0
+    assert run(store.take("k", rate=10.0, capacity=100, cost=0)) == pytest.approx(5.0)
+    clock.now += 5
+    assert run(store.take("k", rate=10.0, capacity=100, cost=0)) == 0
+    assert run(store.take("k", rate=10.0, capacity=100, cost=1)) == pytest.approx(0.1)
+
+
+def test_evicted_bucket_starts_full(clock):
+    store = MemoryRateLimitStore(max_keys=2)
+    run(store.take("a", 1.0, 1, 1))
+    run(store.take("b", 1.0, 1, 1))
+    run(store.take("c", 1.0, 1, 1))
+    assert run(store.take("a", 1.0, 1, 1)) == 0
+    assert run(store.take("c", 1.0, 1, 1)) > 0
+
+
+def test_leases_limit_release_and_expire(clock):
+    store = MemoryRateLimitStore()
+    first = run(store.acquire("slots", limit=2, ttl=60))
+    second = run(store.acquire("slots", limit=2, ttl=60))
+    assert first is not None and second is not None and first != second
+    assert run(store.acquire("slots", limit=2, ttl=60)) is None
+    run(store.release("slots", first))
+    assert run(store.acquire("slots", limit=2, ttl=60)) is not None
+    # A leaked lease comes back once its TTL has passed
+    clock.now += 61
+    assert run(store.acquire("slots", limit=2, ttl=60)) is not None
+    assert run(store.acquire("slots", limit=2, ttl=60)) is not None
+
+
+def test_limiter_request_rate_and_token_quota(clock):
+    limiter = RateLimiter(
+        MemoryRateLimitStore(), requests_per_minute=60, burst=2, tokens_per_minute=600, enabled=True
+    )
+    run(limiter.check_request("user:a"))
+    run(limiter.check_request("user:a"))
+    with pytest.raises(RateLimitExceeded) as exc:
+        run(limiter.check_request("user:a"))
+    assert exc.value.retry_after == pytest.approx(1.0)
+    # Other keys have their own buckets
+    run(limiter.check_request("user:b"))
+
+    run(limiter.charge_tokens("user:b", 700))
+    with pytest.raises(RateLimitExceeded, match="token quota"):
+        run(limiter.check_tokens("user:b"))
+    clock.now += 10
+    run(limiter.check_tokens("user:b"))
+    assert limiter.rejections == {"requests": 1, "concurrency": 0, "tokens": 1}
+
+
+def test_limiter_slots(clock):
+    limiter = RateLimiter(MemoryRateLimitStore(), max_concurrent=1, enabled=True)
+    lease = run(limiter.acquire_slot("user:a"))
+    with pytest.raises(RateLimitExceeded, match="concurrent"):
+        run(limiter.acquire_slot("user:a"))
+    run(limiter.release_slot("user:a", lease))
+    assert run(limiter.acquire_slot("user:a")) is not None
+
+
+def test_wait_for_slot_waits_for_a_release_then_times_out():
+    async def scenario():
+        limiter = RateLimiter(MemoryRateLimitStore(), max_concurrent=1, enabled=True)
+        lease = await limiter.acquire_slot("user:a")
+        waiter = asyncio.ensure_future(limiter.wait_for_slot("user:a", timeout=5))
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+        await limiter.release_slot("user:a", lease)
+        assert await waiter is not None
+        with pytest.raises(RateLimitExceeded, match="concurrent"):
+            await limiter.wait_for_slot("user:a", timeout=0.3)
+        return limiter.rejections["concurrency"]
+
+    assert asyncio.run(scenario()) == 1
+
+
+def test_disabled_limiter_admits_everything(clock):
+    limiter = RateLimiter(MemoryRateLimitStore(), burst=0, max_concurrent=0, enabled=False)
+    run(limiter.check_request("user:a"))
+    assert run(limiter.acquire_slot("user:a")) is None
@@ -0,0 +1,159 @@
+# tests/test_router.py
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from llm.backends import LLMBackend
+from llm.router import BackendRouter
+
+
+class FakeBackend(LLMBackend):
+    name = "fake"
+
+    def __init__(self, model: str, delay: float = 0.0, failures: int = 0):
+        super().__init__(model, max_retries=0, retry_backoff=0)
+        self.delay = delay
+        self.failures = failures
+        self.calls = 0
+
+    async def _generate(self, prompt, max_tokens, temperature, stop_after_lines=None):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.calls <= self.failures:
+            raise httpx.ConnectError("unreachable")
+        return f"{self.model}: Hello."
+
+    async def _stream(self, prompt, max_tokens, temperature, stop_after_lines=None):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.calls <= self.failures:
+            raise httpx.ConnectError("unreachable")
+        for i in range(5):
+            yield f"{self.model}: line {i}\n"
+
+
+def test_routing_learns_latency_and_prefers_the_faster_backend():
+    slow, fast = FakeBackend("slow", delay=0.03), FakeBackend("fast", delay=0.001)
+    router = BackendRouter([slow, fast], hedge_delay=0)
+
+    async def scenario():
+        # Both are untried at first, so each gets measured once
+        for _ in range(2):
+            await router.generate("prompt", 10)
+        results = [await router.generate("prompt", 10) for _ in range(5)]
+        return results
+
+    results = asyncio.run(scenario())
+    assert results == ["fast: Hello."] * 5
+    slow_state, fast_state = router.states
+    assert slow_state.latency > fast_state.latency
+    assert slow.calls == 1
+
+
+def test_hedge_wins_and_loser_is_measured():
+    slow, fast = FakeBackend("slow", delay=0.5), FakeBackend("fast", delay=0.01)
+    router = BackendRouter([slow, fast], hedge_delay=0.02)
+    router.states[1].latency = 1.0  # rank the slow backend first
+
+    result = asyncio.run(router.generate("prompt", 10))
+    assert result == "fast: Hello."
+    slow_state, fast_state = router.states
+    # The cancelled loser still recorded how long it had taken so far
+    assert slow_state.latency is not None and slow_state.latency >= 0.02
+    assert [s.in_flight for s in router.states] == [0, 0]
+
+
+def test_failover_and_circuit_breaker():
+    broken, healthy = FakeBackend("broken", failures=100), FakeBackend("healthy")
+    router = BackendRouter([broken, healthy], hedge_delay=0, breaker_failures=2, breaker_cooldown=60)
+    router.states[1].latency = 1.0  # rank the broken backend first
+
+    async def scenario():
+        return [await router.generate("prompt", 10) for _ in range(4)]
+
+    assert asyncio.run(scenario()) == ["healthy: Hello."] * 4
+    broken_state = router.states[0]
+    assert broken_state.snapshot()["circuit"] == "open"
+    # Skipped while open: only the calls that tripped the breaker reached it
+    assert broken.calls == 2
+
+
+def test_half_open_trial_closes_the_circuit():
+    backend = FakeBackend("recovered")
+    router = BackendRouter([backend], hedge_delay=0, breaker_cooldown=5)
+    state = router.states[0]
+    state.opened_at = time.monotonic() - 10
+
+    assert asyncio.run(router.generate("prompt", 10)) == "recovered: Hello."
+    assert state.snapshot()["circuit"] == "closed"
+    assert not state.trial_in_flight
+
+
+def test_all_circuits_open():
+    router = BackendRouter([FakeBackend("a")], breaker_cooldown=60)
+    router.states[0].opened_at = time.monotonic()
+    with pytest.raises(RuntimeError, match="unavailable"):
+        asyncio.run(router.generate("prompt", 10))
+
+
+async def read_lines(stream, count):
+    """Reads count chunks, then closes the stream early like LLM_EARLY_STOP does."""
+    chunks = []
+    async for chunk in stream:
+        chunks.append(chunk)
+        if len(chunks) == count:
+            break
+    await stream.aclose()
+    return chunks
+
+
+def test_stream_retries_before_the_first_chunk():
+    backend = FakeBackend("flaky", failures=1)
+    backend.max_retries = 1
+
+    async def scenario():
+        return [chunk async for chunk in backend.stream("prompt", 10)]
+
+    assert len(asyncio.run(scenario())) == 5
+    assert backend.calls == 2
+
+
+def test_early_closed_stream_counts_as_success():
+    backend = FakeBackend("recovered")
+    router = BackendRouter([backend], hedge_delay=0, breaker_cooldown=5)
+    state = router.states[0]
+    state.opened_at = time.monotonic() - 10
+
+    chunks = asyncio.run(read_lines(router.stream("prompt", 10), 2))
+    assert chunks == ["recovered: line 0\n", "recovered: line 1\n"]
+    assert state.latency is not None
+    assert state.snapshot()["circuit"] == "closed"
+    assert state.in_flight == 0 and not state.trial_in_flight
+
+
+def test_stream_is_hedged_until_the_first_chunk():
+    slow, fast = FakeBackend("slow", delay=0.5), FakeBackend("fast", delay=0.01)
+    router = BackendRouter([slow, fast], hedge_delay=0.02)
+    router.states[1].latency = 1.0  # rank the slow backend first
+
+    chunks = asyncio.run(read_lines(router.stream("prompt", 10), 3))
+    assert all(chunk.startswith("fast:") for chunk in chunks)
+    slow_state, fast_state = router.states
+    assert slow_state.latency is not None and slow_state.latency >= 0.02
+    assert [s.in_flight for s in router.states] == [0, 0]
+
+
+def test_stream_fails_over_before_the_first_chunk():
+    broken, healthy = FakeBackend("broken", failures=100), FakeBackend("healthy")
+    router = BackendRouter([broken, healthy], hedge_delay=0)
+    router.states[1].latency = 1.0
+
+    async def scenario():
+        return [chunk async for chunk in router.stream("prompt", 10)]
+
+    chunks = asyncio.run(scenario())
+    assert chunks[0] == "healthy: line 0\n" and len(chunks) == 5
+    assert router.states[0].error_rate > 0
+    assert router.states[1].error_rate == 0
@@ -0,0 +1,106 @@
+# tests/test_singleflight.py
+import asyncio
+
+import pytest
+
+from llm.singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    async def scenario():
+        flight = SingleFlight()
+        calls = 0
+
+        async def work():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "dialogue"
+
+        results = await asyncio.gather(*(flight.do("key", work) for _ in range(5)))
+        return results, calls, flight.in_flight()
+
+    results, calls, in_flight = asyncio.run(scenario())
+    assert results == ["dialogue"] * 5
+    assert calls == 1
+    assert in_flight == 0
+
+
+def test_exception_reaches_every_caller():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def work():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("upstream down")
+
+        return await asyncio.gather(
+            *(flight.do("key", work) for _ in range(3)), return_exceptions=True
+        )
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(r, RuntimeError) and str(r) == "upstream down" for r in results)
+
+
+def test_cancelled_caller_leaves_the_call_running_for_others():
+    async def scenario():
+        flight = SingleFlight()
+        finished = asyncio.Event()
+
+        async def work():
+            await asyncio.sleep(0.05)
+            finished.set()
+            return "dialogue"
+
+        first = asyncio.ensure_future(flight.do("key", work))
+        second = asyncio.ensure_future(flight.do("key", work))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        result = await second
+        return first.cancelled(), result, finished.is_set()
+
+    assert asyncio.run(scenario()) == (True, "dialogue", True)
+
+
+def test_last_caller_leaving_cancels_the_call():
+    async def scenario():
+        flight = SingleFlight()
+        cancelled = asyncio.Event()
+
+        async def work():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        callers = [asyncio.ensure_future(flight.do("key", work)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0)
+        return cancelled.is_set(), flight.in_flight()
+
+    assert asyncio.run(scenario()) == (True, 0)
+
+
+def test_new_caller_after_cancellation_starts_a_fresh_call():
+    async def scenario():
+        flight = SingleFlight()
+        calls = 0
+
+        async def work():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.02)
+            return calls
+
+        abandoned = asyncio.ensure_future(flight.do("key", work))
+        await asyncio.sleep(0.005)
+        abandoned.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await abandoned
+        return await flight.do("key", work), calls
+
+    assert asyncio.run(scenario()) == (2, 2)
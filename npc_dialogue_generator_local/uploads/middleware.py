@@ -0,0 +1,65 @@
+# uploads/middleware.py
+from typing import Iterable
+
+from starlette.exceptions import HTTPException
+
+from api.responses import dumps
+from uploads.reader import UPLOAD_MAX_BYTES
+
+# Room for the multipart boundaries and form fields around the file itself
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+
+
+class UploadLimitMiddleware:
+    """
+    Plain ASGI middleware that bounds request bodies on upload routes before
+    Starlette parses (and spools) the multipart form.
+
+    A declared Content-Length over the limit is refused without reading any
+    of the body; a chunked body is counted as it arrives and cut off with a
+    413 HTTPException as soon as it passes the limit.
+    """
+
+    def __init__(self, app, paths: Iterable[str], max_bytes: int = UPLOAD_MAX_BYTES + UPLOAD_FORM_OVERHEAD):
+        self.app = app
+        self.paths = frozenset(paths)
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > self.max_bytes:
+                await self._reject(send)
+                return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=413, detail=self._detail())
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    def _detail(self) -> str:
+        return f"Request body exceeds {self.max_bytes} bytes"
+
+    async def _reject(self, send):
+        body = dumps({"detail": self._detail()})
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,79 @@
+# uploads/reader.py
+import json
+import os
+from typing import Any, AsyncIterator
+
+from fastapi import UploadFile
+
+# --- Upload limits ---
+# Starlette spools multipart uploads to a temporary file once they pass 1 MB,
+# so the raw upload never sits in memory. UploadLimitMiddleware stops bodies
+# over UPLOAD_MAX_BYTES before they are spooled; these bound what parsing buffers.
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+# Largest single scene: a whole .json file, or one line of a .jsonl file
+UPLOAD_MAX_SCENE_BYTES = int(os.getenv("UPLOAD_MAX_SCENE_BYTES", str(256 * 1024)))
+UPLOAD_READ_BYTES = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def check_upload_size(file: UploadFile, max_bytes: int = UPLOAD_MAX_BYTES):
+    """Rejects an oversized file from its spooled size, before parsing any of it."""
+    if file.size is not None and file.size > max_bytes:
+        raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+
+
+async def iter_upload_chunks(file: UploadFile, max_bytes: int = UPLOAD_MAX_BYTES) -> AsyncIterator[bytes]:
+    check_upload_size(file, max_bytes)
+    total = 0
+    while True:
+        chunk = await file.read(UPLOAD_READ_BYTES)
+        if not chunk:
+            return
+        total += len(chunk)
+        if total > max_bytes:
+            raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+        yield chunk
+
+
+async def read_json_upload(file: UploadFile, max_bytes: int = UPLOAD_MAX_SCENE_BYTES) -> Any:
+    """Parses a single JSON document; json.loads takes the bytes as-is, no decoded copy."""
+    buffer = bytearray()
+    async for chunk in iter_upload_chunks(file, max_bytes):
+        buffer += chunk
+    return json.loads(buffer)
+
+
+async def iter_jsonl_upload(
+    file: UploadFile,
+    max_bytes: int = UPLOAD_MAX_BYTES,
+    max_line_bytes: int = UPLOAD_MAX_SCENE_BYTES,
+) -> AsyncIterator[bytes]:
+    """
+    Yields each non-blank line of a JSONL upload, undecoded, as soon as its
+    newline has been read. Only the current line is buffered, so memory stays
+    at one chunk plus one scene however large the file is. Lines are left for
+    the caller to json.loads so a malformed scene fails on its own.
+    """
+    line = bytearray()
+    async for chunk in iter_upload_chunks(file, max_bytes):
+        view = memoryview(chunk)
+        start = 0
+        while True:
+            end = chunk.find(b"\n", start)
+            if end < 0:
+                break
+            line += view[start:end]
+            if len(line) > max_line_bytes:
+                raise UploadTooLarge(f"A scene exceeds {max_line_bytes} bytes")
+            if line.strip():
+                yield bytes(line)
+            line.clear()
+            start = end + 1
+        line += view[start:]
+        if len(line) > max_line_bytes:
+            raise UploadTooLarge(f"A scene exceeds {max_line_bytes} bytes")
+    if line.strip():
+        yield bytes(line)
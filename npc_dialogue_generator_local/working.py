@@ -1,22 +1,85 @@
 # main.py
+import asyncio
 import datetime
 import json
+import logging
 import os
-import re
-from typing import List, Literal, Dict, Any, Union
+from contextlib import asynccontextmanager
+from typing import List, Literal, Dict, Any, Optional, Union
 from routers import auth
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, Request, status
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
-import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from llm.backends import LocalTransformersBackend
+from llm.postprocess import clean_dialogue_text
+from llm.local_model import LOCAL_EXECUTION_MODE, resolve_execution_mode
 
 # --- Load Environment Variables ---
 load_dotenv()
 
+logger = logging.getLogger("npc_dialogue.local")
+
+# --- LLM Connection & Configuration ---
+MODEL_NAME = os.getenv("MODEL_NAME", "TinyLlama/TinyLlama-1.1B-Chat-v1.0")
+LLM_MODEL_NAME = os.getenv("LLM_MODEL_DESC", "TinyLlama-1.1B (local)")
+# Load in the background so the process comes up (and /healthz answers) right away
+LOCAL_LOAD_IN_BACKGROUND = os.getenv("LOCAL_LOAD_IN_BACKGROUND", "false").lower() == "true"
+# Tokens generated once after loading to prime allocators, kernels and the prefix cache; 0 disables
+LOCAL_WARMUP_TOKENS = int(os.getenv("LOCAL_WARMUP_TOKENS", "8"))
+
+# Set by the lifespan hook once the model is loaded and warmed up
+backend: Optional[LocalTransformersBackend] = None
+model_status = {"state": "loading", "error": None}
+
+
+async def start_local_model():
+    global backend
+    logger.info("Loading model '%s' to CPU (%s)...", MODEL_NAME, LOCAL_EXECUTION_MODE)
+    # Batches concurrent requests onto one model.generate call on its own thread
+    local_backend = LocalTransformersBackend(
+        MODEL_NAME, prefix=(PROMPT_TEMPLATE_VERSION, SYSTEM_PROMPT), max_retries=0
+    )
+    try:
+        await local_backend.start()
+        if LOCAL_WARMUP_TOKENS > 0:
+            warmup_prompt = create_prompt({
+                "context": "A quiet village square at dawn.",
+                "characters": [{"name": "Ada", "personality": "kind", "occupation": "baker", "relationship": "neighbour"}],
+                "dialogue_length": "Short",
+            })
+            await local_backend.generate(warmup_prompt, LOCAL_WARMUP_TOKENS)
+    except Exception as e:
+        logger.exception("Failed to load the model")
+        model_status.update(state="failed", error=str(e))
+        await local_backend.close()
+        return
+
+    backend = local_backend
+    model_status.update(state="ready", error=None)
+    logger.info("Model loaded and warmed up.")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    loader = None
+    if LOCAL_LOAD_IN_BACKGROUND:
+        loader = asyncio.create_task(start_local_model())
+    else:
+        await start_local_model()
+        if model_status["state"] == "failed":
+            raise RuntimeError(
+                "Failed to load the TinyLlama model. Please check your internet connection, local files, and Hugging Face access."
+            )
+    yield
+    if loader is not None:
+        loader.cancel()
+    if backend is not None:
+        await backend.close()
+
+
 # --- App setup ---
-app = FastAPI(title="NPC Dialogue Generator (no-auth)")
+app = FastAPI(title="NPC Dialogue Generator (no-auth)", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # adjust for production
@@ -46,27 +109,21 @@ class DialogueResponse(BaseModel):
     timestamp: str
 
 
-# --- LLM Connection & Configuration ---
-MODEL_NAME = os.getenv("MODEL_NAME", "TinyLlama/TinyLlama-1.1B-Chat-v1.0")
-LLM_MODEL_NAME = os.getenv("LLM_MODEL_DESC", "TinyLlama-1.1B (local)")
-
 app.include_router(auth.router, tags=["Authentication"], prefix="/auth")
 
-print(f"Loading model '{MODEL_NAME}' to CPU...")
-try:
-    model = AutoModelForCausalLM.from_pretrained(
-        MODEL_NAME, torch_dtype=torch.float32, low_cpu_mem_usage=True
-    )
-    model.to("cpu")
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-    tokenizer.pad_token = tokenizer.eos_token
-    tokenizer.padding_side = "right"
-    print("Model and tokenizer loaded successfully to CPU.")
-except Exception as e:
-    print(f"Failed to load the model: {e}")
-    raise RuntimeError(
-        "Failed to load the TinyLlama model. Please check your internet connection, local files, and Hugging Face access."
-    )
+
+# Static system block shared by every prompt. Bump PROMPT_TEMPLATE_VERSION
+# whenever it changes so the engine's cached prefix KV is rebuilt.
+PROMPT_TEMPLATE_VERSION = "zephyr-v1"
+SYSTEM_PROMPT = (
+    "<|system|>\n"
+    "You are an AI assistant specialized in generating dialogue for video game NPCs. "
+    "Your task is to create a dialogue based on the provided context, character details, and their relationships. "
+    "Ensure the dialogue is consistent with the characters' personalities, occupations, "
+    "and relationships and directly reflects the given context.\n"
+    "**IMPORTANT: The output must be pure conversation, without any action descriptions, stage directions, or text in parentheses. Only provide character names and their spoken lines.**\n"
+    "</s>\n"
+)
 
 
 def create_prompt(data: Dict[str, Any]) -> str:
@@ -81,14 +138,7 @@ def create_prompt(data: Dict[str, Any]) -> str:
     characters_str = characters_str.strip()
 
     prompt_template = (
-        "<|system|>\n"
-        "You are an AI assistant specialized in generating dialogue for video game NPCs. "
-        "Your task is to create a dialogue based on the provided context, character details, and their relationships. "
-        "Ensure the dialogue is consistent with the characters' personalities, occupations, "
-        "and relationships and directly reflects the given context.\n"
-        "**IMPORTANT: The output must be pure conversation, without any action descriptions, stage directions, or text in parentheses. Only provide character names and their spoken lines.**\n"
-        "</s>\n"
-        "<|user|>\n"
+        SYSTEM_PROMPT + "<|user|>\n"
         f"Context: {context}\n\n"
         f"Characters:\n{characters_str}\n\n"
         f"Dialogue Length: {dialogue_length_str}\n\n"
@@ -99,64 +149,10 @@ def create_prompt(data: Dict[str, Any]) -> str:
     return prompt_template
 
 
-def get_llm_response(prompt: str, num_predict: int) -> str:
+async def get_llm_response(prompt: str, num_predict: int) -> str:
     """Generates a response from the locally loaded TinyLlama model."""
-    inputs = tokenizer(prompt, return_tensors="pt", max_length=512, truncation=True)
-    inputs = {k: v.to("cpu") for k, v in inputs.items()}
-
-    with torch.no_grad():
-        output = model.generate(
-            **inputs,
-            max_new_tokens=num_predict,
-            num_return_sequences=1,
-            do_sample=True,
-            temperature=0.75,
-            top_p=0.9,
-            top_k=50,
-            pad_token_id=tokenizer.eos_token_id,
-        )
-
-    generated_text = tokenizer.decode(output[0], skip_special_tokens=False)
-
-    generated_dialogue_cleaned = generated_text.strip()
-    assistant_marker = "<|assistant|>"
-    if assistant_marker in generated_dialogue_cleaned:
-        start_index = generated_dialogue_cleaned.rfind(assistant_marker) + len(
-            assistant_marker
-        )
-        generated_dialogue_cleaned = generated_dialogue_cleaned[start_index:].strip()
-
-    # Remove parenthetical action directions and stray system/user tokens
-    generated_dialogue_cleaned = re.sub(
-        r"\s*\([^()]*\)", "", generated_dialogue_cleaned
-    ).strip()
-    generated_dialogue_cleaned = re.sub(
-        r"(<\|system\|>|</s>|<\|user\|>|<\|assistant\|>|Dialogue:)",
-        "",
-        generated_dialogue_cleaned,
-        flags=re.IGNORECASE,
-    ).strip()
-
-    # Ensure sensible truncation/ellipsis handling
-    if generated_dialogue_cleaned:
-        last_char = generated_dialogue_cleaned[-1]
-        if last_char not in [".", "?", "!", "…"]:
-            last_punc_index = max(
-                generated_dialogue_cleaned.rfind("."),
-                generated_dialogue_cleaned.rfind("?"),
-                generated_dialogue_cleaned.rfind("!"),
-            )
-            if (
-                last_punc_index != -1
-                and (len(generated_dialogue_cleaned) - (last_punc_index + 1)) < 25
-            ):
-                generated_dialogue_cleaned = generated_dialogue_cleaned[
-                    : last_punc_index + 1
-                ]
-            else:
-                generated_dialogue_cleaned += "..."
-
-    return generated_dialogue_cleaned
+    generated_text = await backend.generate(prompt, num_predict)
+    return clean_dialogue_text(generated_text)
 
 
 # --- API Endpoints ---
@@ -167,6 +163,25 @@ async def root():
     }
 
 
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up, whether or not the model has loaded."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: only 200 once the model is loaded and warmed up."""
+    if model_status["state"] != "ready":
+        raise HTTPException(status_code=503, detail=model_status)
+    return {
+        "status": "ready",
+        "model": MODEL_NAME,
+        "mode": resolve_execution_mode(LOCAL_EXECUTION_MODE),
+        "engine": backend.engine.stats(),
+    }
+
+
 @app.post(
     "/generate_dialogue",
     response_model=DialogueResponse,
@@ -177,8 +192,11 @@ async def generate_dialogue(request: Request):
     Public endpoint (no authentication) to generate NPC dialogue.
     Expects JSON: { "context": "...", "characters": [...], "dialogue_length": "Short|Medium|Long" }
     """
+    if backend is None:
+        raise HTTPException(status_code=503, detail="Model is not ready yet")
+
     print(">> Returning dialogue response")
-    
+
     try:
         data = await request.json()
     except json.JSONDecodeError:
@@ -208,7 +226,7 @@ async def generate_dialogue(request: Request):
             )
 
     try:
-        full_response_content = get_llm_response(prompt, llm_num_predict)
+        full_response_content = await get_llm_response(prompt, llm_num_predict)
         timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat() + "Z"
         return DialogueResponse(
             generated_dialogue=full_response_content,